@@ -0,0 +1,312 @@
+import os
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+from history_loader import load_history
+from history_store import STORE_DIR, reconstruct_snapshots, store_contracts
+
+# Journal des anomalies, à la racine du stockage (ignoré par la lecture Parquet)
+EVENTS_FILE = "_events.csv"
+EVENT_COLUMNS = [
+    "time",
+    "contractName",
+    "number",
+    "name",
+    "kind",
+    "event",
+    "since",
+    "detail",
+]
+# Disponibilités dont l'immobilité prolongée signale une station bloquée
+COUNT_COLUMNS = ["bikes", "stands", "mechanicalBikes", "electricalBikes"]
+KINDS = ["stuck", "stale", "disconnected", "closed", "inconsistent"]
+
+# Plusieurs collecteurs (threads) peuvent écrire dans le même journal
+_events_lock = threading.Lock()
+
+
+class AnomalyDetector:
+    """Détection incrémentale des stations anormales, snapshot par snapshot.
+
+    L'état conservé tient en quelques tableaux d'une case par station
+    (dernières disponibilités, instant du dernier changement, durée habituelle
+    sans changement, anomalies en cours) : chaque snapshot est traité en un
+    seul passage vectorisé, sans relire l'historique. Une anomalie produit un
+    événement « start » quand elle apparaît et « end » quand elle disparaît.
+
+    - stuck : disponibilités inchangées depuis plus de `stuck_after` et de
+      `stuck_factor` fois la durée habituelle sans changement de la station
+    - stale : lastUpdate plus ancien que `stale_after`
+    - disconnected : connected est faux
+    - closed : status différent de OPEN
+    - inconsistent : vélos + places libres différent de la capacité
+    """
+
+    def __init__(
+        self,
+        events_file=None,
+        stuck_after="3h",
+        stuck_factor=4.0,
+        stale_after="1h",
+        smoothing=0.2,
+        timezone=None,
+    ):
+        self.events_file = events_file
+        self.stuck_after = pd.Timedelta(stuck_after).total_seconds()
+        self.stuck_factor = stuck_factor
+        self.stale_after = pd.Timedelta(stale_after).total_seconds()
+        self.smoothing = smoothing
+        self.timezone = timezone
+
+        # État par station, aligné sur `numbers` (trié)
+        self.numbers = np.empty(0, dtype=np.int64)
+        self.counts = np.empty((0, len(COUNT_COLUMNS)))
+        self.changed_at = np.empty(0, dtype="datetime64[s]")
+        self.typical = np.empty(0)
+        self.active = np.empty((0, len(KINDS)), dtype=bool)
+        self.since = np.empty((0, len(KINDS)), dtype="datetime64[s]")
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def _positions(self, numbers):
+        """Positions des stations dans l'état (les nouvelles y sont ajoutées)"""
+        new = np.setdiff1d(numbers, self.numbers)
+        if len(new):
+            merged = np.union1d(self.numbers, new)
+            old = np.searchsorted(merged, self.numbers)
+            n = len(merged)
+            grown = {
+                "counts": np.full((n, len(COUNT_COLUMNS)), np.nan),
+                "changed_at": np.full(n, np.datetime64("NaT"), dtype="datetime64[s]"),
+                "typical": np.full(n, np.nan),
+                "active": np.zeros((n, len(KINDS)), dtype=bool),
+                "since": np.full(
+                    (n, len(KINDS)), np.datetime64("NaT"), dtype="datetime64[s]"
+                ),
+            }
+            for name, array in grown.items():
+                array[old] = getattr(self, name)
+                setattr(self, name, array)
+            self.numbers = merged
+        return np.searchsorted(self.numbers, numbers)
+
+    def _utc(self, snapshot_time):
+        """Instant de collecte en UTC (les instants sans fuseau sont ceux de
+        `timezone`, par défaut l'heure locale de la machine de collecte)"""
+        moment = pd.Timestamp(snapshot_time)
+        if moment.tzinfo is None:
+            if self.timezone is None:
+                moment = pd.Timestamp(moment.to_pydatetime().astimezone())
+            else:
+                moment = moment.tz_localize(self.timezone)
+        return moment.tz_convert("UTC").tz_localize(None).to_datetime64()
+
+    def _conditions(self, snapshot, counts, unchanged, typical, now_utc):
+        """Anomalies présentes dans le snapshot (stations × types)"""
+        limit = np.maximum(self.stuck_after, self.stuck_factor * np.nan_to_num(typical))
+        last_update = pd.to_datetime(
+            pd.Series(_column(snapshot, "lastUpdate", None)), format="ISO8601", utc=True
+        )
+        age = now_utc - last_update.dt.tz_localize(None).to_numpy()
+        age = age / np.timedelta64(1, "s")
+        connected = _column(snapshot, "connected", True).astype(str)
+        status = _column(snapshot, "status", "OPEN")
+        capacity = pd.to_numeric(
+            _column(snapshot, "capacity", np.nan), errors="coerce"
+        ).astype("float64")
+        total = counts[:, 0] + counts[:, 1]
+        conditions = {
+            "stuck": unchanged > limit,
+            "stale": age > self.stale_after,
+            "disconnected": np.char.lower(connected) == "false",
+            "closed": pd.notna(status) & (status != "OPEN"),
+            "inconsistent": (total != capacity) & ~np.isnan(total + capacity),
+        }
+        return np.stack([conditions[kind] for kind in KINDS], axis=1)
+
+    def update(self, stations_df, snapshot_time=None):
+        """Traite un snapshot complet ; renvoie (et consigne) les événements"""
+        if snapshot_time is None:
+            snapshot_time = stations_df["snapshot_time"].iloc[0]
+        now = pd.Timestamp(snapshot_time).to_datetime64().astype("datetime64[s]")
+        snapshot = stations_df.drop_duplicates("number", keep="last")
+        positions = self._positions(snapshot["number"].to_numpy(dtype=np.int64))
+        counts = np.stack(
+            [
+                pd.to_numeric(_column(snapshot, c, np.nan), errors="coerce").astype(
+                    "float64"
+                )
+                for c in COUNT_COLUMNS
+            ],
+            axis=1,
+        )
+
+        # Changement des disponibilités depuis le snapshot précédent
+        previous = self.counts[positions]
+        changed_at = self.changed_at[positions]
+        known = ~np.isnat(changed_at)
+        differs = (counts != previous) & ~(np.isnan(counts) & np.isnan(previous))
+        changed = ~known | differs.any(axis=1)
+
+        # Durée habituelle sans changement : moyenne glissante des durées
+        # observées entre deux changements
+        run = (now - changed_at) / np.timedelta64(1, "s")
+        typical = self.typical[positions]
+        ended_run = changed & known
+        smoothed = np.where(
+            np.isnan(typical), run, typical + self.smoothing * (run - typical)
+        )
+        typical = np.where(ended_run, smoothed, typical)
+        changed_at = np.where(changed, now, changed_at)
+        unchanged = (now - changed_at) / np.timedelta64(1, "s")
+
+        conditions = self._conditions(
+            snapshot, counts, unchanged, typical, self._utc(snapshot_time)
+        )
+        active = self.active[positions]
+        since = self.since[positions]
+        events = self._events(
+            snapshot, counts, conditions, active, since, now, unchanged
+        )
+
+        self.counts[positions] = counts
+        self.changed_at[positions] = changed_at
+        self.typical[positions] = typical
+        self.active[positions] = conditions
+        since = np.where(conditions & ~active, now, since)
+        self.since[positions] = np.where(conditions, since, np.datetime64("NaT"))
+
+        if self.events_file and len(events):
+            write_events(events, self.events_file)
+        return events
+
+    def _events(self, snapshot, counts, conditions, active, since, now, unchanged):
+        """Événements de début et de fin d'anomalie entre deux snapshots"""
+        rows, kinds = np.nonzero(conditions != active)
+        if not len(rows):
+            return pd.DataFrame(columns=EVENT_COLUMNS)
+        started = conditions[rows, kinds]
+        events = pd.DataFrame(
+            {
+                "time": pd.Timestamp(now),
+                "contractName": _column(snapshot, "contractName", None)[rows],
+                "number": snapshot["number"].to_numpy()[rows],
+                "name": _column(snapshot, "name", None)[rows],
+                "kind": np.array(KINDS)[kinds],
+                "event": np.where(started, "start", "end"),
+                "since": np.where(started, now, since[rows, kinds]),
+            }
+        )
+        # Début : valeurs utiles au diagnostic ; fin : durée de l'anomalie
+        duration = (now - events["since"].to_numpy()) / np.timedelta64(1, "h")
+        details = {
+            "stuck": [f"inchangée depuis {u / 3600:.1f} h" for u in unchanged[rows]],
+            "stale": [
+                f"lastUpdate={v}" for v in _column(snapshot, "lastUpdate", "")[rows]
+            ],
+            "closed": [f"status={v}" for v in _column(snapshot, "status", "")[rows]],
+            "inconsistent": [
+                f"bikes={b:.0f} stands={s:.0f} capacity={c}"
+                for b, s, c in zip(
+                    counts[rows, 0],
+                    counts[rows, 1],
+                    _column(snapshot, "capacity", "")[rows],
+                )
+            ],
+        }
+        events["detail"] = [
+            details[kind][i] if kind in details else ""
+            for i, kind in enumerate(events["kind"])
+        ]
+        ended = ~started
+        events.loc[ended, "detail"] = [f"durée {d:.1f} h" for d in duration[ended]]
+        return events[EVENT_COLUMNS]
+
+
+def _column(df, name, default):
+    """Valeurs d'une colonne (ou `default` si elle est absente)"""
+    if name in df.columns:
+        return df[name].to_numpy()
+    return np.full(len(df), default, dtype=object)
+
+
+def events_path(store_dir=STORE_DIR):
+    """Chemin du journal des anomalies d'un stockage"""
+    return os.path.join(store_dir, EVENTS_FILE)
+
+
+def write_events(events, path):
+    """Ajoute des événements au journal CSV (créé avec son en-tête)"""
+    with _events_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        new_file = not os.path.isfile(path)
+        events.to_csv(path, mode="a", header=new_file, index=False)
+
+
+def read_events(path=None):
+    """Relit le journal des anomalies"""
+    path = path or events_path()
+    if not os.path.isfile(path):
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    return pd.read_csv(path, parse_dates=["time", "since"])
+
+
+def replay(df, detector):
+    """Rejoue un historique snapshot par snapshot ; renvoie tous les événements"""
+    full = reconstruct_snapshots(df)
+    bounds = np.flatnonzero(np.r_[True, np.diff(full["snapshot_time"]) > 0])
+    events = []
+    for start, end in zip(bounds, np.r_[bounds[1:], len(full)]):
+        snapshot = full.iloc[start:end]
+        events.append(detector.update(snapshot, snapshot["snapshot_time"].iloc[0]))
+    events = [e for e in events if len(e)]
+    if not events:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    return pd.concat(events, ignore_index=True)
+
+
+def main():
+    """Rejoue l'historique dans le détecteur d'anomalies"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--store", default=STORE_DIR, help="stockage ou CSV")
+    parser.add_argument("--contract", default=None)
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--stuck-after", default="3h")
+    parser.add_argument("--stale-after", default="1h")
+    parser.add_argument(
+        "--timezone", default=None, help="fuseau des instants de collecte (ex. UTC)"
+    )
+    parser.add_argument("--output", default=None, help="journal CSV des événements")
+    args = parser.parse_args()
+
+    # Les numéros de stations sont propres à chaque contrat : chaque contrat
+    # du stockage est lu et rejoué dans son propre détecteur
+    contracts = [args.contract]
+    if args.contract is None and os.path.isdir(args.store):
+        contracts = store_contracts(args.store) or [None]
+    events = []
+    for contract in contracts:
+        contract_df = load_history(
+            args.store, args.start, args.end, contract=contract
+        )
+        if contract_df.empty:
+            continue
+        detector = AnomalyDetector(
+            args.output,
+            stuck_after=args.stuck_after,
+            stale_after=args.stale_after,
+            timezone=args.timezone,
+        )
+        events.append(replay(contract_df, detector))
+    events = pd.concat(events, ignore_index=True) if events else pd.DataFrame()
+    counts = events.groupby(["kind", "event"]).size() if len(events) else events
+    print(counts.to_string() if len(events) else "Aucune anomalie")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from history_loader import load_history
+from history_store import STORE_DIR
+
+
+class AsOfIndex:
+    """Index « à l'instant T » : dernier relevé connu de chaque station.
+
+    Les relevés sont triés par (station, instant) et chacun reçoit une clé
+    unique station × durée + instant : la clé cherchée pour une station et un
+    instant donnés se trouve par recherche dichotomique dans un seul tableau
+    trié, pour toutes les stations et tous les instants à la fois.
+    """
+
+    def __init__(self, df, columns=("bikes", "stands"), time_column="snapshot_time"):
+        times = df[time_column].to_numpy().astype("datetime64[us]")
+        order = np.lexsort((times, df["number"].to_numpy()))
+        numbers = df["number"].to_numpy()[order]
+        self.numbers, starts = np.unique(numbers, return_index=True)
+        self.offsets = np.append(starts, len(numbers))
+
+        self.times = times[order]
+        self.origin = self.times.min() if len(self.times) else np.datetime64(0, "us")
+        ticks = (self.times - self.origin).astype(np.int64)
+        self.span = int(ticks.max()) + 1 if len(ticks) else 1
+        stations = np.repeat(np.arange(len(self.numbers)), np.diff(self.offsets))
+        self.keys = stations * self.span + ticks
+        self.values = {
+            c: df[c].to_numpy()[order] for c in columns if c in df.columns
+        }
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def _ticks(self, times):
+        """Instants demandés en microsecondes depuis l'origine, bornés à la
+        durée couverte (-1 : avant le premier relevé)"""
+        times = pd.DatetimeIndex(np.atleast_1d(times)).to_numpy()
+        ticks = (times.astype("datetime64[us]") - self.origin).astype(np.int64)
+        return np.clip(ticks, -1, self.span - 1)
+
+    def lookup(self, times, max_staleness=None):
+        """Position du dernier relevé de chaque station à chaque instant.
+
+        Renvoie un tableau instants × stations (-1 : aucun relevé, ou relevé
+        plus ancien que `max_staleness`).
+        """
+        ticks = self._ticks(times)
+        queries = np.arange(len(self.numbers))[None, :] * self.span + ticks[:, None]
+        positions = np.searchsorted(self.keys, queries, side="right") - 1
+        # Une clé d'une autre station (précédente) signifie : pas de relevé
+        found = positions >= self.offsets[:-1][None, :]
+        if max_staleness is not None:
+            limit = pd.Timedelta(max_staleness).to_timedelta64()
+            at = pd.DatetimeIndex(np.atleast_1d(times)).to_numpy().astype(
+                "datetime64[us]"
+            )
+            age = at[:, None] - self.times[np.maximum(positions, 0)]
+            found &= age <= limit
+        return np.where(found, positions, -1)
+
+    def state_at(self, at, max_staleness=None):
+        """État du réseau à l'instant `at` : une ligne par station connue,
+        indexée par numéro, avec l'instant du relevé utilisé"""
+        positions = self.lookup([at], max_staleness)[0]
+        known = positions >= 0
+        rows = positions[known]
+        state = pd.DataFrame(
+            {c: v[rows] for c, v in self.values.items()},
+            index=pd.Index(self.numbers[known], name="number"),
+        )
+        state["snapshot_time"] = self.times[rows]
+        return state
+
+    def values_at(self, times, column="bikes", max_staleness=None):
+        """Matrice stations × instants des valeurs de `column` (float32, NaN si
+        inconnue ou périmée)"""
+        positions = self.lookup(times, max_staleness)
+        values = self.values[column][np.maximum(positions, 0)].astype("float32")
+        values[positions < 0] = np.nan
+        columns = pd.DatetimeIndex(np.atleast_1d(times), name="snapshot_time")
+        return pd.DataFrame(
+            values.T, index=pd.Index(self.numbers, name="number"), columns=columns
+        )
+
+    def station_at(self, number, at):
+        """Dernier relevé d'une station à l'instant `at` (None si inconnu)"""
+        i = np.searchsorted(self.numbers, number)
+        if i >= len(self.numbers) or self.numbers[i] != number:
+            return None
+        position = self.lookup([at])[0, i]
+        if position < 0:
+            return None
+        result = {c: v[position] for c, v in self.values.items()}
+        result["snapshot_time"] = pd.Timestamp(self.times[position])
+        return result
+
+
+def main():
+    """Affiche l'état du réseau à un instant donné"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("at", help="instant (ex. '2025-06-23 08:30')")
+    parser.add_argument("--store", default=STORE_DIR, help="stockage ou CSV")
+    parser.add_argument(
+        "--max-staleness", default=None, help="âge maximal d'un relevé (ex. 1h)"
+    )
+    parser.add_argument(
+        "--contract",
+        default=os.getenv("JCDECAUX_CONTRACT"),
+        help="contrat lu dans un stockage multi-contrats",
+    )
+    args = parser.parse_args()
+
+    # Seul l'historique antérieur à l'instant demandé est lu
+    at = pd.Timestamp(args.at)
+    start = at - pd.Timedelta(args.max_staleness) if args.max_staleness else None
+    df = load_history(
+        args.store, start, at + pd.Timedelta(microseconds=1),
+        columns=["number", "snapshot_time", "bikes", "stands"],
+        contract=args.contract,
+    )
+    state = AsOfIndex(df).state_at(at, args.max_staleness)
+    print(state.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import json
+import argparse
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+# Rendu sans affichage : à choisir avant tout import de pyplot
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from metrics import configure_metrics, incr, span  # noqa: E402
+from station_analyzer import (  # noqa: E402
+    StationAnalyzer,
+    draw_station_evolution,
+    station_stats,
+)
+
+# Dossier par défaut du rapport
+REPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report")
+
+
+def _init_worker():
+    """Initialise un processus de rendu (backend sans affichage)"""
+    plt.switch_backend("Agg")
+    # Les émojis des titres n'existent pas dans la police par défaut
+    warnings.filterwarnings("ignore", message="Glyph .* missing from font")
+
+
+def render_station(task):
+    """Rend le graphique d'une station et renvoie ses statistiques"""
+    number, name, address, station_data, output_dir, formats = task
+    fig = draw_station_evolution(station_data, name)
+    files = []
+    for fmt in formats:
+        path = os.path.join(output_dir, f"station_{number:05d}.{fmt}")
+        fig.savefig(path, format=fmt)
+        files.append(os.path.basename(path))
+    plt.close(fig)
+
+    result = {
+        "number": number,
+        "name": name,
+        "address": address,
+        "count": len(station_data),
+        "start": str(station_data["snapshot_time"].iloc[0]),
+        "end": str(station_data["snapshot_time"].iloc[-1]),
+    }
+    result.update(station_stats(station_data))
+    result["files"] = files
+    return result
+
+
+def station_tasks(analyzer, output_dir, formats):
+    """Une tâche de rendu par station de l'analyseur"""
+    for _, station in analyzer.index.summary.iterrows():
+        number = int(station["number"])
+        yield (
+            number,
+            station.get("name", str(number)),
+            station.get("address", ""),
+            analyzer.index.station_data(number),
+            output_dir,
+            formats,
+        )
+
+
+def run_report(
+    data_file,
+    output_dir=REPORT_DIR,
+    stations=None,
+    start=None,
+    end=None,
+    formats=("png",),
+    workers=None,
+    contract=None,
+):
+    """Rend toutes les stations (ou celles demandées) dans `output_dir`.
+
+    Les graphiques sont répartis sur un pool de processus ; le récapitulatif
+    des statistiques est écrit dans summary.json et summary.csv. Une source
+    absente lève FileNotFoundError (pas de données de démonstration).
+    """
+    analyzer = StationAnalyzer(
+        data_file,
+        start=start,
+        end=end,
+        stations=stations,
+        contract=contract,
+        demo_fallback=False,
+    )
+    if analyzer.index is None:
+        return []
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = station_tasks(analyzer, output_dir, tuple(formats))
+    with span("render", formats=",".join(formats)):
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker
+        ) as pool:
+            results = list(pool.map(render_station, tasks, chunksize=8))
+    incr("stations_rendered", len(results))
+
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    summary = pd.DataFrame(results)
+    summary["files"] = summary["files"].str.join(";")
+    summary.to_csv(os.path.join(output_dir, "summary.csv"), index=False)
+    return results
+
+
+def main():
+    """Rapport non interactif : graphiques et statistiques de chaque station"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "data_file",
+        nargs="?",
+        default="stations_history",
+        help="dossier de stockage ou CSV historique",
+    )
+    parser.add_argument("--output-dir", default=REPORT_DIR)
+    parser.add_argument(
+        "--stations",
+        type=lambda s: [int(n) for n in s.split(",")],
+        default=None,
+        help="numéros de stations séparés par des virgules (toutes par défaut)",
+    )
+    parser.add_argument("--start", default=None, help="début de la période")
+    parser.add_argument("--end", default=None, help="fin (exclue) de la période")
+    parser.add_argument(
+        "--contract",
+        default=os.getenv("JCDECAUX_CONTRACT"),
+        help="contrat lu dans un stockage multi-contrats",
+    )
+    parser.add_argument(
+        "--format", nargs="+", default=["png"], choices=["png", "svg", "pdf"]
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="processus de rendu (nb de cœurs)"
+    )
+    args = parser.parse_args()
+    if not os.path.exists(args.data_file):
+        parser.error(f"source introuvable : {args.data_file}")
+    configure_metrics()
+
+    results = run_report(
+        args.data_file,
+        args.output_dir,
+        args.stations,
+        args.start,
+        args.end,
+        args.format,
+        args.workers,
+        args.contract,
+    )
+    print(f"{len(results)} stations rendues dans {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
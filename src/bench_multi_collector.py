@@ -0,0 +1,71 @@
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from multi_collector import ContractPoller, collect_round
+from stub_jcdecaux import start_stub_server
+
+
+def run_benchmark(contracts=40, stations=200, workers=(1, 4, 16), rounds=3, seed=0):
+    """Mesure le débit de collecte contre un serveur simulé multi-contrats"""
+    rng = random.Random(seed)
+    names = [f"city{i:02d}" for i in range(contracts)]
+    # Latences variées : la plupart rapides, quelques contrats très lents
+    latencies = {
+        name: rng.choice([0.02, 0.05, 0.1, 0.2]) if i % 10 else 1.0
+        for i, name in enumerate(names)
+    }
+    server, url = start_stub_server(
+        contracts=names, latencies=latencies, stations=stations, change_rate=0.1
+    )
+
+    results = []
+    try:
+        for n_workers in workers:
+            with tempfile.TemporaryDirectory() as store_dir:
+                pollers = [ContractPoller(name, timeout=30) for name in names]
+                durations = []
+                fast_delays = []
+                for _ in range(rounds):
+                    start = time.monotonic()
+                    round_results = collect_round(pollers, store_dir, url, n_workers)
+                    durations.append(time.monotonic() - start)
+                    # Délai entre requête et horodatage pour les contrats rapides
+                    fast_delays += [
+                        r["duration"]
+                        for r in round_results
+                        if latencies[r["contract"]] < 1.0
+                    ]
+
+            results.append(
+                {
+                    "workers": n_workers,
+                    "contracts": contracts,
+                    "stations_per_contract": stations,
+                    "round_seconds": round(min(durations), 3),
+                    "contracts_per_second": round(contracts / min(durations), 1),
+                    "fast_contract_max_delay": round(max(fast_delays), 3),
+                }
+            )
+    finally:
+        server.shutdown()
+    return results
+
+
+def main():
+    """Benchmark de débit de la collecte multi-contrats"""
+    parser = argparse.ArgumentParser(description="Benchmark multi_collector.py")
+    parser.add_argument("--contracts", type=int, default=40)
+    parser.add_argument("--stations", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.contracts, args.stations, args.workers, args.rounds)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import gc
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+import folium
+import pandas as pd
+
+from compact_map import build_payload, save_compact_map
+from history_loader import load_history
+from map_colors import build_color_lut, color_bounds
+from map_folium_slider import add_geojson_layer, build_geojson
+from resampling import resample_stations, station_metadata
+from stand_decoder import decode_nested
+from station_analyzer import StationAnalyzer
+from synthetic_history import generate_history, write_store
+
+# Tailles par défaut : stations × snapshots (5 min : 288 par jour)
+SIZES = ["50x288", "400x288", "400x2016"]
+
+
+def parse_size(size):
+    """'400x2016' -> (400, 2016)"""
+    stations, snapshots = size.lower().split("x")
+    return int(stations), int(snapshots)
+
+
+def measure(stage, func, *args, memory=True, **kwargs):
+    """Exécute une étape ; renvoie (résultat, mesure de durée et de mémoire).
+
+    Le pic mémoire est celui suivi par tracemalloc (allocations Python et
+    numpy) ; les tampons Arrow n'y figurent pas.
+    """
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    record = {"stage": stage, "seconds": round(seconds, 4)}
+    if memory:
+        record["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+        tracemalloc.stop()
+    return result, record
+
+
+def analyzer_queries(analyzer, numbers):
+    """Requêtes typiques de l'analyseur : récapitulatif puis historiques"""
+    analyzer.index.summary.round(1)
+    return [len(analyzer.index.station_data(n)) for n in numbers]
+
+
+def save_geojson_map(gj, path, freq):
+    m = folium.Map(location=[43.6045, 1.4440], zoom_start=13)
+    add_geojson_layer(m, gj, freq)
+    m.save(path)
+
+
+def save_compact(payload, path):
+    m = folium.Map(location=[43.6045, 1.4440], zoom_start=13)
+    save_compact_map(m, payload, path, external=True)
+
+
+def bench_size(stations, snapshots, workdir, freq="15min", memory=True, seed=0):
+    """Mesure chaque étape de la chaîne pour une taille d'historique"""
+    records = []
+
+    def step(stage, func, *args, **kwargs):
+        result, record = measure(stage, func, *args, memory=memory, **kwargs)
+        records.append(record)
+        return result
+
+    csv_file = os.path.join(workdir, "history.csv")
+    store_dir = os.path.join(workdir, "store")
+    raw = step("generate", generate_history, stations, snapshots, seed=seed)
+    step("csv_write", raw.to_csv, csv_file, index=False)
+    del raw
+
+    raw = step("load_csv", pd.read_csv, csv_file)
+    df = step("decode", decode_nested, raw)
+    del raw
+    df["snapshot_time"] = pd.to_datetime(df["snapshot_time"])
+    step("store_write", write_store, df, store_dir)
+    del df
+
+    df = step("load_store", load_history, store_dir)
+    bikes = step("resample", resample_stations, df, "bikes", freq)
+    metadata = station_metadata(df)
+    del df
+    vmin, vmax = color_bounds(bikes)
+    lut = build_color_lut()
+
+    gj = step("geojson", build_geojson, bikes, metadata, vmin, vmax, lut)
+    step("html_geojson", save_geojson_map, gj, os.path.join(workdir, "g.html"), freq)
+    del gj
+    payload = step("payload", build_payload, bikes, metadata, vmin, vmax)
+    step("html_compact", save_compact, payload, os.path.join(workdir, "c.html"))
+    del payload
+
+    analyzer = step("analyzer_load", StationAnalyzer, store_dir)
+    numbers = random.Random(seed).sample(range(1, stations + 1), min(stations, 50))
+    step("analyzer_queries", analyzer_queries, analyzer, numbers)
+
+    for record in records:
+        record.update({"stations": stations, "snapshots": snapshots})
+    return records
+
+
+def git_revision():
+    """Révision courante du dépôt (None hors d'un dépôt git)"""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except OSError:
+        return None
+    return output.stdout.strip() or None
+
+
+def compare(results, baseline):
+    """Ajoute à chaque mesure le rapport de durée avec une exécution de
+    référence (même taille, même étape)"""
+    reference = {
+        (r["stations"], r["snapshots"], r["stage"]): r for r in baseline["results"]
+    }
+    for record in results:
+        key = (record["stations"], record["snapshots"], record["stage"])
+        if key in reference and reference[key]["seconds"] > 0:
+            record["baseline_seconds"] = reference[key]["seconds"]
+            record["ratio"] = round(record["seconds"] / reference[key]["seconds"], 2)
+    return results
+
+
+def run_benchmark(sizes=SIZES, freq="15min", memory=True, seed=0):
+    """Mesure toutes les étapes pour chaque taille d'historique"""
+    results = []
+    for size in sizes:
+        stations, snapshots = parse_size(size)
+        with tempfile.TemporaryDirectory() as workdir:
+            results += bench_size(stations, snapshots, workdir, freq, memory, seed)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "freq": freq,
+        "results": results,
+    }
+
+
+def main():
+    """Benchmark de bout en bout sur des historiques synthétiques"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--sizes", nargs="+", default=SIZES, help="tailles STATIONSxSNAPSHOTS"
+    )
+    parser.add_argument("--freq", default="15min", help="pas de la grille de la carte")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="sans suivi mémoire (plus rapide)"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="résultats JSON d'une version de référence")
+    parser.add_argument("--output", help="fichier JSON des résultats")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sizes, args.freq, not args.no_memory, args.seed)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(report["results"], json.load(f))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
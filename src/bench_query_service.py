@@ -0,0 +1,120 @@
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+import requests
+
+from query_service import QueryService, start_query_server
+from synthetic_history import generate_history, write_store
+
+
+def request_mix(stations, start, days, rng):
+    """Requête typique d'un tableau de bord (chemin, paramètres)"""
+    kind = rng.random()
+    if kind < 0.4:
+        return "/current", {}
+    if kind < 0.6:
+        return "/stations", {}
+    number = rng.randint(1, stations)
+    if kind < 0.8:
+        return f"/stations/{number}", {}
+    if kind < 0.9:
+        return f"/stations/{number}/stats", {}
+    # Instants au quart d'heure : les tableaux de bord demandent les mêmes
+    minutes = rng.randrange(0, days * 24 * 60, 15)
+    return "/asof", {"at": str(start + np.timedelta64(minutes, "m"))}
+
+
+def load_test(url, clients=8, duration=10.0, stations=400, start=None, days=1, seed=0):
+    """Interroge le service depuis `clients` threads pendant `duration` s"""
+    start = np.datetime64(start or "2025-06-02", "m")
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(i):
+        rng = random.Random(seed + i)
+        local, failed = [], 0
+        with requests.Session() as session:
+            while time.monotonic() < deadline:
+                path, params = request_mix(stations, start, days, rng)
+                begin = time.perf_counter()
+                response = session.get(url + path, params=params, timeout=30)
+                local.append(time.perf_counter() - begin)
+                failed += response.status_code != 200
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    begin = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - begin
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": int(sum(errors)),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def run_benchmark(stations=400, snapshots=288, clients=(1, 8), duration=10.0):
+    """Mesure le débit d'une instance locale, avec et sans cache"""
+    results = []
+    with tempfile.TemporaryDirectory() as store_dir:
+        history = generate_history(stations, snapshots, nested=False)
+        write_store(history, store_dir)
+        start = history["snapshot_time"].min()
+        days = max(1, snapshots // 288)
+
+        for ttl in (5.0, 0.0):
+            service = QueryService(store_dir, cache_ttl=ttl, reload_interval=0)
+            server, url = start_query_server(service)
+            try:
+                for n in clients:
+                    result = load_test(url, n, duration, stations, start, days)
+                    result.update(cache_ttl=ttl, hits=service.cache.hits)
+                    results.append(result)
+            finally:
+                server.shutdown()
+                server.server_close()
+    return results
+
+
+def main():
+    """Test de charge du service de requêtes (requêtes par seconde)"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--url", default=None, help="instance existante (sinon instance locale)"
+    )
+    parser.add_argument("--stations", type=int, default=400)
+    parser.add_argument("--snapshots", type=int, default=288)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--duration", type=float, default=10.0, help="secondes")
+    args = parser.parse_args()
+
+    if args.url:
+        results = [
+            load_test(args.url, n, args.duration, args.stations) for n in args.clients
+        ]
+    else:
+        results = run_benchmark(
+            args.stations, args.snapshots, args.clients, args.duration
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
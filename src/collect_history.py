@@ -1,34 +1,278 @@
 import os
+import time
+import random
+import argparse
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 from datetime import datetime
 
+from anomaly_detector import AnomalyDetector, events_path
+from metrics import configure_metrics, export_metrics, incr, set_gauge, span
+from history_store import (
+    STORE_DIR,
+    UNKNOWN,
+    record_snapshot,
+    to_schema,
+    write_table,
+)
+from snapshot_log import SnapshotLog, log_dir
+from stand_decoder import decode_nested
+from station_profiles import StationProfiles, profiles_path
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Charger les variables d'environnement
 load_dotenv()
 API_KEY = os.getenv("JCDECAUX_API_KEY")
 CONTRACT = os.getenv("JCDECAUX_CONTRACT")
+API_URL = os.getenv("JCDECAUX_API_URL", "https://api.jcdecaux.com/vls/v3/stations")
+
+# Colonnes dont le changement déclenche l'écriture d'une station
+CHANGE_COLUMNS = [
+    "lastUpdate",
+    "status",
+    "connected",
+    "bikes",
+    "stands",
+    "mechanicalBikes",
+    "electricalBikes",
+    "capacity",
+]
+
+
+def create_session():
+    """Crée une session HTTP persistante (connexions réutilisées)"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_stations(session, contract=CONTRACT, api_url=API_URL, timeout=10):
+    """Récupère l'état de toutes les stations d'un contrat"""
+    with span("fetch", contract=contract):
+        response = session.get(
+            api_url, params={"contract": contract, "apiKey": API_KEY}, timeout=timeout
+        )
+        response.raise_for_status()
+    incr("fetch_bytes", len(response.content), contract=contract)
+    with span("parse_json", contract=contract):
+        return response.json()
+
+
+class ChangeTracker:
+    """Mémorise le dernier état écrit de chaque station pour n'écrire que les
+    stations modifiées"""
+
+    def __init__(self):
+        self.last_state = None
+        self.last_day = None
+
+    def filter_changed(self, flat_df):
+        """Renvoie les lignes dont lastUpdate ou les disponibilités ont changé"""
+        state = flat_df.set_index("number")[CHANGE_COLUMNS].astype(str)
+        day = str(flat_df["snapshot_time"].iloc[0])[:10]
+
+        # Snapshot complet au démarrage et à chaque nouvelle journée, pour que
+        # chaque partition se suffise à elle-même
+        if self.last_state is None or day != self.last_day:
+            changed = pd.Series(True, index=state.index)
+        else:
+            previous = self.last_state.reindex(state.index)
+            changed = (state != previous).any(axis=1)
+
+        self.last_state = state
+        self.last_day = day
+        return flat_df[changed.to_numpy()]
+
+    def reset(self):
+        """Oublie le dernier état : le prochain snapshot sera écrit en entier
+        (après un échec, les changements filtrés n'ont peut-être pas été
+        écrits)"""
+        self.last_state = None
+        self.last_day = None
+
+
+def collect_snapshot(
+    session,
+    store_dir=STORE_DIR,
+    tracker=None,
+    detector=None,
+    log=None,
+    profiles=None,
+    **fetch_kwargs,
+):
+    """Effectue un snapshot et l'enregistre ; renvoie (stations, lignes écrites).
+
+    Le snapshot complet (avant filtrage des changements) est aussi passé au
+    détecteur d'anomalies et aux profils des stations éventuels, et les lignes
+    écrites au journal des snapshots éventuel (voir snapshot_log.py).
+    """
+    contract = fetch_kwargs.get("contract", CONTRACT)
+    with span("snapshot", contract=contract):
+        stations = fetch_stations(session, **fetch_kwargs)
+
+        # Transformation en DataFrame à plat
+        with span("decode", contract=contract):
+            stations_df = decode_nested(pd.DataFrame(stations))
+
+        # Ajout du timestamp
+        snapshot_time = datetime.now().isoformat()
+        stations_df["snapshot_time"] = snapshot_time
+
+        rows = stations_df if tracker is None else tracker.filter_changed(stations_df)
+        if detector is not None:
+            with span("anomalies", contract=contract):
+                detector.update(stations_df, snapshot_time)
+        if profiles is not None:
+            with span("profiles", contract=contract):
+                profiles.update(stations_df)
+
+        # Enregistrement dans le stockage partitionné par contrat et par jour
+        with span("write", contract=contract):
+            table = to_schema(rows)
+            write_table(table, store_dir)
+            if log is not None:
+                log.append(table, snapshot_time)
+            partition = (
+                stations_df["contractName"].iloc[0] if len(stations_df) else UNKNOWN
+            )
+            record_snapshot(
+                store_dir, snapshot_time, len(stations_df), len(rows), partition
+            )
+
+    # Fraîcheur des données (objectifs de service) : instant de la collecte et
+    # dernière mise à jour annoncée par les stations
+    incr("stations_fetched", len(stations_df), contract=contract)
+    incr("rows_written", len(rows), contract=contract)
+    set_gauge("last_snapshot_timestamp_seconds", time.time(), contract=contract)
+    if len(stations_df):
+        last_update = pd.to_datetime(
+            stations_df["lastUpdate"], format="ISO8601", utc=True
+        ).max()
+        if pd.notna(last_update):
+            set_gauge(
+                "last_station_update_timestamp_seconds",
+                last_update.timestamp(),
+                contract=contract,
+            )
+    return len(stations_df), len(rows)
+
+
+def describe_error(exc):
+    """Message d'une erreur de collecte (type compris : une KeyError seule
+    n'affiche que la clé)"""
+    if isinstance(exc, requests.RequestException):
+        return str(exc)
+    return f"{type(exc).__name__} : {exc}"
+
+
+def next_delay(interval, jitter, failures, backoff_max):
+    """Délai avant la prochaine collecte (intervalle + gigue, ou backoff)"""
+    if failures:
+        delay = min(backoff_max, interval * 2**failures)
+    else:
+        delay = interval
+    return max(0.0, delay + random.uniform(-jitter, jitter))
+
+
+def run_daemon(
+    interval=300,
+    jitter=15,
+    backoff_max=3600,
+    store_dir=STORE_DIR,
+    anomalies=True,
+    log=True,
+    **fetch_kwargs,
+):
+    """Collecte en continu avec session persistante et écriture des changements.
+
+    Avec anomalies=True, les anomalies détectées sont consignées dans
+    le journal des événements du stockage. Avec log=True, chaque snapshot est
+    aussi ajouté au journal des snapshots suivi par les consommateurs. Les
+    profils des stations (voir station_profiles.py) sont tenus à jour.
+    """
+    session = create_session()
+    tracker = ChangeTracker()
+    detector = AnomalyDetector(events_path(store_dir)) if anomalies else None
+    contract = fetch_kwargs.get("contract", CONTRACT) or UNKNOWN
+    snapshots = SnapshotLog(log_dir(store_dir, contract)) if log else None
+    profiles = StationProfiles.load(profiles_path(store_dir, contract))
+    failures = 0
+
+    print(f"🚲 Collecte toutes les {interval}s (gigue ±{jitter}s) -> {store_dir}")
+    while True:
+        try:
+            total, written = collect_snapshot(
+                session,
+                store_dir,
+                tracker,
+                detector,
+                snapshots,
+                profiles,
+                **fetch_kwargs,
+            )
+            failures = 0
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"Snapshot enregistré à {now} ({written}/{total} stations modifiées)")
+        except Exception as exc:
+            # Toute erreur (réseau, réponse inattendue, écriture) est consignée
+            # sans arrêter le démon
+            failures += 1
+            tracker.reset()
+            incr("collect_failures", contract=fetch_kwargs.get("contract", CONTRACT))
+            print(f"❌ Échec de la collecte ({failures}) : {describe_error(exc)}")
+
+        export_metrics()
+        time.sleep(next_delay(interval, jitter, failures, backoff_max))
+
 
-# Récupération des données des stations
-base_url = "https://api.jcdecaux.com/vls/v3/stations"
-params = f"?contract={CONTRACT}&apiKey={API_KEY}"
-url = base_url + params
-response = requests.get(url)
-stations = response.json()
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Collecte des stations JCDecaux")
+    parser.add_argument(
+        "--daemon", action="store_true", help="collecte en continu (mode démon)"
+    )
+    parser.add_argument("--interval", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=15)
+    parser.add_argument("--backoff-max", type=float, default=3600)
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--contract", default=CONTRACT)
+    parser.add_argument(
+        "--no-anomalies", action="store_true", help="sans détection des anomalies"
+    )
+    parser.add_argument(
+        "--no-log", action="store_true", help="sans journal des snapshots"
+    )
+    args = parser.parse_args()
+    configure_metrics()
 
-# Transformation en DataFrame
-stations_df = pd.DataFrame(stations)
+    fetch_kwargs = {"api_url": args.api_url, "contract": args.contract}
+    if args.daemon:
+        try:
+            run_daemon(
+                args.interval,
+                args.jitter,
+                args.backoff_max,
+                args.store,
+                not args.no_anomalies,
+                not args.no_log,
+                **fetch_kwargs,
+            )
+        except KeyboardInterrupt:
+            print("\n👋 Arrêt de la collecte")
+        return
 
-# Ajout du timestamp
-stations_df["snapshot_time"] = datetime.now().isoformat()
+    # Les profils des stations sont tenus à jour comme en mode démon
+    contract = args.contract or UNKNOWN
+    profiles = StationProfiles.load(profiles_path(args.store, contract))
+    collect_snapshot(create_session(), args.store, profiles=profiles, **fetch_kwargs)
+    print(f"Snapshot enregistré à {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-# Enregistrement dans le CSV (ajout ou création)
-history_file = os.path.join(BASE_DIR, "stations_history.csv")
-if not os.path.isfile(history_file):
-    stations_df.to_csv(history_file, index=False)
-else:
-    stations_df.to_csv(history_file, mode="a", header=False, index=False)
 
-print(f"Snapshot enregistré à {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+if __name__ == "__main__":
+    main()
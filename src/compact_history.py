@@ -0,0 +1,250 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from history_loader import iter_source
+
+# Champs propres à une station : stockés une seule fois par station
+STATION_COLUMNS = [
+    "contractName",
+    "name",
+    "address",
+    "latitude",
+    "longitude",
+    "banking",
+    "bonus",
+    "overflow",
+]
+# Colonnes brutes imbriquées, inutiles une fois décodées
+RAW_COLUMNS = ["position", "totalStands", "mainStands", "overflowStands", "shape"]
+# Horodatages stockés en secondes depuis l'instant de référence (fuseau d'origine)
+TIME_COLUMNS = {"snapshot_time": None, "lastUpdate": "UTC"}
+BOOL_COLUMNS = ["connected"]
+
+
+def _small_int(series):
+    """Plus petit type entier pouvant contenir les valeurs (nullable si besoin)"""
+    values = pd.to_numeric(series, errors="coerce")
+    valid = values.dropna()
+    low, high = (valid.min(), valid.max()) if len(valid) else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            break
+    else:
+        dtype = np.int64
+    if len(valid) < len(values):
+        return values.astype(pd.api.types.pandas_dtype(dtype.__name__.capitalize()))
+    return values.astype(dtype)
+
+
+def _is_integral(series):
+    values = series.dropna().to_numpy(dtype="float64")
+    return bool(np.all(values == np.round(values)))
+
+
+def _to_naive(series, tz):
+    """Horodatages sans fuseau (ramenés à `tz` s'ils en ont un)"""
+    times = pd.to_datetime(series, utc=tz is not None)
+    if tz is not None:
+        times = times.dt.tz_convert(tz).dt.tz_localize(None)
+    return times
+
+
+class CompactHistory:
+    """Historique des stations sous une forme compacte en mémoire.
+
+    - `rows` : une ligne par (station, instant) avec des types entiers réduits,
+      les horodatages en secondes (int32) depuis `base` et le statut en
+      catégorie ;
+    - `stations` : métadonnées (nom, adresse, coordonnées, ...) stockées une
+      seule fois par station, indexées par numéro.
+
+    Les colonnes brutes imbriquées (position, totalStands, ...) sont écartées.
+    """
+
+    def __init__(self, rows, stations, base):
+        self.rows = rows
+        self.stations = stations
+        self.base = base
+
+    @classmethod
+    def from_frame(cls, df):
+        """Compacte un historique déjà chargé (colonnes décodées)"""
+        return cls.from_chunks([df])
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Compacte un historique bloc par bloc : seul le bloc courant est
+        gardé sous sa forme d'origine"""
+        base = None
+        parts, metadata = [], []
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            if base is None:
+                times = pd.to_datetime(chunk["snapshot_time"])
+                base = times.min().floor("D")
+            rows, stations = cls._compact_chunk(chunk, base)
+            parts.append(rows)
+            metadata.append(stations)
+
+        if not parts:
+            return cls(pd.DataFrame(), pd.DataFrame(), None)
+        rows = cls._concat(parts)
+        order = np.lexsort((rows["number"].to_numpy(), rows["snapshot_time"]))
+        rows = rows.iloc[order].reset_index(drop=True)
+
+        # Dernières métadonnées connues de chaque station
+        stations = cls._concat(metadata)
+        stations = stations.sort_values("_seen", kind="stable")
+        stations = stations.groupby("number").last().drop(columns="_seen")
+        return cls(rows, stations, base)
+
+    def append(self, chunk):
+        """Historique complété d'un bloc de relevés postérieurs aux relevés
+        déjà compactés (nouvel objet : celui-ci reste inchangé). Seul le bloc
+        est compacté et trié ; les relevés existants sont repris tels quels."""
+        if chunk.empty:
+            return self
+        if self.base is None:
+            return self.from_chunks([chunk])
+        rows, stations = self._compact_chunk(chunk, self.base)
+        order = np.lexsort((rows["number"].to_numpy(), rows["snapshot_time"]))
+        rows = self._concat([self.rows, rows.iloc[order]])
+
+        stations = stations.sort_values("_seen", kind="stable")
+        stations = stations.groupby("number").last().drop(columns="_seen")
+        stations = pd.concat([self.stations, stations]).groupby(level=0).last()
+        return CompactHistory(rows, stations, self.base)
+
+    @staticmethod
+    def _compact_chunk(chunk, base):
+        """Compacte un bloc : (lignes compactes, métadonnées du bloc)"""
+        chunk = chunk.drop(columns=[c for c in RAW_COLUMNS if c in chunk.columns])
+        rows = pd.DataFrame(index=range(len(chunk)))
+        rows["number"] = _small_int(chunk["number"]).to_numpy()
+
+        for col, tz in TIME_COLUMNS.items():
+            if col in chunk.columns:
+                offsets = (_to_naive(chunk[col], tz) - base).dt.total_seconds()
+                dtype = "int32" if offsets.notna().all() else "Int32"
+                rows[col] = offsets.round().astype(dtype).to_numpy()
+
+        station_cols = [c for c in STATION_COLUMNS if c in chunk.columns]
+        for col in chunk.columns:
+            if col in rows.columns or col in station_cols:
+                continue
+            values = chunk[col]
+            if col in BOOL_COLUMNS:
+                rows[col] = values.astype("boolean").to_numpy()
+            elif pd.api.types.is_bool_dtype(values):
+                rows[col] = values.to_numpy()
+            elif pd.api.types.is_numeric_dtype(values):
+                if _is_integral(values):
+                    rows[col] = _small_int(values).to_numpy()
+                else:
+                    rows[col] = values.astype("float32").to_numpy()
+            else:
+                rows[col] = pd.Categorical(values)
+
+        stations = chunk[["number"] + station_cols].copy()
+        stations["_seen"] = rows["snapshot_time"].to_numpy()
+        stations = stations.drop_duplicates("number", keep="last")
+        return rows, stations
+
+    @staticmethod
+    def _concat(parts):
+        """Concatène des blocs en gardant les colonnes catégorielles compactes"""
+        if len(parts) == 1:
+            return parts[0].reset_index(drop=True)
+        result = pd.concat(parts, ignore_index=True)
+        for col in parts[0].columns:
+            if isinstance(parts[0][col].dtype, pd.CategoricalDtype):
+                result[col] = union_categoricals([p[col] for p in parts])
+        return result
+
+    @property
+    def empty(self):
+        return self.rows.empty
+
+    def __len__(self):
+        return len(self.rows)
+
+    def timestamps(self, offsets, column="snapshot_time"):
+        """Horodatages complets correspondant à des décalages en secondes"""
+        times = self.base + pd.to_timedelta(np.asarray(offsets), unit="s")
+        tz = TIME_COLUMNS.get(column)
+        return times.tz_localize(tz) if tz is not None else times
+
+    def to_frame(self, columns=None):
+        """DataFrame classique (horodatages et métadonnées restitués)"""
+        if columns is None:
+            columns = list(self.rows.columns) + list(self.stations.columns)
+        frame = {}
+        for col in columns:
+            if col in TIME_COLUMNS and col in self.rows:
+                frame[col] = self.timestamps(self.rows[col], col)
+            elif col in self.rows:
+                frame[col] = self.rows[col].array
+            else:
+                frame[col] = self.stations[col].reindex(self.rows["number"]).array
+        return pd.DataFrame(frame)
+
+    def memory_usage(self):
+        """Mémoire occupée par colonne (octets), métadonnées comprises"""
+        usage = [
+            (col, str(self.rows[col].dtype), self.rows[col].memory_usage(
+                index=False, deep=True))
+            for col in self.rows.columns
+        ]
+        usage.append(
+            ("stations.number", str(self.stations.index.dtype),
+             self.stations.index.memory_usage(deep=True))
+        )
+        usage += [
+            ("stations." + col, str(self.stations[col].dtype),
+             self.stations[col].memory_usage(index=False, deep=True))
+            for col in self.stations.columns
+        ]
+        return pd.DataFrame(usage, columns=["column", "dtype", "bytes"]).set_index(
+            "column"
+        )
+
+
+def format_memory(usage):
+    """Rapport lisible de l'occupation mémoire par colonne"""
+    lines = [f"{'colonne':<28} {'type':<16} {'Mo':>10}"]
+    for col, row in usage.iterrows():
+        lines.append(f"{col:<28} {row['dtype']:<16} {row['bytes'] / 1e6:>10.2f}")
+    lines.append(f"{'total':<28} {'':<16} {usage['bytes'].sum() / 1e6:>10.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    """Affiche l'occupation mémoire d'un historique, avant et après compactage"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("source", help="dossier de stockage ou CSV historique")
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument(
+        "--contract",
+        default=os.getenv("JCDECAUX_CONTRACT"),
+        help="contrat lu dans un stockage multi-contrats",
+    )
+    args = parser.parse_args()
+
+    chunks = list(
+        iter_source(args.source, args.start, args.end, contract=args.contract)
+    )
+    default = sum(c.memory_usage(index=False, deep=True).sum() for c in chunks)
+    history = CompactHistory.from_chunks(chunks)
+    print(format_memory(history.memory_usage()))
+    print(f"\nTypes pandas par défaut : {default / 1e6:.2f} Mo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import os
+import gzip
+import json
+
+import folium
+import numpy as np
+
+from map_colors import build_color_lut
+
+# Valeur utilisée dans les tableaux pour une station sans donnée à cet instant
+MISSING = -1
+
+
+def build_payload(bikes, metadata, vmin, vmax, colors=None):
+    """Construit la charge utile compacte de la carte temporelle.
+
+    La géométrie et le nom de chaque station ne sont stockés qu'une fois ; pour
+    chaque pas de temps, un tableau donne le nombre de vélos de chaque station
+    (MISSING si inconnu). `bikes` est la matrice stations × temps du
+    rééchantillonnage.
+    """
+    metadata = metadata.reindex(bikes.index)
+    located = metadata["latitude"].notna() & metadata["longitude"].notna()
+    bikes = bikes[located.to_numpy()]
+    metadata = metadata[located]
+
+    counts = np.where(np.isnan(bikes.to_numpy()), MISSING, np.round(bikes.to_numpy()))
+    return {
+        "times": [t.strftime("%Y-%m-%d %H:%M:%S") for t in bikes.columns],
+        "stations": {
+            "number": [int(n) for n in bikes.index],
+            "name": metadata["name"].fillna("").tolist(),
+            "lat": metadata["latitude"].round(6).tolist(),
+            "lon": metadata["longitude"].round(6).tolist(),
+        },
+        "vmin": float(vmin),
+        "vmax": float(vmax),
+        "palette": colors or build_color_lut().tolist(),
+        # Un tableau par pas de temps (temps × stations)
+        "bikes": counts.T.astype(int).tolist(),
+    }
+
+
+def write_payload(payload, path, compress=True):
+    """Écrit la charge utile en JSON, compressé en gzip si demandé"""
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    if compress:
+        data = gzip.compress(data)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+# Curseur temporel et lecture automatique, partagés par les calques pilotés
+# par une charge utile (stations, cellules) : render(t) redessine le pas t,
+# jamais appelé sans pas de temps
+TIME_CONTROL_JS = """
+    function addTimeControl(map, times, className, render) {
+        var current = 0, timer = null;
+        var control = L.control({position: "bottomleft"});
+        var div = L.DomUtil.create("div", className);
+        div.style.cssText = "background:white;padding:6px 10px;" +
+            "border-radius:4px;font:12px sans-serif";
+        div.innerHTML = '<button type="button">&#9654;</button> ' +
+            '<input type="range" min="0" value="0" style="width:320px;' +
+            'vertical-align:middle"> <span></span>';
+        var button = div.querySelector("button");
+        var slider = div.querySelector("input");
+        var label = div.querySelector("span");
+        L.DomEvent.disableClickPropagation(div);
+        control.onAdd = function () { return div; };
+        control.addTo(map);
+        if (times.length === 0) {
+            // Aucun pas de temps : rien à afficher ni à lire
+            slider.disabled = button.disabled = true;
+            label.textContent = "Aucune donnée";
+            return;
+        }
+        slider.max = times.length - 1;
+
+        function show(t) {
+            current = t;
+            render(t);
+            slider.value = t;
+            label.textContent = times[t];
+        }
+
+        slider.addEventListener("input", function () {
+            show(parseInt(slider.value, 10));
+        });
+        button.addEventListener("click", function () {
+            if (timer) {
+                clearInterval(timer);
+                timer = null;
+                button.innerHTML = "&#9654;";
+                return;
+            }
+            button.innerHTML = "&#10074;&#10074;";
+            timer = setInterval(function () {
+                show((current + 1) % times.length);
+            }, 500);
+        });
+        show(0);
+    }
+"""
+
+# Script de pilotage de la carte : marqueurs créés une seule fois, recolorés à
+# chaque déplacement du curseur
+_SLIDER_JS = """
+(function () {
+    var map = %(map)s;
+    var dataUrl = %(data_url)s;
+    var inlinePayload = %(payload)s;
+%(time_control)s
+
+    function start(data) {
+        var st = data.stations, n = st.number.length, current = 0;
+        var span = Math.max(data.vmax - data.vmin, 1e-9);
+        var size = data.palette.length;
+        var markers = [];
+
+        function color(b) {
+            var x = Math.min(Math.max((b - data.vmin) / span, 0), 1);
+            return data.palette[Math.min(Math.floor(x * size), size - 1)];
+        }
+
+        for (var i = 0; i < n; i++) {
+            var marker = L.circleMarker([st.lat[i], st.lon[i]], {
+                radius: 8, weight: 2, fillOpacity: 0.7
+            });
+            marker.bindPopup("");
+            marker.on("popupopen", (function (i, marker) {
+                return function () {
+                    marker.setPopupContent(
+                        st.name[i] + "<br>Vélos dispo : " + data.bikes[current][i]
+                    );
+                };
+            })(i, marker));
+            markers.push(marker);
+        }
+
+        addTimeControl(map, data.times, "compact-time-slider", function (t) {
+            current = t;
+            var row = data.bikes[t];
+            for (var i = 0; i < n; i++) {
+                var marker = markers[i], b = row[i];
+                if (b === %(missing)s) {
+                    if (map.hasLayer(marker)) map.removeLayer(marker);
+                    continue;
+                }
+                var c = color(b);
+                marker.setStyle({color: c, fillColor: c});
+                if (!map.hasLayer(marker)) marker.addTo(map);
+            }
+        });
+    }
+
+    function isGzip(bytes) {
+        return bytes.length > 1 && bytes[0] === 0x1f && bytes[1] === 0x8b;
+    }
+
+    if (dataUrl === null) {
+        start(inlinePayload);
+        return;
+    }
+    fetch(dataUrl)
+        .then(function (response) { return response.arrayBuffer(); })
+        .then(function (buffer) {
+            var bytes = new Uint8Array(buffer);
+            if (!isGzip(bytes)) return new Response(bytes).text();
+            var stream = new Blob([bytes]).stream()
+                .pipeThrough(new DecompressionStream("gzip"));
+            return new Response(stream).text();
+        })
+        .then(function (text) { start(JSON.parse(text)); });
+})();
+"""
+
+
+def add_compact_layer(m, payload, data_url=None):
+    """Ajoute à la carte le calque piloté par la charge utile compacte.
+
+    Avec `data_url`, la charge utile est chargée depuis un fichier JSON (gzip
+    accepté) placé à côté du HTML ; sinon elle est intégrée au HTML.
+    """
+    script = _SLIDER_JS % {
+        "map": m.get_name(),
+        "data_url": json.dumps(data_url),
+        "payload": "null" if data_url else json.dumps(payload, separators=(",", ":")),
+        "missing": MISSING,
+        "time_control": TIME_CONTROL_JS,
+    }
+    m.get_root().script.add_child(folium.Element(script))
+    return m
+
+
+def save_compact_map(m, payload, output_file, external=False, compress=True):
+    """Enregistre la carte compacte, avec les données intégrées ou à part"""
+    data_url = None
+    if external:
+        suffix = ".json.gz" if compress else ".json"
+        data_file = os.path.splitext(output_file)[0] + "_data" + suffix
+        write_payload(payload, data_file, compress)
+        data_url = os.path.basename(data_file)
+    add_compact_layer(m, payload, data_url)
+    m.save(output_file)
+    return output_file
@@ -0,0 +1,366 @@
+import os
+import glob
+import shutil
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from history_store import (
+    COMPACTED_PREFIX,
+    PARTITIONING,
+    SCHEMA,
+    STORE_DIR,
+    contract_partition,
+    history_filter,
+    partition_files,
+    publish,
+    read_history,
+    read_snapshots,
+    reconstruct_snapshots,
+    store_partitions,
+)
+
+# Agrégats, rangés à côté des données brutes (ignorés par leur lecture grâce
+# au préfixe "_") : _rollups/<pas>/contractName=<contrat>/date=<jour>/
+ROLLUP_DIR = "_rollups"
+ROLLUP_FREQS = ["15min", "1h"]
+# Disponibilités agrégées (minimum, moyenne, maximum par pas)
+VALUE_COLUMNS = ["bikes", "stands", "mechanicalBikes", "electricalBikes"]
+# Dernière valeur connue sur le pas
+LAST_COLUMNS = ["name", "address", "latitude", "longitude", "capacity", "status"]
+# Périodes au-delà desquelles les lectures passent aux agrégats 15 min, puis
+# horaires (voir choose_resolution)
+RAW_SPAN = pd.Timedelta(days=7)
+FINE_SPAN = pd.Timedelta(days=90)
+# Délai avant la suppression des fichiers remplacés par une compaction (les
+# lectures commencées avant la publication du fichier compacté les lisent)
+SUPERSEDED_GRACE = pd.Timedelta(minutes=10)
+
+ROLLUP_SCHEMA = pa.schema(
+    [
+        ("number", pa.int32()),
+        ("contractName", pa.string()),
+        ("snapshot_time", pa.timestamp("us")),
+        ("samples", pa.int16()),
+    ]
+    + [
+        field
+        for col in VALUE_COLUMNS
+        for field in (
+            (col, pa.float32()),
+            (f"{col}_min", pa.int16()),
+            (f"{col}_max", pa.int16()),
+        )
+    ]
+    + [SCHEMA.field(col) for col in LAST_COLUMNS]
+)
+
+
+def conform(table, schema=SCHEMA):
+    """Aligne une table sur le schéma courant (évolution du schéma).
+
+    Les colonnes apparues depuis l'écriture du fichier sont ajoutées (nulles),
+    les types sont convertis et les colonnes inconnues écartées.
+    """
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type, safe=False))
+        else:
+            columns.append(pa.nulls(table.num_rows, field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def drop_repeats(df):
+    """Supprime les lignes identiques à la ligne précédente de la même station.
+
+    La première ligne de chaque station est gardée : une partition (journée)
+    se suffit toujours à elle-même.
+    """
+    df = df.sort_values(["number", "snapshot_time"], kind="stable")
+    values = [c for c in df.columns if c not in ("snapshot_time", "contractName")]
+    same = np.r_[False, df["number"].to_numpy()[1:] == df["number"].to_numpy()[:-1]]
+    for col in values:
+        current = df[col]
+        previous = current.shift()
+        equal = (current == previous) | (current.isna() & previous.isna())
+        same &= equal.fillna(False).to_numpy(dtype=bool)
+    return df[~same]
+
+
+def _data_files(part_dir):
+    return sorted(glob.glob(os.path.join(part_dir, "*.parquet")))
+
+
+def _is_compacted(part_dir):
+    files = partition_files(part_dir)
+    return len(files) == 1 and os.path.basename(files[0]).startswith(
+        COMPACTED_PREFIX
+    )
+
+
+def remove_superseded(part_dir, grace=SUPERSEDED_GRACE, now=None):
+    """Supprime les fichiers remplacés par le fichier compacté d'une
+    partition, une fois passé `grace` après sa publication ; renvoie leur
+    nombre"""
+    live = partition_files(part_dir)
+    superseded = [f for f in _data_files(part_dir) if f not in live]
+    if not superseded:
+        return 0
+    published = pd.Timestamp(os.stat(live[0]).st_mtime_ns, unit="ns")
+    if pd.Timestamp(now or datetime.now()) - published < pd.Timedelta(grace):
+        return 0
+    for path in superseded:
+        os.remove(path)
+    return len(superseded)
+
+
+def compact_partition(part_dir, grace=SUPERSEDED_GRACE):
+    """Regroupe les fichiers d'une journée en un seul, sans lignes répétées.
+
+    Le fichier compacté est publié atomiquement. Les lectures ignorent dès
+    lors les fichiers qu'il remplace (voir history_store.partition_files) :
+    ils ne sont supprimés qu'à une compaction ultérieure, `grace` au moins
+    après la publication, pour qu'une lecture en cours ne les perde pas.
+    Renvoie (lignes lues, lignes gardées), None si déjà compactée.
+    """
+    remove_superseded(part_dir, grace)
+    if _is_compacted(part_dir):
+        return None
+    files = partition_files(part_dir)
+    table = pa.concat_tables([conform(pq.read_table(f)) for f in files])
+    df = drop_repeats(table.to_pandas())
+    compacted = pa.Table.from_pandas(
+        df.sort_values(["snapshot_time", "number"], kind="stable"),
+        schema=SCHEMA,
+        preserve_index=False,
+    )
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    publish(compacted, os.path.join(part_dir, f"{COMPACTED_PREFIX}-{stamp}.parquet"))
+    return table.num_rows, compacted.num_rows
+
+
+def rollup_frame(df, freq, snapshot_times=None):
+    """Agrégats min / moyenne / max des disponibilités par station et par pas.
+
+    Les lignes écrites ne sont que celles qui ont changé : les snapshots
+    complets sont d'abord reconstitués (voir reconstruct_snapshots), pour que
+    chaque snapshot compte une fois dans chaque pas.
+    """
+    if df.empty:
+        return ROLLUP_SCHEMA.empty_table().to_pandas()
+    full = reconstruct_snapshots(df, snapshot_times)
+    full["snapshot_time"] = full["snapshot_time"].dt.floor(freq)
+    grouped = full.groupby(["number", "snapshot_time"], sort=True)
+
+    aggregations = {"samples": ("bikes", "size")}
+    for col in VALUE_COLUMNS:
+        aggregations[col] = (col, "mean")
+        aggregations[f"{col}_min"] = (col, "min")
+        aggregations[f"{col}_max"] = (col, "max")
+    for col in ["contractName"] + LAST_COLUMNS:
+        aggregations[col] = (col, "last")
+    return grouped.agg(**aggregations).reset_index()
+
+
+def _snapshot_times(store_dir, contract, start, end):
+    """Instants des snapshots d'un contrat dans [start, end[ (None sans
+    journal)"""
+    journal = read_snapshots(store_dir, contract)
+    times = journal[(journal >= start) & (journal < end)]
+    return times if len(times) else None
+
+
+def _rollup_path(store_dir, freq, contract, day):
+    return os.path.join(
+        store_dir, ROLLUP_DIR, freq, f"contractName={contract}", f"date={day}"
+    )
+
+
+def rollup_day(store_dir, contract, day, freqs=ROLLUP_FREQS):
+    """Calcule et publie les agrégats d'une journée brute"""
+    start = pd.Timestamp(day)
+    end = start + pd.Timedelta("1D")
+    df = read_history(store_dir, contract=contract, start=start, end=end)
+    times = _snapshot_times(store_dir, contract, start, end)
+    written = []
+    for freq in freqs:
+        rollup = rollup_frame(df, freq, times)
+        table = pa.Table.from_pandas(
+            rollup, schema=ROLLUP_SCHEMA, preserve_index=False
+        )
+        path = _rollup_path(store_dir, freq, contract, day)
+        written.append(publish(table, os.path.join(path, "rollup.parquet")))
+    return written
+
+
+def compact_store(
+    store_dir=STORE_DIR, raw_days=30, fine_days=365, today=None, report=print
+):
+    """Compacte le stockage et applique la politique de rétention.
+
+    - journées terminées : fichiers regroupés, lignes répétées supprimées et
+      agrégats 15 min / 1 h calculés ;
+    - données brutes de plus de `raw_days` jours : supprimées (les agrégats
+      restent) ;
+    - agrégats 15 min de plus de `fine_days` jours : supprimés (l'horaire
+      reste).
+
+    La journée en cours, encore écrite par le collecteur, n'est pas touchée.
+    """
+    today = pd.Timestamp(today or datetime.now()).normalize()
+    raw_limit = (today - pd.Timedelta(days=raw_days)).strftime("%Y-%m-%d")
+    fine_limit = (today - pd.Timedelta(days=fine_days)).strftime("%Y-%m-%d")
+    today = today.strftime("%Y-%m-%d")
+    stats = {"compacted": 0, "rows_before": 0, "rows_after": 0, "rolled_up": 0}
+    stats.update({"raw_removed": 0, "fine_removed": 0})
+
+    for contract, day, part_dir in store_partitions(store_dir):
+        if day >= today:
+            continue
+        # Agrégats calculés avant la compaction : sans journal des snapshots,
+        # les lignes répétées sont les seules traces des snapshots inchangés
+        compacted = _is_compacted(part_dir)
+        missing = [
+            freq
+            for freq in ROLLUP_FREQS
+            if not os.path.isdir(_rollup_path(store_dir, freq, contract, day))
+        ]
+        if not compacted or missing:
+            rollup_day(store_dir, contract, day)
+            stats["rolled_up"] += 1
+        result = compact_partition(part_dir)
+        if result is not None:
+            stats["compacted"] += 1
+            stats["rows_before"] += result[0]
+            stats["rows_after"] += result[1]
+        if day < raw_limit:
+            shutil.rmtree(part_dir)
+            stats["raw_removed"] += 1
+
+    fine_root = os.path.join(store_dir, ROLLUP_DIR, ROLLUP_FREQS[0])
+    for contract, day, part_dir in store_partitions(fine_root):
+        if day < fine_limit:
+            shutil.rmtree(part_dir)
+            stats["fine_removed"] += 1
+    if report:
+        report(stats)
+    return stats
+
+
+def stored_days(store_dir=STORE_DIR):
+    """Journées encore disponibles en données brutes (ou dans un dossier
+    d'agrégats)"""
+    return sorted({day for _, day, _ in store_partitions(store_dir)})
+
+
+def read_rollups(
+    store_dir=STORE_DIR,
+    freq="1h",
+    columns=None,
+    contract=None,
+    start=None,
+    end=None,
+    stations=None,
+):
+    """Lit les agrégats d'un pas ; les journées brutes pas encore agrégées
+    (journée en cours) sont agrégées à la volée"""
+    root = os.path.join(store_dir, ROLLUP_DIR, freq)
+    row_filter = history_filter(contract, start, end, stations)
+    parts = []
+    covered = set()
+    if os.path.isdir(root):
+        dataset = ds.dataset(
+            root, format="parquet", partitioning=PARTITIONING, schema=ROLLUP_SCHEMA
+        )
+        parts.append(dataset.to_table(filter=row_filter).to_pandas())
+        covered = {(c, d) for c, d, _ in store_partitions(root)}
+
+    first = pd.Timestamp(start).strftime("%Y-%m-%d") if start is not None else ""
+    last = pd.Timestamp(end).strftime("%Y-%m-%d") if end is not None else "9999"
+    for name, day, _ in store_partitions(store_dir):
+        if (name, day) in covered or not first <= day <= last:
+            continue
+        if contract is not None and name != contract_partition(contract):
+            continue
+        # Journée entière : les pas coupés par start / end sont filtrés après
+        day_start = pd.Timestamp(day)
+        day_end = day_start + pd.Timedelta("1D")
+        df = read_history(
+            store_dir, contract=name, start=day_start, end=day_end, stations=stations
+        )
+        times = _snapshot_times(store_dir, name, day_start, day_end)
+        rollup = rollup_frame(df, freq, times)
+        parts.append(_filter_buckets(rollup, start, end))
+
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        df = ROLLUP_SCHEMA.empty_table().to_pandas()
+    else:
+        df = pd.concat(parts, ignore_index=True)
+        df = df.sort_values(["snapshot_time", "number"], kind="stable")
+    df = df.reset_index(drop=True)
+    return df if columns is None else df[[c for c in columns if c in df.columns]]
+
+
+def _filter_buckets(df, start=None, end=None):
+    """Garde les pas commençant dans [start, end["""
+    keep = np.ones(len(df), dtype=bool)
+    if start is not None:
+        keep &= (df["snapshot_time"] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep &= (df["snapshot_time"] < pd.Timestamp(end)).to_numpy()
+    return df[keep]
+
+
+def choose_resolution(store_dir=STORE_DIR, start=None, end=None):
+    """Résolution adaptée à une période : données brutes jusqu'à une semaine
+    (si elles couvrent encore la période), agrégats 15 min jusqu'à trois
+    mois, agrégats horaires au-delà"""
+    raw = stored_days(store_dir)
+    rolled = {
+        freq: stored_days(os.path.join(store_dir, ROLLUP_DIR, freq))
+        for freq in ROLLUP_FREQS
+    }
+    known = raw + rolled[ROLLUP_FREQS[-1]]
+    if not known:
+        return "raw"
+    first = pd.Timestamp(start) if start is not None else pd.Timestamp(min(known))
+    last = pd.Timestamp(end) if end is not None else pd.Timestamp(max(known))
+    if end is None:
+        last += pd.Timedelta("1D")
+    span = last - first
+    day = first.strftime("%Y-%m-%d")
+
+    def covers(days):
+        return bool(days) and day >= days[0]
+
+    if span <= RAW_SPAN and covers(raw):
+        return "raw"
+    # Les agrégats 15 min des journées anciennes ont pu être supprimés
+    if span <= FINE_SPAN and (covers(rolled[ROLLUP_FREQS[0]]) or covers(raw)):
+        return ROLLUP_FREQS[0]
+    return ROLLUP_FREQS[-1]
+
+
+def main():
+    """Compaction, agrégats et rétention de l'historique"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument(
+        "--raw-days", type=int, default=30, help="rétention des données brutes"
+    )
+    parser.add_argument(
+        "--fine-days", type=int, default=365, help="rétention des agrégats 15 min"
+    )
+    args = parser.parse_args()
+    compact_store(args.store, args.raw_days, args.fine_days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from compaction import read_rollups, rollup_frame
+from flows import grid_districts, read_districts, station_positions
+from history_loader import iter_source, load_history
+from history_store import STORE_DIR, publish, resolve_contract
+from query_service import source_signature
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Dossier par défaut du cache des vues préparées (une vue par jeu de paramètres)
+CACHE_DIR = os.path.join(BASE_DIR, "explore_cache")
+VIEWS = ["station_hour", "district_day", "sample"]
+# Budget par défaut d'une vue : au-delà, l'explorateur du navigateur rame
+MAX_ROWS = 200_000
+MAX_BYTES = 64 * 2**20
+# Colonnes des relevés bruts gardées dans l'échantillon
+SAMPLE_COLUMNS = [
+    "number",
+    "contractName",
+    "snapshot_time",
+    "name",
+    "status",
+    "bikes",
+    "stands",
+    "mechanicalBikes",
+    "electricalBikes",
+    "capacity",
+    "latitude",
+    "longitude",
+]
+# Strates de l'échantillon : chaque station à chaque heure de la journée
+SAMPLE_STRATA = ["number", "hour"]
+
+
+def compact_types(df):
+    """Types compacts : entiers réduits, flottants 32 bits, chaînes en
+    catégories (une valeur stockée une fois par colonne)"""
+    df = df.copy()
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_bool_dtype(values) or pd.api.types.is_datetime64_any_dtype(
+            values
+        ):
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            df[col] = pd.to_numeric(values, downcast="integer")
+        elif pd.api.types.is_float_dtype(values):
+            df[col] = values.astype("float32")
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(
+            values
+        ):
+            df[col] = values.astype("category")
+    return df
+
+
+def row_limit(df, max_rows=MAX_ROWS, max_bytes=MAX_BYTES):
+    """Nombre de lignes tenant dans le budget (lignes et octets en mémoire)"""
+    if not len(df) or not max_bytes:
+        return max_rows
+    per_row = df.memory_usage(deep=True, index=False).sum() / len(df)
+    limit = int(max_bytes // max(per_row, 1))
+    return min(limit, max_rows) if max_rows else limit
+
+
+def _bottom_k(df, by, k):
+    """Les k lignes de plus petite clé aléatoire de chaque strate : un
+    échantillon uniforme de chaque strate, qui se combine bloc par bloc.
+    Les lignes restent triées par clé : s'il y a plus de strates que de
+    lignes permises, les premières forment un tirage uniforme parmi elles."""
+    df = df.sort_values("_key", kind="stable")
+    return df[df.groupby(by, sort=False, observed=True).cumcount() < k]
+
+
+def fit_budget(df, max_rows=MAX_ROWS, max_bytes=MAX_BYTES, by="number", seed=0):
+    """Réduit une vue trop grande pour le budget à un échantillon stratifié
+    (chaque valeur de `by` reste représentée) ; renvoie (vue, réduite ?)"""
+    limit = row_limit(df, max_rows, max_bytes)
+    if len(df) <= limit:
+        return df, False
+    strata = max(df[by].nunique(), 1)
+    keyed = df.assign(_key=np.random.default_rng(seed).random(len(df)))
+    sample = _bottom_k(keyed, by, max(limit // strata, 1)).head(limit)
+    return _sort_view(sample.drop(columns="_key")), True
+
+
+def _sort_view(df):
+    keys = [c for c in ("snapshot_time", "date", "number", "district") if c in df]
+    return df.sort_values(keys, kind="stable").reset_index(drop=True)
+
+
+def read_hourly(source, start=None, end=None, contract=None):
+    """Agrégats horaires par station (voir compaction.py) d'un contrat, depuis
+    un stockage ou un CSV"""
+    if os.path.isdir(source):
+        contract = resolve_contract(source, contract)
+        return read_rollups(source, "1h", contract=contract, start=start, end=end)
+    df = load_history(source, start, end, contract=contract)
+    return _sort_view(rollup_frame(df, "1h")) if not df.empty else df
+
+
+def station_districts(hourly, districts_file=None, cell=0.01):
+    """Quartier de chaque station : CSV number,district ou grille (comme
+    flows.py)"""
+    if districts_file:
+        return read_districts(districts_file)
+    return grid_districts(station_positions(hourly), cell)
+
+
+def _calendar(df, times):
+    df["date"] = times.dt.normalize()
+    df["weekday"] = times.dt.dayofweek.astype("int8")
+    return df
+
+
+def station_hour_view(hourly, districts):
+    """Une ligne par station et par heure : disponibilités moyennes, minimum
+    et maximum sur l'heure, remplissage et repères calendaires"""
+    times = hourly["snapshot_time"]
+    df = hourly[["number", "contractName", "name", "snapshot_time"]].copy()
+    df["district"] = districts.reindex(hourly["number"]).to_numpy()
+    df = _calendar(df, times)
+    df["hour"] = times.dt.hour.astype("int8")
+    for col in ["bikes", "bikes_min", "bikes_max", "stands"]:
+        df[col] = hourly[col]
+    df["mechanicalBikes"] = hourly["mechanicalBikes"]
+    df["electricalBikes"] = hourly["electricalBikes"]
+    df["capacity"] = hourly["capacity"]
+    docks = hourly["bikes"] + hourly["stands"]
+    df["fill"] = (hourly["bikes"] / docks.where(docks > 0)).astype("float32")
+    df["samples"] = hourly["samples"]
+    df["latitude"] = hourly["latitude"]
+    df["longitude"] = hourly["longitude"]
+    return compact_types(df)
+
+
+def district_day_view(hourly, districts):
+    """Une ligne par quartier et par jour : vélos et places libres du
+    quartier (moyenne, minimum et maximum des totaux horaires), remplissage
+    et part des heures-stations vides ou pleines"""
+    df = hourly.assign(
+        district=districts.reindex(hourly["number"]).to_numpy(),
+        empty=hourly["bikes_min"] == 0,
+        full=hourly["stands_min"] == 0,
+    )
+    per_hour = df.groupby(["district", "snapshot_time"], observed=True).agg(
+        stations=("number", "size"),
+        bikes=("bikes", "sum"),
+        stands=("stands", "sum"),
+        capacity=("capacity", "sum"),
+        empty=("empty", "sum"),
+        full=("full", "sum"),
+    )
+    per_hour = per_hour.reset_index()
+    per_hour["date"] = per_hour["snapshot_time"].dt.normalize()
+    daily = per_hour.groupby(["district", "date"]).agg(
+        stations=("stations", "max"),
+        capacity=("capacity", "max"),
+        bikes=("bikes", "mean"),
+        bikes_min=("bikes", "min"),
+        bikes_max=("bikes", "max"),
+        stands=("stands", "mean"),
+        station_hours=("stations", "sum"),
+        empty_hours=("empty", "sum"),
+        full_hours=("full", "sum"),
+    )
+    daily = daily.reset_index()
+    daily["weekday"] = daily["date"].dt.dayofweek.astype("int8")
+    daily["fill"] = daily["bikes"] / (daily["bikes"] + daily["stands"])
+    daily["empty_share"] = daily["empty_hours"] / daily["station_hours"]
+    daily["full_share"] = daily["full_hours"] / daily["station_hours"]
+    return compact_types(daily)
+
+
+def sample_view(
+    source,
+    start=None,
+    end=None,
+    contract=None,
+    max_rows=MAX_ROWS,
+    max_bytes=MAX_BYTES,
+    seed=0,
+):
+    """Échantillon stratifié des relevés bruts : le même nombre de relevés
+    (tirés au hasard) pour chaque station à chaque heure de la journée.
+
+    L'historique est parcouru bloc par bloc sans être chargé en entier :
+    chaque bloc est fusionné avec l'échantillon courant, qui ne garde que les
+    k plus petites clés aléatoires de chaque strate. k ne fait que diminuer
+    quand de nouvelles strates apparaissent, donc le résultat est celui d'un
+    tirage sur tout l'historique. Dans un stockage, les snapshots complets
+    sont reconstitués (voir history_loader.iter_snapshots).
+    """
+    rng = np.random.default_rng(seed)
+    kept, limit, strata = None, None, 0
+    chunks = iter_source(source, start, end, columns=SAMPLE_COLUMNS, contract=contract)
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        chunk = compact_types(chunk.reindex(columns=SAMPLE_COLUMNS))
+        chunk["hour"] = chunk["snapshot_time"].dt.hour.astype("int8")
+        if limit is None:
+            limit = row_limit(chunk, max_rows, max_bytes)
+        chunk["_key"] = rng.random(len(chunk))
+        if kept is not None:
+            chunk = pd.concat([kept, chunk], ignore_index=True)
+            chunk = compact_types(chunk)
+        strata = len(chunk.groupby(SAMPLE_STRATA, sort=False, observed=True))
+        kept = _bottom_k(chunk, SAMPLE_STRATA, max(limit // strata, 1))
+    if kept is None:
+        return compact_types(pd.DataFrame(columns=SAMPLE_COLUMNS))
+    kept = kept.head(limit)
+    df = _calendar(kept.drop(columns="_key"), kept["snapshot_time"])
+    return _sort_view(df)
+
+
+def build_view(
+    source,
+    view="station_hour",
+    start=None,
+    end=None,
+    contract=None,
+    districts_file=None,
+    cell=0.01,
+    max_rows=MAX_ROWS,
+    max_bytes=MAX_BYTES,
+    seed=0,
+):
+    """Construit une vue d'exploration ; renvoie (vue, réduite ?)"""
+    if view not in VIEWS:
+        raise ValueError(f"vue inconnue : {view} (parmi {', '.join(VIEWS)})")
+    if view == "sample":
+        df = sample_view(source, start, end, contract, max_rows, max_bytes, seed)
+        return df, False
+    hourly = read_hourly(source, start, end, contract)
+    districts = station_districts(hourly, districts_file, cell)
+    if view == "station_hour":
+        df = station_hour_view(hourly, districts)
+        return fit_budget(df, max_rows, max_bytes, "number", seed)
+    df = district_day_view(hourly, districts)
+    return fit_budget(df, max_rows, max_bytes, "district", seed)
+
+
+class ExploreCache:
+    """Cache des vues préparées, réutilisables d'une session à l'autre.
+
+    Une vue est identifiée par ses paramètres et accompagnée de l'empreinte
+    de la source au moment du calcul : elle est recalculée quand la source
+    a changé, sauf si elle a moins de `max_age`.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _paths(self, view, params):
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        name = f"{view}-{key[:12]}"
+        return (
+            os.path.join(self.cache_dir, f"{name}.parquet"),
+            os.path.join(self.cache_dir, f"{name}.json"),
+        )
+
+    def load(self, view, params, signature, max_age=None):
+        """Vue en cache (None si absente ou périmée)"""
+        data_path, meta_path = self._paths(view, params)
+        if not os.path.isfile(meta_path) or not os.path.isfile(data_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        fresh = meta["signature"] == signature
+        if not fresh and max_age is not None:
+            age = pd.Timestamp.now() - pd.Timestamp(meta["created"])
+            fresh = age <= pd.Timedelta(max_age)
+        if not fresh:
+            return None
+        return pd.read_parquet(data_path)
+
+    def save(self, view, params, signature, df):
+        """Enregistre une vue (données puis paramètres, remplacés d'un coup)"""
+        data_path, meta_path = self._paths(view, params)
+        publish(pa.Table.from_pandas(df, preserve_index=False), data_path)
+        meta = {
+            "view": view,
+            "params": params,
+            "signature": signature,
+            "created": pd.Timestamp.now().isoformat(),
+            "rows": len(df),
+        }
+        tmp = f"{meta_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, meta_path)
+
+
+def prepare(
+    source=STORE_DIR,
+    view="station_hour",
+    start=None,
+    end=None,
+    contract=None,
+    districts_file=None,
+    cell=0.01,
+    max_rows=MAX_ROWS,
+    max_bytes=MAX_BYTES,
+    seed=0,
+    cache_dir=CACHE_DIR,
+    max_age=None,
+    refresh=False,
+    report=print,
+):
+    """Vue d'exploration prête pour PyGWalker, depuis le cache si possible.
+
+    `cache_dir=None` désactive le cache ; `refresh` force le recalcul.
+    """
+    if os.path.isdir(source):
+        # Clé du cache : nom exact de la partition du contrat lu
+        contract = resolve_contract(source, contract)
+    params = {
+        "source": os.path.abspath(source),
+        "start": None if start is None else str(pd.Timestamp(start)),
+        "end": None if end is None else str(pd.Timestamp(end)),
+        "contract": contract,
+        "districts": districts_file,
+        "cell": cell,
+        "max_rows": max_rows,
+        "max_bytes": max_bytes,
+        "seed": seed,
+    }
+    cache = ExploreCache(cache_dir) if cache_dir else None
+    # Empreinte relue du JSON pour être comparable à celle du cache
+    signature = json.loads(json.dumps(source_signature(source)))
+    if cache is not None and not refresh:
+        df = cache.load(view, params, signature, max_age)
+        if df is not None:
+            report(f"♻️ Vue {view} en cache : {len(df)} lignes")
+            return df
+
+    df, reduced = build_view(
+        source,
+        view,
+        start,
+        end,
+        contract,
+        districts_file,
+        cell,
+        max_rows,
+        max_bytes,
+        seed,
+    )
+    size = df.memory_usage(deep=True, index=False).sum() / 2**20
+    report(f"📦 Vue {view} : {len(df)} lignes, {size:.1f} Mo")
+    if reduced:
+        report(
+            "⚠️ Vue réduite à un échantillon pour tenir dans le budget : "
+            "restreindre la période ou passer à une vue plus agrégée"
+        )
+    if cache is not None:
+        cache.save(view, params, signature, df)
+    return df
+
+
+def main():
+    """Prépare une vue agrégée et bornée de l'historique pour l'exploration"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("view", nargs="?", default="station_hour", choices=VIEWS)
+    parser.add_argument("--store", default=STORE_DIR, help="stockage ou CSV")
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument(
+        "--contract",
+        default=os.getenv("JCDECAUX_CONTRACT"),
+        help="contrat lu dans un stockage multi-contrats",
+    )
+    parser.add_argument(
+        "--districts", default=None, help="CSV number,district (sinon grille)"
+    )
+    parser.add_argument(
+        "--cell", type=float, default=0.01, help="taille de la grille en degrés"
+    )
+    parser.add_argument("--max-rows", type=int, default=MAX_ROWS)
+    parser.add_argument("--max-mb", type=float, default=MAX_BYTES / 2**20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument(
+        "--max-age", default=None, help="réutilise une vue plus récente (ex. 1D)"
+    )
+    parser.add_argument("--refresh", action="store_true", help="recalcule la vue")
+    parser.add_argument("--output", default=None, help="export .parquet ou .csv")
+    args = parser.parse_args()
+
+    df = prepare(
+        args.store,
+        args.view,
+        args.start,
+        args.end,
+        args.contract,
+        args.districts,
+        args.cell,
+        args.max_rows,
+        int(args.max_mb * 2**20),
+        args.seed,
+        None if args.no_cache else args.cache_dir,
+        args.max_age,
+        args.refresh,
+    )
+    if args.output:
+        if args.output.endswith(".csv"):
+            df.to_csv(args.output, index=False)
+        else:
+            df.to_parquet(args.output, index=False)
+        print(f"💾 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from history_loader import load_history
+from history_store import STORE_DIR
+from metrics import configure_metrics, incr, span
+
+# Colonnes lues dans l'historique pour le calcul des flux
+COLUMNS = [
+    "number",
+    "snapshot_time",
+    "lastUpdate",
+    "latitude",
+    "longitude",
+    "mechanicalBikes",
+    "electricalBikes",
+]
+# Type de vélo -> colonne de disponibilité
+BIKE_TYPES = {"mechanical": "mechanicalBikes", "electrical": "electricalBikes"}
+FLOW_COLUMNS = [
+    f"{kind}_{bike}" for kind in ("departures", "arrivals") for bike in BIKE_TYPES
+] + ["departures", "arrivals", "net"]
+
+
+def _fresh_reports(df):
+    """Garde, pour chaque station, les seuls relevés réellement nouveaux.
+
+    Un relevé dont lastUpdate n'est pas postérieur au précédent de la même
+    station est la répétition d'une mesure déjà vue (collecte plus fréquente
+    que la mise à jour de la station, ou réponse en cache) : ses écarts
+    seraient comptés deux fois. lastUpdate est comparé en instant (chaîne
+    ISO 8601 dans un CSV).
+    """
+    if "lastUpdate" not in df.columns:
+        return df
+    updates = pd.to_datetime(df["lastUpdate"], format="ISO8601", utc=True)
+    seen = updates.groupby(df["number"], sort=False).cummax()
+    previous = seen.groupby(df["number"], sort=False).shift()
+    fresh = previous.isna() | (updates > previous)
+    return df[fresh.to_numpy()]
+
+
+def station_flows(df):
+    """Départs et arrivées de chaque station entre relevés consécutifs.
+
+    Toutes les stations sont traitées en un seul passage : les relevés sont
+    triés par (station, instant) puis différenciés, et les écarts entre deux
+    stations différentes sont écartés. Une baisse du nombre de vélos compte
+    comme des départs, une hausse comme des arrivées, séparément pour les
+    vélos mécaniques et électriques. Ce sont des bornes basses : un vélo pris
+    puis rendu entre deux relevés n'est pas vu.
+    """
+    df = df.sort_values(["number", "snapshot_time"], kind="stable")
+    df = _fresh_reports(df.dropna(subset=list(BIKE_TYPES.values())))
+
+    numbers = df["number"].to_numpy()
+    times = df["snapshot_time"].to_numpy()
+    # Ligne i : intervalle entre les relevés i-1 et i de la même station
+    same = np.r_[False, numbers[1:] == numbers[:-1]]
+
+    flows = {
+        "number": numbers[same],
+        "start": times[:-1][same[1:]],
+        "snapshot_time": times[same],
+    }
+    for bike, col in BIKE_TYPES.items():
+        values = df[col].to_numpy(dtype="int32")
+        delta = np.diff(values)[same[1:]]
+        flows[f"departures_{bike}"] = np.maximum(-delta, 0)
+        flows[f"arrivals_{bike}"] = np.maximum(delta, 0)
+
+    flows = pd.DataFrame(flows)
+    flows["departures"] = sum(flows[f"departures_{b}"] for b in BIKE_TYPES)
+    flows["arrivals"] = sum(flows[f"arrivals_{b}"] for b in BIKE_TYPES)
+    flows["net"] = flows["arrivals"] - flows["departures"]
+    return flows
+
+
+def aggregate_flows(flows, freq="1h", by="number"):
+    """Somme des flux par groupe et par période.
+
+    `by` est une colonne des flux ou une Series numéro -> groupe (quartier).
+    """
+    period = flows["snapshot_time"].dt.floor(freq).rename("period")
+    if isinstance(by, str):
+        keys = flows[by]
+    else:
+        keys = pd.Series(
+            by.reindex(flows["number"]).to_numpy(),
+            index=flows.index,
+            name=by.name or "group",
+        )
+    grouped = flows[FLOW_COLUMNS].groupby([keys, period], dropna=False)
+    return grouped.sum().reset_index()
+
+
+def hourly_flows(flows, by="number"):
+    """Flux par groupe et par heure"""
+    return aggregate_flows(flows, "1h", by)
+
+
+def daily_flows(flows, by="number"):
+    """Flux par groupe et par jour"""
+    return aggregate_flows(flows, "1D", by)
+
+
+def grid_districts(metadata, cell=0.01):
+    """Quartiers approximatifs : cellules d'une grille de `cell` degrés"""
+    lat = np.floor(metadata["latitude"] / cell).astype("Int64")
+    lon = np.floor(metadata["longitude"] / cell).astype("Int64")
+    return (lat.astype(str) + "_" + lon.astype(str)).rename("district")
+
+
+def read_districts(path):
+    """Quartier de chaque station depuis un CSV number,district"""
+    return pd.read_csv(path, index_col="number")["district"]
+
+
+def station_positions(df):
+    """Dernière position connue de chaque station"""
+    latest = df.dropna(subset=["latitude", "longitude"])
+    latest = latest.sort_values("snapshot_time", kind="stable")
+    return latest.groupby("number")[["latitude", "longitude"]].last()
+
+
+def main():
+    """Calcule les flux (départs / arrivées) et écrit les tables agrégées"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--store", default=STORE_DIR, help="stockage ou CSV")
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument(
+        "--districts", default=None, help="CSV number,district (sinon grille)"
+    )
+    parser.add_argument(
+        "--cell", type=float, default=0.01, help="taille de la grille en degrés"
+    )
+    parser.add_argument("--output-dir", default="flows")
+    parser.add_argument(
+        "--contract",
+        default=os.getenv("JCDECAUX_CONTRACT"),
+        help="contrat lu dans un stockage multi-contrats",
+    )
+    args = parser.parse_args()
+    configure_metrics()
+
+    with span("load_history"):
+        df = load_history(
+            args.store, args.start, args.end, columns=COLUMNS, contract=args.contract
+        )
+    incr("rows_loaded", len(df))
+    with span("station_flows"):
+        flows = station_flows(df)
+    if args.districts:
+        districts = read_districts(args.districts)
+    else:
+        districts = grid_districts(station_positions(df), args.cell)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    tables = {
+        "station_hourly": hourly_flows(flows),
+        "station_daily": daily_flows(flows),
+        "district_hourly": hourly_flows(flows, districts),
+        "district_daily": daily_flows(flows, districts),
+    }
+    for name, table in tables.items():
+        table.to_csv(os.path.join(args.output_dir, f"{name}.csv"), index=False)
+    print(
+        f"{len(flows)} intervalles, {flows['departures'].sum()} départs, "
+        f"{flows['arrivals'].sum()} arrivées -> {args.output_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from history_loader import load_history
+from history_store import (
+    STORE_DIR,
+    UNKNOWN,
+    reconstruct_snapshots,
+    resolve_contract,
+)
+from metrics import configure_metrics, incr, span
+from snapshot_log import LogReader, log_dir
+
+# Créneaux du profil saisonnier : jour de la semaine × quart d'heure
+SLOT_MINUTES = 15
+DAY_SLOTS = 24 * 60 // SLOT_MINUTES
+SLOTS = 7 * DAY_SLOTS
+# Horizons de prévision par défaut (minutes)
+HORIZONS = (15, 30, 60)
+COLUMNS = ["number", "snapshot_time", "bikes", "capacity"]
+
+
+def time_slots(times):
+    """Créneau (jour de la semaine × quart d'heure) de chaque instant"""
+    times = pd.DatetimeIndex(np.atleast_1d(times))
+    minutes = times.hour * 60 + times.minute
+    return (times.dayofweek * DAY_SLOTS + minutes // SLOT_MINUTES).to_numpy()
+
+
+def _normal_cdf(z):
+    """Fonction de répartition de la loi normale (approximation d'Abramowitz
+    et Stegun 7.1.26, erreur < 1,5e-7), vectorisée"""
+    x = np.abs(z) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (
+        0.254829592
+        + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429)))
+    )
+    erf = 1.0 - poly * np.exp(-x * x)
+    return 0.5 * (1.0 + np.sign(z) * erf)
+
+
+class AvailabilityForecaster:
+    """Prévision du risque de station vide ou pleine, pour tout le réseau.
+
+    Le taux de remplissage (vélos / capacité) de chaque station est décomposé
+    en un profil saisonnier (moyenne et variance par jour de la semaine et
+    quart d'heure) et un écart à ce profil, qui s'estompe exponentiellement
+    avec l'horizon (processus autorégressif d'ordre 1, appris par station).
+    Le modèle tient dans des sommes cumulées par station et par créneau :
+    l'apprentissage s'enrichit de chaque nouveau snapshot sans relire
+    l'historique, et la prévision de toutes les stations est un calcul
+    matriciel.
+    """
+
+    def __init__(self, prior_weight=4.0, max_gap="1h"):
+        self.prior_weight = prior_weight
+        self.max_gap = pd.Timedelta(max_gap).total_seconds()
+
+        # Sommes par station (lignes alignées sur `numbers`, trié)
+        self.numbers = np.empty(0, dtype=np.int64)
+        self.count = np.zeros((0, SLOTS))
+        self.total = np.zeros((0, SLOTS))
+        self.squares = np.zeros((0, SLOTS))
+        # Autocorrélation des écarts au profil entre relevés consécutifs
+        self.lag_products = np.zeros(0)
+        self.lag_squares = np.zeros(0)
+        self.lag_seconds = np.zeros(0)
+        self.lag_count = np.zeros(0)
+        # Dernier relevé de chaque station
+        self.last_time = np.empty(0, dtype="datetime64[s]")
+        self.last_fill = np.zeros(0)
+        self.capacity = np.zeros(0)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def _positions(self, numbers):
+        """Lignes des stations dans le modèle (les nouvelles y sont ajoutées)"""
+        new = np.setdiff1d(numbers, self.numbers)
+        if len(new):
+            merged = np.union1d(self.numbers, new)
+            old = np.searchsorted(merged, self.numbers)
+            for name in ("count", "total", "squares"):
+                array = np.zeros((len(merged), SLOTS))
+                array[old] = getattr(self, name)
+                setattr(self, name, array)
+            for name in ("lag_products", "lag_squares", "lag_seconds", "lag_count"):
+                array = np.zeros(len(merged))
+                array[old] = getattr(self, name)
+                setattr(self, name, array)
+            last_time = np.full(len(merged), np.datetime64("NaT"), "datetime64[s]")
+            last_time[old] = self.last_time
+            last_fill = np.full(len(merged), np.nan)
+            last_fill[old] = self.last_fill
+            capacity = np.full(len(merged), np.nan)
+            capacity[old] = self.capacity
+            self.last_time, self.last_fill, self.capacity = (
+                last_time,
+                last_fill,
+                capacity,
+            )
+            self.numbers = merged
+        return np.searchsorted(self.numbers, numbers)
+
+    def update(self, df):
+        """Ajoute des relevés (un snapshot ou un historique entier) au modèle"""
+        df = df.dropna(subset=["bikes", "capacity"])
+        df = df[df["capacity"].to_numpy() > 0]
+        if not len(df):
+            return self
+        times = df["snapshot_time"].to_numpy().astype("datetime64[s]")
+        order = np.lexsort((times, df["number"].to_numpy()))
+        times = times[order]
+        rows = self._positions(df["number"].to_numpy(dtype=np.int64)[order])
+        capacity = df["capacity"].to_numpy(dtype="float64")[order]
+        fill = df["bikes"].to_numpy(dtype="float64")[order] / capacity
+        slots = time_slots(times)
+
+        # Profil saisonnier : sommes par (station, créneau)
+        cells = rows * SLOTS + slots
+        np.add.at(self.count.ravel(), cells, 1.0)
+        np.add.at(self.total.ravel(), cells, fill)
+        np.add.at(self.squares.ravel(), cells, fill * fill)
+
+        # Couples de relevés consécutifs de la même station, y compris le
+        # dernier relevé déjà appris avant ce lot
+        first = np.r_[True, rows[1:] != rows[:-1]]
+        previous_time = np.r_[times[:1], times[:-1]]
+        previous_fill = np.r_[fill[:1], fill[:-1]]
+        previous_time[first] = self.last_time[rows[first]]
+        previous_fill[first] = self.last_fill[rows[first]]
+        gap = (times - previous_time) / np.timedelta64(1, "s")
+        pairs = (gap > 0) & (gap <= self.max_gap) & ~np.isnan(previous_fill)
+        if pairs.any():
+            r = rows[pairs]
+            mean, _ = self._profile(r, slots[pairs])
+            before, _ = self._profile(r, time_slots(previous_time[pairs]))
+            d1 = fill[pairs] - mean
+            d0 = previous_fill[pairs] - before
+            np.add.at(self.lag_products, r, d0 * d1)
+            np.add.at(self.lag_squares, r, d0 * d0)
+            np.add.at(self.lag_seconds, r, gap[pairs])
+            np.add.at(self.lag_count, r, 1.0)
+
+        last = np.r_[rows[1:] != rows[:-1], True]
+        self.last_time[rows[last]] = times[last]
+        self.last_fill[rows[last]] = fill[last]
+        self.capacity[rows[last]] = capacity[last]
+        return self
+
+    def _profile(self, rows, slots):
+        """Moyenne et variance du remplissage de stations à des créneaux.
+
+        Un créneau peu observé est rapproché du profil de la même heure tous
+        jours confondus, lui-même rapproché de la moyenne de la station.
+        """
+        k = self.prior_weight
+        count = self.count[rows, slots]
+        total = self.total[rows, slots]
+        squares = self.squares[rows, slots]
+
+        # Même quart d'heure, tous jours de la semaine
+        quarter = slots % DAY_SLOTS
+        by_day = [self.count, self.total, self.squares]
+        day_count, day_total, day_squares = (
+            a.reshape(len(a), 7, DAY_SLOTS)[rows, :, quarter].sum(axis=-1)
+            for a in by_day
+        )
+        # Toute la semaine
+        station_count = np.maximum(self.count.sum(axis=1), 1)
+        station_mean = (self.total.sum(axis=1) / station_count)[rows]
+        station_m2 = (self.squares.sum(axis=1) / station_count)[rows]
+
+        prior_mean = (day_total + k * station_mean) / (day_count + k)
+        prior_m2 = (day_squares + k * station_m2) / (day_count + k)
+        mean = (total + k * prior_mean) / (count + k)
+        m2 = (squares + k * prior_m2) / (count + k)
+        return mean, np.maximum(m2 - mean * mean, 0.0)
+
+    def decay_rate(self):
+        """Vitesse (par seconde) à laquelle l'écart au profil s'estompe"""
+        rho = self.lag_products / np.maximum(self.lag_squares, 1e-12)
+        rho = np.clip(np.nan_to_num(rho, nan=0.5), 0.01, 0.999)
+        # Stations sans couple de relevés : écart moyen de 5 minutes
+        gap = np.where(
+            self.lag_count > 0, self.lag_seconds / np.maximum(self.lag_count, 1), 300.0
+        )
+        return -np.log(rho) / gap
+
+    def predict(self, horizons=HORIZONS, now=None):
+        """Probabilités que chaque station soit vide ou pleine à chaque
+        horizon (minutes), depuis son dernier relevé.
+
+        Renvoie une table indexée par numéro : bikes (dernier relevé),
+        capacity, puis pour chaque horizon h : bikes_h (prévision), p_empty_h
+        et p_full_h.
+        """
+        known = ~np.isnat(self.last_time)
+        rows = np.flatnonzero(known)
+        last_time = self.last_time[rows]
+        if now is None:
+            now = last_time.max() if len(rows) else np.datetime64("now", "s")
+        now = np.datetime64(pd.Timestamp(now).to_datetime64(), "s")
+        capacity = self.capacity[rows]
+        rate = self.decay_rate()[rows]
+
+        mean, _ = self._profile(rows, time_slots(last_time))
+        deviation = self.last_fill[rows] - mean
+        # Demi-véhicule de part et d'autre des seuils « vide » et « plein »
+        half = 0.5 / capacity
+
+        result = {
+            "bikes": np.rint(self.last_fill[rows] * capacity),
+            "capacity": capacity,
+        }
+        for h in horizons:
+            target = now + np.timedelta64(int(h * 60), "s")
+            elapsed = (target - last_time) / np.timedelta64(1, "s")
+            slots = np.full(len(rows), time_slots(target)[0])
+            mean, variance = self._profile(rows, slots)
+            decay = np.exp(-rate * elapsed)
+            expected = np.clip(mean + deviation * decay, 0.0, 1.0)
+            sd = np.sqrt(variance * (1.0 - decay * decay) + half * half)
+            result[f"bikes_{h}"] = expected * capacity
+            result[f"p_empty_{h}"] = _normal_cdf((half - expected) / sd)
+            result[f"p_full_{h}"] = 1.0 - _normal_cdf((1.0 - half - expected) / sd)
+        return pd.DataFrame(result, index=pd.Index(self.numbers[rows], name="number"))
+
+    def last_state(self):
+        """Dernier relevé appris de chaque station (bikes, capacity)"""
+        known = ~np.isnat(self.last_time)
+        return pd.DataFrame(
+            {
+                "number": self.numbers[known],
+                "snapshot_time": self.last_time[known].astype("datetime64[us]"),
+                "bikes": np.rint(self.last_fill[known] * self.capacity[known]),
+                "capacity": self.capacity[known],
+            }
+        )
+
+    def save(self, path):
+        """Enregistre le modèle (sommes et derniers relevés)"""
+        np.savez_compressed(model_path(path), **self.__dict__)
+
+    @classmethod
+    def load(cls, path):
+        """Recharge un modèle enregistré avec save"""
+        model = cls()
+        with np.load(model_path(path)) as data:
+            for name in data.files:
+                value = data[name]
+                setattr(model, name, value.item() if value.ndim == 0 else value)
+        return model
+
+
+def model_path(path):
+    """Chemin du fichier du modèle : np.savez_compressed ajoute « .npz » à un
+    nom qui ne l'a pas, save et load utilisent donc le même nom complet"""
+    path = os.fspath(path)
+    return path if path.endswith(".npz") else f"{path}.npz"
+
+
+def main():
+    """Apprend (ou complète) le modèle puis prévoit le risque vide / plein"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--store", default=STORE_DIR, help="stockage ou CSV")
+    parser.add_argument("--model", default="forecast_model.npz")
+    parser.add_argument(
+        "--horizons", type=int, nargs="+", default=list(HORIZONS), help="minutes"
+    )
+    parser.add_argument("--top", type=int, default=20, help="stations affichées")
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="suit ensuite le journal des snapshots du collecteur",
+    )
+    parser.add_argument(
+        "--contract",
+        default=os.getenv("JCDECAUX_CONTRACT"),
+        help="contrat appris puis suivi dans un stockage multi-contrats",
+    )
+    parser.add_argument("--interval", type=float, default=30.0, help="secondes")
+    args = parser.parse_args()
+    configure_metrics()
+
+    # Le même contrat est appris dans le stockage et suivi dans son journal
+    contract = args.contract
+    if os.path.isdir(args.store):
+        try:
+            contract = resolve_contract(args.store, contract)
+        except ValueError as exc:
+            parser.error(str(exc))
+
+    # Un modèle existant n'apprend que les relevés postérieurs à son dernier
+    if os.path.isfile(model_path(args.model)):
+        model = AvailabilityForecaster.load(args.model)
+        start = pd.Timestamp(model.last_time.max()) + pd.Timedelta(seconds=1)
+    else:
+        model, start = AvailabilityForecaster(), None
+    df = load_history(args.store, start, columns=COLUMNS, contract=contract)
+    with span("forecast_update"):
+        model.update(df)
+    incr("rows_learned", len(df))
+    model.save(args.model)
+    print(f"{len(df)} relevés appris, {len(model)} stations")
+
+    report(model, args.horizons, args.top)
+    if not args.follow:
+        return
+
+    # Seuls les snapshots ajoutés depuis le dernier relevé appris sont lus
+    reader = LogReader(log_dir(args.store, contract or UNKNOWN))
+    if len(model):
+        reader.seek(pd.Timestamp(model.last_time.max()) + pd.Timedelta(seconds=1))
+    state = model.last_state()
+    try:
+        for table, times in reader.follow(args.interval, with_times=True):
+            if table is None:
+                rows = state.iloc[:0]
+            else:
+                rows = table.select(COLUMNS).to_pandas()
+            df = complete_snapshots(state, rows, times)
+            if df.empty:
+                continue
+            with span("forecast_update"):
+                model.update(df)
+            incr("rows_learned", len(df))
+            state = df[df["snapshot_time"] == df["snapshot_time"].max()]
+            model.save(args.model)
+            report(model, args.horizons, args.top)
+    except KeyboardInterrupt:
+        pass
+
+
+def complete_snapshots(state, rows, times):
+    """Snapshots complets aux instants `times` du journal, qui ne contient que
+    les stations modifiées : chaque station reprend sa dernière ligne connue
+    (dernier état `state` ou ligne du journal), pour que chaque snapshot
+    compte autant dans le modèle qu'à l'apprentissage sur le stockage"""
+    if not len(times):
+        return rows
+    known = pd.concat([state, rows], ignore_index=True)
+    return reconstruct_snapshots(known, times)
+
+
+def report(model, horizons, top):
+    """Affiche les stations les plus à risque à l'horizon le plus lointain"""
+    with span("forecast_predict"):
+        forecast = model.predict(horizons)
+    h = max(horizons)
+    risk = forecast[[f"p_empty_{h}", f"p_full_{h}"]].max(axis=1)
+    print(forecast.loc[risk.nlargest(top).index].round(2).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import math
+import json
+
+import folium
+import numpy as np
+
+from compact_map import MISSING, TIME_CONTROL_JS
+from map_colors import build_color_lut
+from spatial_index import EARTH_RADIUS
+
+# Taille par défaut des cellules (m) : rayon d'un hexagone, côté d'un carré
+GRID_CELL_SIZE = 500.0
+SQRT3 = math.sqrt(3.0)
+
+
+class CellGrid:
+    """Découpage de la ville en cellules hexagonales (ou carrées).
+
+    Les stations sont projetées en mètres autour de leur latitude moyenne
+    (comme dans spatial_index.py) puis rangées dans la cellule qui les
+    contient ; seules les cellules contenant au moins une station sont
+    gardées. `station_cell` donne la cellule de chaque station.
+    """
+
+    def __init__(self, latitudes, longitudes, size=GRID_CELL_SIZE, shape="hex"):
+        if shape not in ("hex", "square"):
+            raise ValueError(f"forme de cellule inconnue : {shape}")
+        lat = np.asarray(latitudes, dtype="float64")
+        lon = np.asarray(longitudes, dtype="float64")
+        self.size = float(size)
+        self.shape = shape
+        center = np.nanmean(lat) if len(lat) else 0.0
+        self.cos_lat = math.cos(math.radians(center))
+        x, y = self.project(lat, lon)
+        keys = np.stack(self._cells(x, y), axis=1)
+        self.cells, self.station_cell = np.unique(keys, axis=0, return_inverse=True)
+        self.station_cell = self.station_cell.ravel()
+
+    def __len__(self):
+        return len(self.cells)
+
+    def project(self, latitudes, longitudes):
+        """Coordonnées planes (m) de points géographiques"""
+        lat = np.radians(latitudes)
+        lon = np.radians(longitudes)
+        return EARTH_RADIUS * lon * self.cos_lat, EARTH_RADIUS * lat
+
+    def unproject(self, x, y):
+        """Coordonnées géographiques (degrés) de points plans"""
+        lat = np.degrees(np.asarray(y) / EARTH_RADIUS)
+        lon = np.degrees(np.asarray(x) / (EARTH_RADIUS * self.cos_lat))
+        return lat, lon
+
+    def _cells(self, x, y):
+        """Cellule (deux entiers) de points plans"""
+        if self.shape == "square":
+            return (
+                np.floor(x / self.size).astype(np.int64),
+                np.floor(y / self.size).astype(np.int64),
+            )
+        # Hexagones « pointe en haut » : coordonnées axiales arrondies en
+        # coordonnées cubiques (q + r + s = 0)
+        q = (SQRT3 / 3 * x - y / 3) / self.size
+        r = (2 / 3 * y) / self.size
+        s = -q - r
+        rq, rr, rs = np.round(q), np.round(r), np.round(s)
+        dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        rq = np.where(fix_q, -rr - rs, rq)
+        rr = np.where(fix_r, -rq - rs, rr)
+        return rq.astype(np.int64), rr.astype(np.int64)
+
+    def polygons(self):
+        """Contour (liste de [lat, lon]) de chaque cellule"""
+        a, b = self.cells[:, 0].astype("float64"), self.cells[:, 1].astype("float64")
+        if self.shape == "square":
+            corners = [(0, 0), (1, 0), (1, 1), (0, 1)]
+            x = (a[:, None] + [c[0] for c in corners]) * self.size
+            y = (b[:, None] + [c[1] for c in corners]) * self.size
+        else:
+            cx = self.size * SQRT3 * (a + b / 2)
+            cy = self.size * 1.5 * b
+            angles = np.radians(30 + 60 * np.arange(6))
+            x = cx[:, None] + self.size * np.cos(angles)
+            y = cy[:, None] + self.size * np.sin(angles)
+        lat, lon = self.unproject(x, y)
+        return np.stack([lat, lon], axis=-1).round(6).tolist()
+
+
+def aggregate_cells(grid, bikes, stands):
+    """Vélos, places libres et remplissage par cellule et par pas de temps.
+
+    `bikes` et `stands` sont des matrices stations × temps alignées sur les
+    stations de la grille (NaN si inconnu) ; une station ne compte à un
+    instant que si ses deux valeurs sont connues. Renvoie des tableaux
+    cellules × temps : bikes, stands, stations (stations comptées) et fill
+    (vélos / (vélos + places libres), NaN sans station).
+    """
+    bikes = np.asarray(bikes, dtype="float64")
+    stands = np.asarray(stands, dtype="float64")
+    known = ~(np.isnan(bikes) | np.isnan(stands))
+    shape = (len(grid), bikes.shape[1])
+
+    def cell_sum(values):
+        total = np.zeros(shape)
+        np.add.at(total, grid.station_cell, np.where(known, values, 0.0))
+        return total
+
+    cells = {
+        "bikes": cell_sum(bikes),
+        "stands": cell_sum(stands),
+        "stations": cell_sum(1.0),
+    }
+    docks = cells["bikes"] + cells["stands"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cells["fill"] = np.where(docks > 0, cells["bikes"] / docks, np.nan)
+    return cells
+
+
+def build_grid_payload(grid, cells, times, palette=None):
+    """Charge utile compacte du calque par cellules : contours stockés une
+    fois, puis pour chaque pas de temps vélos et places libres de chaque
+    cellule (MISSING si aucune station ne répond) ; le remplissage en est
+    déduit à l'affichage"""
+    missing = cells["stations"] == 0
+
+    def per_time(values):
+        values = np.where(missing, MISSING, np.round(values))
+        return values.T.astype(int).tolist()
+
+    return {
+        "times": [t.strftime("%Y-%m-%d %H:%M:%S") for t in times],
+        "cells": {
+            "polygon": grid.polygons(),
+            "stations": np.bincount(grid.station_cell, minlength=len(grid)).tolist(),
+        },
+        "palette": palette or build_color_lut().tolist(),
+        "bikes": per_time(cells["bikes"]),
+        "stands": per_time(cells["stands"]),
+    }
+
+
+# Cellules créées une seule fois, recolorées (remplissage) à chaque
+# déplacement du curseur (voir compact_map.TIME_CONTROL_JS)
+_GRID_JS = """
+(function () {
+    var map = %(map)s;
+    var data = %(payload)s;
+    var cells = data.cells, n = cells.polygon.length, current = 0;
+    var size = data.palette.length;
+    var polygons = [];
+%(time_control)s
+
+    function fill(b, s) {
+        return b + s > 0 ? b / (b + s) : 0;
+    }
+
+    for (var i = 0; i < n; i++) {
+        var polygon = L.polygon(cells.polygon[i], {
+            weight: 1, color: "#555", fillOpacity: 0
+        }).addTo(map);
+        polygon.bindPopup("");
+        polygon.on("popupopen", (function (i, polygon) {
+            return function () {
+                var b = data.bikes[current][i], s = data.stands[current][i];
+                polygon.setPopupContent(
+                    cells.stations[i] + " stations<br>Vélos dispo : " + b +
+                    "<br>Places libres : " + s + "<br>Remplissage : " +
+                    Math.round(100 * fill(b, s)) + " %%"
+                );
+            };
+        })(i, polygon));
+        polygons.push(polygon);
+    }
+
+    addTimeControl(map, data.times, "grid-time-slider", function (t) {
+        current = t;
+        var bikes = data.bikes[t], stands = data.stands[t];
+        for (var i = 0; i < n; i++) {
+            if (bikes[i] === %(missing)s) {
+                polygons[i].setStyle({fillOpacity: 0});
+                continue;
+            }
+            var k = Math.min(Math.floor(fill(bikes[i], stands[i]) * size), size - 1);
+            polygons[i].setStyle({fillColor: data.palette[k], fillOpacity: 0.6});
+        }
+    });
+})();
+"""
+
+
+def add_grid_layer(m, payload):
+    """Ajoute à la carte le calque des cellules piloté par la charge utile"""
+    script = _GRID_JS % {
+        "map": m.get_name(),
+        "payload": json.dumps(payload, separators=(",", ":")),
+        "missing": MISSING,
+        "time_control": TIME_CONTROL_JS,
+    }
+    m.get_root().script.add_child(folium.Element(script))
+    return m
+
+
+def build_grid_layer(bikes, stands, metadata, size=GRID_CELL_SIZE, shape="hex"):
+    """Grille et charge utile du calque par cellules depuis les matrices
+    stations × temps du rééchantillonnage"""
+    metadata = metadata.reindex(bikes.index)
+    located = (metadata["latitude"].notna() & metadata["longitude"].notna()).to_numpy()
+    metadata = metadata[located]
+    grid = CellGrid(metadata["latitude"], metadata["longitude"], size, shape)
+    stands = stands.reindex(index=bikes.index, columns=bikes.columns)
+    cells = aggregate_cells(grid, bikes.to_numpy()[located], stands.to_numpy()[located])
+    return grid, build_grid_payload(grid, cells, bikes.columns)
@@ -0,0 +1,347 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from compaction import choose_resolution, read_rollups
+from history_store import (
+    SCHEMA,
+    history_filter,
+    open_dataset,
+    read_snapshots,
+    reconstruct_snapshots,
+    resolve_contract,
+    store_partitions,
+)
+from stand_decoder import (
+    POSITION_FIELDS,
+    STAND_FIELDS,
+    decode_nested,
+    decode_position,
+    decode_stands,
+)
+
+# Colonnes indispensables au filtrage et au tri des lignes
+KEY_COLUMNS = ["number", "snapshot_time"]
+
+
+def _filter_frame(df, start=None, end=None, stations=None, contract=None):
+    """Garde les lignes dans [start, end[, parmi les stations demandées et du
+    contrat demandé (casse ignorée)"""
+    keep = np.ones(len(df), dtype=bool)
+    if start is not None:
+        keep &= (df["snapshot_time"] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep &= (df["snapshot_time"] < pd.Timestamp(end)).to_numpy()
+    if stations is not None:
+        keep &= df["number"].isin([int(n) for n in stations]).to_numpy()
+    if contract is not None and "contractName" in df.columns:
+        names = df["contractName"].astype(str).str.lower()
+        keep &= (names == str(contract).lower()).to_numpy()
+    return df[keep]
+
+
+def iter_csv_history(
+    csv_file,
+    start=None,
+    end=None,
+    stations=None,
+    chunksize=200_000,
+    decode=True,
+    contract=None,
+):
+    """Parcourt un CSV historique bloc par bloc en ne gardant que les lignes
+    filtrées ; seules ces lignes sont décodées (decode=False : colonnes brutes).
+
+    Sans contrat demandé, un CSV mêlant plusieurs contrats lève ValueError
+    (les numéros de stations sont propres à chaque contrat).
+    """
+    seen = set()
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+        chunk["snapshot_time"] = pd.to_datetime(chunk["snapshot_time"])
+        chunk = _filter_frame(chunk, start, end, stations, contract)
+        if chunk.empty:
+            continue
+        if contract is None and "contractName" in chunk.columns:
+            seen.update(chunk["contractName"].dropna().unique())
+            if len(seen) > 1:
+                raise ValueError(
+                    f"plusieurs contrats dans {csv_file} ({', '.join(sorted(seen))})"
+                    " : préciser le contrat (--contract)"
+                )
+        if decode:
+            chunk = decode_nested(chunk)
+        yield chunk
+
+
+def _empty_history(columns=None):
+    """Historique vide aux colonnes (typées) du stockage"""
+    df = SCHEMA.empty_table().to_pandas()
+    return df if columns is None else df.reindex(columns=columns)
+
+
+def iter_snapshots(
+    store_dir, start=None, end=None, stations=None, columns=None, contract=None
+):
+    """Parcourt les snapshots complets d'un stockage, journée par journée.
+
+    Le collecteur n'écrit que les stations modifiées (voir collect_history.py),
+    mais chaque partition commence par un snapshot complet : chaque journée est
+    reconstituée (voir reconstruct_snapshots) à tous les instants de collecte
+    (journal des snapshots et instants écrits), chaque station reprenant sa
+    dernière ligne écrite. Moyennes et reports de valeurs portent ainsi sur le
+    temps écoulé, et non sur le nombre de changements d'une station.
+
+    Un seul contrat est lu (voir resolve_contract).
+    """
+    contract = resolve_contract(store_dir, contract)
+    read = None
+    if columns is not None:
+        read = list(dict.fromkeys(KEY_COLUMNS + list(columns)))
+    first = pd.Timestamp(start).strftime("%Y-%m-%d") if start is not None else ""
+    last = pd.Timestamp(end).strftime("%Y-%m-%d") if end is not None else "9999"
+    dataset = None
+    journals = {}
+    for name, day, _ in store_partitions(store_dir):
+        if name != contract or not first <= day <= last:
+            continue
+        day_start = pd.Timestamp(day)
+        low = day_start if start is None else max(day_start, pd.Timestamp(start))
+        high = day_start + pd.Timedelta("1D")
+        if end is not None:
+            high = min(high, pd.Timestamp(end))
+        if low >= high:
+            continue
+        if dataset is None:
+            dataset = open_dataset(store_dir)
+        # Depuis le début de la journée : snapshot complet de départ
+        table = dataset.to_table(
+            columns=read or SCHEMA.names,
+            filter=history_filter(contract, day_start, high, stations),
+        )
+        if not table.num_rows:
+            continue
+        df = table.to_pandas()
+        if contract not in journals:
+            journals[contract] = read_snapshots(store_dir, contract)
+        journal = journals[contract]
+        times = pd.concat(
+            [journal[(journal >= low) & (journal < high)], df["snapshot_time"]]
+        )
+        full = _filter_frame(reconstruct_snapshots(df, times), low, high)
+        if len(full):
+            yield full if columns is None else full[list(columns)]
+
+
+def read_resolution(
+    store_dir,
+    start=None,
+    end=None,
+    stations=None,
+    columns=None,
+    resolution="auto",
+    contract=None,
+):
+    """Historique d'un stockage à une résolution donnée : "raw" (relevés
+    bruts), "15min" ou "1h" (agrégats, voir compaction.py) ou "auto"
+    (choisie selon la longueur de la période) ; None si brute.
+
+    Dans les agrégats, les disponibilités (bikes, ...) sont les moyennes sur
+    chaque pas et snapshot_time le début du pas.
+    """
+    if resolution == "auto":
+        resolution = choose_resolution(store_dir, start, end)
+    if resolution == "raw":
+        return None
+    df = read_rollups(
+        store_dir,
+        resolution,
+        contract=resolve_contract(store_dir, contract),
+        start=start,
+        end=end,
+        stations=stations,
+    )
+    return df if columns is None else df.reindex(columns=columns)
+
+
+def iter_source(
+    source,
+    start=None,
+    end=None,
+    stations=None,
+    columns=None,
+    resolution="raw",
+    contract=None,
+):
+    """Parcourt un historique (stockage ou CSV) bloc par bloc, filtré.
+
+    `resolution` (stockage seulement) permet de lire les agrégats plutôt que
+    les relevés bruts (voir read_resolution). Un seul contrat est lu : celui
+    demandé, ou le seul présent dans la source (voir resolve_contract).
+    """
+    if os.path.isdir(source):
+        if resolution != "raw":
+            df = read_resolution(
+                source, start, end, stations, columns, resolution, contract
+            )
+            if df is not None:
+                if len(df):
+                    yield df
+                return
+        yield from iter_snapshots(source, start, end, stations, columns, contract)
+        return
+    chunks = iter_csv_history(source, start, end, stations, contract=contract)
+    for chunk in chunks:
+        yield chunk[columns] if columns is not None else chunk
+
+
+def load_history(
+    source,
+    start=None,
+    end=None,
+    stations=None,
+    columns=None,
+    lazy=False,
+    resolution="raw",
+    contract=None,
+):
+    """Charge l'historique d'un stockage en colonnes (dossier) ou d'un CSV.
+
+    Seules les lignes de [start, end[, des stations et du contrat demandés
+    (voir iter_source) sont gardées,
+    en lisant le CSV bloc par bloc. Avec lazy=True, renvoie un LazyHistory dont
+    les colonnes ne sont lues ou décodées qu'au premier accès. `resolution`
+    permet de lire les agrégats d'un stockage (voir read_resolution), alors
+    renvoyés en DataFrame même avec lazy=True (ils sont peu volumineux).
+    """
+    if os.path.isdir(source) and resolution != "raw":
+        df = read_resolution(
+            source, start, end, stations, columns, resolution, contract
+        )
+        if df is not None:
+            return df
+
+    if lazy:
+        if os.path.isdir(source):
+            return LazyHistory.from_store(source, start, end, stations, contract)
+        return LazyHistory.from_csv(source, start, end, stations, contract)
+
+    chunks = list(iter_source(source, start, end, stations, columns, contract=contract))
+    if os.path.isdir(source):
+        # Journées successives d'un seul contrat, déjà triées par instant
+        if not chunks:
+            return _empty_history(columns)
+        return pd.concat(chunks, ignore_index=True)
+    if not chunks:
+        empty = pd.read_csv(source, nrows=0)
+        return decode_nested(empty) if columns is None else empty.reindex(
+            columns=columns
+        )
+    df = pd.concat(chunks, ignore_index=True)
+    return df.sort_values(KEY_COLUMNS, kind="stable").reset_index(drop=True)
+
+
+class LazyHistory:
+    """Historique filtré dont les colonnes sont chargées à la demande.
+
+    Seules les clés (numéro, instant) sont lues à la création. Les autres
+    colonnes sont lues (stockage) ou décodées (CSV) au premier accès, puis
+    gardées en mémoire.
+    """
+
+    def __init__(self, keys, loaders, order):
+        # `order` remet dans l'ordre (instant, station) les colonnes chargées
+        self._order = order
+        self._loaders = loaders
+        self._columns = {c: self._reorder(keys[c]) for c in KEY_COLUMNS}
+
+    @classmethod
+    def from_store(cls, store_dir, start=None, end=None, stations=None, contract=None):
+        """Historique paresseux lu dans le stockage en colonnes (snapshots
+        reconstitués, voir iter_snapshots : mêmes lignes pour chaque colonne)"""
+
+        def loader(columns):
+            def load():
+                chunks = list(
+                    iter_snapshots(store_dir, start, end, stations, columns, contract)
+                )
+                if not chunks:
+                    return _empty_history(columns)
+                return pd.concat(chunks, ignore_index=True)
+            return load
+
+        keys = loader(KEY_COLUMNS)()
+        names = [c for c in SCHEMA.names if c not in KEY_COLUMNS]
+        return cls(keys, {c: loader([c]) for c in names}, cls._sort_order(keys))
+
+    @classmethod
+    def from_csv(cls, csv_file, start=None, end=None, stations=None, contract=None):
+        """Historique paresseux lu dans un CSV : les colonnes imbriquées ne
+        sont décodées qu'à l'accès d'un de leurs champs"""
+        chunks = list(
+            iter_csv_history(
+                csv_file, start, end, stations, decode=False, contract=contract
+            )
+        )
+        raw = (
+            pd.concat(chunks, ignore_index=True)
+            if chunks
+            else pd.read_csv(csv_file, nrows=0)
+        )
+        loaders = {}
+        for col in raw.columns:
+            if col not in KEY_COLUMNS:
+                loaders[col] = (lambda c: lambda: raw[[c]])(col)
+        if "position" in raw.columns:
+            for field in POSITION_FIELDS:
+                loaders[field] = lambda: decode_position(raw["position"])
+        if "totalStands" in raw.columns:
+            for field in STAND_FIELDS:
+                loaders[field] = lambda: decode_stands(raw["totalStands"])
+        keys = raw[KEY_COLUMNS]
+        return cls(keys, loaders, cls._sort_order(keys))
+
+    @staticmethod
+    def _sort_order(keys):
+        """Permutation triant les lignes par instant puis par station"""
+        return np.lexsort(
+            (keys["number"].to_numpy(), keys["snapshot_time"].to_numpy())
+        )
+
+    @property
+    def columns(self):
+        return list(self._columns) + [
+            c for c in self._loaders if c not in self._columns
+        ]
+
+    @property
+    def loaded(self):
+        """Colonnes déjà chargées en mémoire"""
+        return list(self._columns)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, column):
+        return column in self._columns or column in self._loaders
+
+    def __getitem__(self, column):
+        if isinstance(column, (list, tuple)):
+            return self.to_frame(column)
+        if column not in self._columns:
+            if column not in self._loaders:
+                raise KeyError(column)
+            # Un décodage peut fournir plusieurs champs : tous sont gardés
+            loaded = self._loaders[column]()
+            for col in loaded.columns:
+                if col not in self._columns:
+                    self._columns[col] = self._reorder(loaded[col])
+        return self._columns[column]
+
+    def _reorder(self, series):
+        return series.iloc[self._order].reset_index(drop=True)
+
+    def to_frame(self, columns=None):
+        """DataFrame des colonnes demandées (toutes par défaut)"""
+        columns = self.columns if columns is None else list(columns)
+        return pd.concat([self[c] for c in columns], axis=1)
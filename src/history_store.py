@@ -0,0 +1,416 @@
+import os
+import glob
+import argparse
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from stand_decoder import decode_nested
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Répertoire par défaut du stockage historique (un sous-dossier par contrat,
+# puis par jour)
+STORE_DIR = os.path.join(BASE_DIR, "stations_history")
+
+# Partition utilisée quand le contrat est inconnu
+UNKNOWN = "unknown"
+# Fichier regroupant les fichiers d'une journée (voir compaction.py)
+COMPACTED_PREFIX = "part-compacted"
+
+# Partitionnement des fichiers : contractName=<contrat>/date=<AAAA-MM-JJ>
+PARTITIONING = ds.partitioning(
+    pa.schema([("contractName", pa.string()), ("date", pa.string())]), flavor="hive"
+)
+
+# Journal des snapshots (ignoré par la lecture Parquet grâce au préfixe "_")
+SNAPSHOTS_FILE = "_snapshots.csv"
+
+# Schéma à plat et typé des colonnes enregistrées
+SCHEMA = pa.schema(
+    [
+        ("number", pa.int32()),
+        ("contractName", pa.string()),
+        ("name", pa.string()),
+        ("address", pa.string()),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("banking", pa.bool_()),
+        ("bonus", pa.bool_()),
+        ("status", pa.string()),
+        ("lastUpdate", pa.timestamp("s", tz="UTC")),
+        ("connected", pa.bool_()),
+        ("overflow", pa.bool_()),
+        ("bikes", pa.int16()),
+        ("stands", pa.int16()),
+        ("mechanicalBikes", pa.int16()),
+        ("electricalBikes", pa.int16()),
+        ("capacity", pa.int16()),
+        ("snapshot_time", pa.timestamp("us")),
+    ]
+)
+
+# Schéma des lectures : colonnes enregistrées et jour de la partition
+DATASET_SCHEMA = SCHEMA.append(pa.field("date", pa.string()))
+
+
+def flatten_stations(stations_df):
+    """Aplatit les colonnes imbriquées de l'API en colonnes typées"""
+    return to_schema(decode_nested(stations_df))
+
+
+def to_schema(df):
+    """Aligne un DataFrame sur le schéma du stockage et le convertit en table"""
+    df = df.copy()
+    for field in SCHEMA:
+        if field.name not in df.columns:
+            df[field.name] = None
+
+    for col in ["lastUpdate", "snapshot_time"]:
+        df[col] = pd.to_datetime(df[col], format="ISO8601", utc=(col == "lastUpdate"))
+
+    for field in SCHEMA:
+        if pa.types.is_integer(field.type):
+            df[field.name] = pd.to_numeric(df[field.name], errors="coerce")
+        elif pa.types.is_boolean(field.type):
+            df[field.name] = df[field.name].map(_as_bool).astype("boolean")
+
+    return pa.Table.from_pandas(
+        df[SCHEMA.names], schema=SCHEMA, preserve_index=False, safe=False
+    )
+
+
+def _as_bool(value):
+    """Interprète les booléens relus depuis le CSV ("True"/"False")"""
+    if isinstance(value, str):
+        return {"true": True, "false": False}.get(value.lower())
+    if pd.isna(value):
+        return None
+    return bool(value)
+
+
+def contract_partition(contract):
+    """Nom de la partition d'un contrat : le nom en minuscules, comme le
+    contractName renvoyé par l'API (JCDECAUX_CONTRACT=Toulouse désigne la
+    partition « toulouse »)"""
+    if contract is None or pd.isna(contract) or not str(contract).strip():
+        return UNKNOWN
+    return str(contract).strip().lower()
+
+
+def _partition_dir(store_dir, contract, day):
+    """Chemin de la partition d'un contrat et d'une journée"""
+    return os.path.join(_contract_dir(store_dir, contract), f"date={day}")
+
+
+def _contract_dir(store_dir, contract):
+    """Dossier d'un contrat dans le stockage (données, journal des snapshots,
+    journal des lots et profils y sont rangés côte à côte)"""
+    return os.path.join(store_dir, f"contractName={contract_partition(contract)}")
+
+
+def write_table(table, store_dir=STORE_DIR, part_name=None):
+    """Écrit une table dans les partitions contrat / journée correspondantes"""
+    if table.num_rows == 0:
+        return []
+    if part_name is None:
+        part_name = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+
+    contracts = table.column("contractName").to_pandas().map(contract_partition)
+    keys = pd.DataFrame(
+        {
+            "contract": contracts,
+            "day": table.column("snapshot_time").to_pandas().dt.strftime("%Y-%m-%d"),
+        }
+    )
+    written = []
+    for (contract, day), rows in keys.groupby(["contract", "day"]):
+        path = os.path.join(
+            _partition_dir(store_dir, contract, day), f"part-{part_name}.parquet"
+        )
+        written.append(publish(table.take(rows.index.to_numpy()), path))
+    return written
+
+
+def publish(table, path):
+    """Écrit un fichier Parquet de façon atomique : écriture sous un nom
+    caché (ignoré des lectures) puis renommage, pour qu'un lecteur ne tombe
+    jamais sur un fichier à moitié écrit"""
+    directory, name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".{name}.tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+    return path
+
+
+def write_snapshot(stations_df, store_dir=STORE_DIR):
+    """Enregistre un snapshot brut de l'API dans le stockage"""
+    return write_table(flatten_stations(stations_df), store_dir)
+
+
+def store_contracts(store_dir=STORE_DIR):
+    """Contrats présents dans le stockage : partitions contenant des données
+    (un dossier de contrat sans journée n'en fait pas partie)"""
+    paths = glob.glob(os.path.join(store_dir, "contractName=*", "date=*"))
+    return sorted(
+        {os.path.basename(os.path.dirname(p)).split("=", 1)[1] for p in paths}
+    )
+
+
+def resolve_contract(store_dir=STORE_DIR, contract=None):
+    """Contrat à lire dans un stockage (nom de sa partition).
+
+    Les numéros de stations sont propres à chaque contrat : un stockage qui en
+    contient plusieurs se lit contrat par contrat. Sans contrat demandé, le
+    seul contrat du stockage est choisi (ValueError s'il y en a plusieurs) ;
+    un contrat demandé est désigné par son nom de partition (voir
+    contract_partition : JCDECAUX_CONTRACT=Toulouse lit « toulouse »).
+    """
+    contracts = store_contracts(store_dir)
+    if contract is None:
+        if len(contracts) > 1:
+            raise ValueError(
+                f"plusieurs contrats dans le stockage ({', '.join(contracts)}) : "
+                "préciser le contrat (--contract)"
+            )
+        return contracts[0] if contracts else None
+    contract = contract_partition(contract)
+    if contracts and contract not in contracts:
+        raise ValueError(
+            f"contrat {contract} absent du stockage ({', '.join(contracts)})"
+        )
+    return contract
+
+
+def store_partitions(root=STORE_DIR):
+    """Partitions (contrat, jour, dossier) d'un stockage (ou d'un dossier
+    d'agrégats), par ordre de date"""
+    found = []
+    for path in glob.glob(os.path.join(root, "contractName=*", "date=*")):
+        contract = os.path.basename(os.path.dirname(path)).split("=", 1)[1]
+        day = os.path.basename(path).split("=", 1)[1]
+        found.append((contract, day, path))
+    return sorted(found, key=lambda p: (p[1], p[0]))
+
+
+def partition_files(part_dir):
+    """Fichiers de données à lire dans une partition.
+
+    Après une compaction, le dernier fichier compacté remplace les fichiers
+    écrits avant lui : ceux-ci, pas encore supprimés (voir
+    compaction.compact_partition), sont ignorés pour ne pas compter leurs
+    lignes deux fois. Les fichiers écrits après lui sont lus.
+    """
+    files = sorted(glob.glob(os.path.join(part_dir, "*.parquet")))
+    compacted = [f for f in files if os.path.basename(f).startswith(COMPACTED_PREFIX)]
+    if not compacted:
+        return files
+    latest = compacted[-1]
+    since = os.stat(latest).st_mtime_ns
+    later = [f for f in files if f not in compacted and os.stat(f).st_mtime_ns > since]
+    return [latest] + later
+
+
+def open_dataset(store_dir=STORE_DIR):
+    """Ouvre le stockage comme un dataset Parquet partitionné.
+
+    Le schéma est imposé plutôt que déduit du premier fichier : les fichiers
+    écrits avant l'ajout d'une colonne la lisent comme nulle. Seuls les
+    fichiers en vigueur de chaque partition sont lus (voir partition_files).
+    """
+    files = [
+        path
+        for _, _, part_dir in store_partitions(store_dir)
+        for path in partition_files(part_dir)
+    ]
+    return ds.dataset(
+        files,
+        format="parquet",
+        partitioning=PARTITIONING,
+        partition_base_dir=store_dir,
+        schema=DATASET_SCHEMA,
+    )
+
+
+def history_filter(contract=None, start=None, end=None, stations=None):
+    """Expression de filtre poussée jusqu'aux fichiers Parquet.
+
+    Les bornes temporelles portent aussi sur la partition `date`, ce qui évite
+    d'ouvrir les fichiers des journées hors intervalle. `end` est exclu.
+    """
+    conditions = []
+    if contract is not None:
+        conditions.append(ds.field("contractName") == contract_partition(contract))
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions.append(ds.field("date") >= start.strftime("%Y-%m-%d"))
+        conditions.append(
+            ds.field("snapshot_time") >= pa.scalar(start, type=pa.timestamp("us"))
+        )
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions.append(ds.field("date") <= end.strftime("%Y-%m-%d"))
+        conditions.append(
+            ds.field("snapshot_time") < pa.scalar(end, type=pa.timestamp("us"))
+        )
+    if stations is not None:
+        numbers = pa.array([int(n) for n in stations], type=pa.int32())
+        conditions.append(ds.field("number").isin(numbers))
+
+    row_filter = None
+    for condition in conditions:
+        row_filter = condition if row_filter is None else row_filter & condition
+    return row_filter
+
+
+def _sort_history(df):
+    """Trie l'historique par instant puis par station"""
+    keys = [c for c in ("snapshot_time", "number") if c in df.columns]
+    if keys:
+        df = df.sort_values(keys, kind="stable")
+    return df.reset_index(drop=True)
+
+
+def read_history(
+    store_dir=STORE_DIR,
+    columns=None,
+    contract=None,
+    start=None,
+    end=None,
+    stations=None,
+):
+    """Lit l'historique du stockage en DataFrame typé.
+
+    Les filtres (contrat, intervalle [start, end[, numéros de stations) sont
+    appliqués à la lecture : seules les partitions et lignes concernées sont
+    chargées en mémoire.
+    """
+    table = open_dataset(store_dir).to_table(
+        columns=columns or SCHEMA.names,
+        filter=history_filter(contract, start, end, stations),
+    )
+    return _sort_history(table.to_pandas())
+
+
+def iter_history(
+    store_dir=STORE_DIR,
+    columns=None,
+    contract=None,
+    start=None,
+    end=None,
+    stations=None,
+    batch_size=100_000,
+):
+    """Parcourt l'historique filtré bloc par bloc, sans tout matérialiser"""
+    batches = open_dataset(store_dir).to_batches(
+        columns=columns or SCHEMA.names,
+        filter=history_filter(contract, start, end, stations),
+        batch_size=batch_size,
+    )
+    for batch in batches:
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def record_snapshot(store_dir, snapshot_time, stations, written, contract=UNKNOWN):
+    """Consigne un snapshot dans le journal, même si aucune ligne n'a changé"""
+    contract_dir = _contract_dir(store_dir, contract)
+    os.makedirs(contract_dir, exist_ok=True)
+    path = os.path.join(contract_dir, SNAPSHOTS_FILE)
+    new_file = not os.path.isfile(path)
+    with open(path, "a", encoding="utf-8") as f:
+        if new_file:
+            f.write("snapshot_time,stations,written\n")
+        f.write(f"{snapshot_time},{stations},{written}\n")
+
+
+def read_snapshots(store_dir=STORE_DIR, contract=UNKNOWN):
+    """Liste des instants de collecte d'un contrat consignés dans le journal"""
+    path = os.path.join(_contract_dir(store_dir, contract), SNAPSHOTS_FILE)
+    if not os.path.isfile(path):
+        return pd.Series(dtype="datetime64[us]", name="snapshot_time")
+    snapshots = pd.read_csv(path)
+    return pd.to_datetime(snapshots["snapshot_time"], format="ISO8601")
+
+
+def reconstruct_snapshots(df, snapshot_times=None):
+    """Reconstruit des snapshots complets à partir des seules lignes modifiées.
+
+    Pour chaque instant de `snapshot_times` (par défaut les instants présents
+    dans `df`), chaque station reprend sa dernière ligne connue. Les instants
+    étant propres à chaque contrat, `df` ne doit en contenir qu'un seul.
+    """
+    if snapshot_times is None:
+        snapshot_times = df["snapshot_time"].unique()
+    times = pd.DataFrame(
+        {"snapshot_time": pd.to_datetime(pd.Series(snapshot_times)).unique()}
+    )
+    grid = times.merge(pd.DataFrame({"number": df["number"].unique()}), how="cross")
+    grid = grid.sort_values("snapshot_time", kind="stable")
+
+    rows = df.rename(columns={"snapshot_time": "observed_time"})
+    rows = rows.sort_values("observed_time", kind="stable")
+    full = pd.merge_asof(
+        grid,
+        rows,
+        left_on="snapshot_time",
+        right_on="observed_time",
+        by="number",
+        direction="backward",
+    )
+    full = full.dropna(subset=["observed_time"]).drop(columns="observed_time")
+    return full.sort_values(["snapshot_time", "number"]).reset_index(drop=True)
+
+
+def convert_csv(csv_file, store_dir=STORE_DIR, chunksize=200_000):
+    """Migre un historique CSV existant vers le stockage en colonnes.
+
+    Chaque instant du CSV est consigné dans le journal de son contrat (voir
+    record_snapshot), une fois même s'il s'étend sur deux blocs : toutes les
+    lignes d'un snapshot sont écrites.
+    """
+    total = 0
+    counts = []
+    for i, chunk in enumerate(pd.read_csv(csv_file, chunksize=chunksize)):
+        table = flatten_stations(chunk)
+        write_table(table, store_dir, part_name=f"csv{i:05d}")
+        keys = pd.DataFrame(
+            {
+                "contract": table.column("contractName")
+                .to_pandas()
+                .map(contract_partition),
+                "snapshot_time": table.column("snapshot_time").to_pandas(),
+            }
+        )
+        counts.append(keys.value_counts())
+        total += len(chunk)
+    if counts:
+        counts = pd.concat(counts).groupby(level=[0, 1]).sum().sort_index()
+        for (contract, snapshot_time), rows in counts.items():
+            record_snapshot(
+                store_dir, snapshot_time.isoformat(), rows, rows, contract
+            )
+    return total
+
+
+def main():
+    """Conversion ponctuelle d'un historique CSV"""
+    parser = argparse.ArgumentParser(
+        description="Convertit stations_history.csv vers le stockage Parquet"
+    )
+    parser.add_argument(
+        "csv_file", nargs="?", default=os.path.join(BASE_DIR, "stations_history.csv")
+    )
+    parser.add_argument("--store", default=STORE_DIR)
+    args = parser.parse_args()
+
+    total = convert_csv(args.csv_file, args.store)
+    print(f"{total} lignes converties vers {args.store}")
+
+
+if __name__ == "__main__":
+    main()
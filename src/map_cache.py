@@ -0,0 +1,232 @@
+import os
+import json
+import glob
+import shutil
+
+import pandas as pd
+
+from compaction import choose_resolution
+from history_loader import load_history
+from history_store import resolve_contract
+from map_colors import color_bounds
+from resampling import resample_stations, station_metadata
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Dossier par défaut du cache de la carte (un fichier par jour)
+CACHE_DIR = os.path.join(BASE_DIR, "map_cache")
+META_FILE = "meta.json"
+STATIONS_FILE = "stations.parquet"
+# Colonnes lues dans l'historique (vélos et métadonnées des stations)
+COLUMNS = ["number", "snapshot_time", "bikes", "name", "latitude", "longitude"]
+
+
+class MapCache:
+    """Cache des matrices rééchantillonnées et des Features, un bloc par jour"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def load_meta(self):
+        """Paramètres du cache (fréquence, bornes de couleurs, ...)"""
+        path = self._path(META_FILE)
+        if not os.path.isfile(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_meta(self, meta):
+        """Enregistre les paramètres du cache"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._path(META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+    def clear(self):
+        """Vide le cache"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def days(self):
+        """Journées présentes dans le cache, dans l'ordre"""
+        paths = glob.glob(self._path("bikes-*.parquet"))
+        names = [os.path.basename(p) for p in paths]
+        return sorted(n.replace("bikes-", "").replace(".parquet", "") for n in names)
+
+    def read_day(self, day):
+        """Matrice stations × temps d'une journée"""
+        by_time = pd.read_parquet(self._path(f"bikes-{day}.parquet"))
+        by_time.columns = by_time.columns.astype(int)
+        return by_time.T.rename_axis("number")
+
+    def write_day(self, day, bikes):
+        """Enregistre la matrice stations × temps d'une journée"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        by_time = bikes.T
+        by_time.columns = by_time.columns.astype(str)
+        by_time.to_parquet(self._path(f"bikes-{day}.parquet"))
+
+    def read_features(self, day):
+        """Features GeoJSON d'une journée"""
+        path = self._path(f"features-{day}.json")
+        if not os.path.isfile(path):
+            return []
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_features(self, day, features):
+        """Enregistre les Features GeoJSON d'une journée"""
+        with open(self._path(f"features-{day}.json"), "w", encoding="utf-8") as f:
+            json.dump(features, f, separators=(",", ":"))
+
+    def read_stations(self):
+        """Métadonnées des stations (nom, coordonnées)"""
+        path = self._path(STATIONS_FILE)
+        if not os.path.isfile(path):
+            return None
+        return pd.read_parquet(path)
+
+    def write_stations(self, metadata):
+        """Enregistre les métadonnées des stations"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        metadata.to_parquet(self._path(STATIONS_FILE))
+
+    def last_time(self):
+        """Dernier pas de temps présent dans le cache"""
+        days = self.days()
+        if not days:
+            return None
+        return self.read_day(days[-1]).columns.max()
+
+    def read_bikes(self):
+        """Matrice stations × temps complète, réassemblée depuis les blocs"""
+        chunks = [self.read_day(day) for day in self.days()]
+        if not chunks:
+            return pd.DataFrame(dtype="float32")
+        return pd.concat(chunks, axis=1).sort_index()
+
+
+def update_cache(
+    cache,
+    store_dir,
+    freq="15min",
+    max_staleness="1h",
+    bounds=None,
+    build_features=None,
+    start=None,
+    end=None,
+    stations=None,
+    resolution="auto",
+    contract=None,
+):
+    """Met à jour le cache avec les seuls pas de temps postérieurs au dernier
+    pas en cache ; renvoie (matrice complète, métadonnées, (vmin, vmax)).
+
+    `bounds` fige les bornes de couleurs ; sinon celles du premier calcul sont
+    conservées dans le cache pour que les couleurs restent stables d'un bloc à
+    l'autre. `build_features(bikes, metadata, vmin, vmax)` construit les
+    Features GeoJSON d'un bloc (None : pas de Features en cache). La période
+    [start, end[, les stations, la résolution et le contrat sont ceux de la
+    lecture (voir history_loader.load_history) : en changer reconstruit le
+    cache.
+    """
+    if os.path.isdir(store_dir):
+        contract = resolve_contract(store_dir, contract)
+        if resolution == "auto":
+            # Même résolution pour tous les blocs, fixée par la période demandée
+            resolution = choose_resolution(store_dir, start, end)
+    params = {
+        "freq": freq,
+        "max_staleness": max_staleness,
+        "features": build_features is not None,
+        "start": None if start is None else str(pd.Timestamp(start)),
+        "end": None if end is None else str(pd.Timestamp(end)),
+        "stations": None if stations is None else sorted(int(n) for n in stations),
+        "resolution": resolution,
+        "contract": contract,
+    }
+    pinned = [float(b) for b in bounds] if bounds is not None else None
+    meta = cache.load_meta()
+    if (
+        meta is None
+        or meta["params"] != params
+        or (pinned is not None and meta["bounds"] != pinned)
+    ):
+        # Paramètres modifiés : reconstruction complète
+        cache.clear()
+        meta = {"params": params, "bounds": pinned}
+
+    last = cache.last_time()
+    step = pd.Timedelta(freq)
+    if last is None:
+        grid_start = None
+        read_start = start
+    else:
+        # Relire juste assez d'historique pour la tolérance de report
+        lookback = pd.Timedelta(max_staleness) if max_staleness is not None else step
+        grid_start = last + step
+        read_start = grid_start - lookback
+        if start is not None:
+            read_start = max(read_start, pd.Timestamp(start))
+    if end is not None and grid_start is not None and grid_start >= pd.Timestamp(end):
+        df = pd.DataFrame(columns=COLUMNS)
+    else:
+        df = load_history(
+            store_dir,
+            read_start,
+            end,
+            stations,
+            COLUMNS,
+            resolution=resolution,
+            contract=contract,
+        )
+
+    metadata = cache.read_stations()
+    if not df.empty:
+        latest = station_metadata(df)
+        metadata = latest if metadata is None else latest.combine_first(metadata)
+        cache.write_stations(metadata)
+
+    new_bikes = None
+    if not df.empty and (
+        grid_start is None or df["snapshot_time"].max() >= grid_start
+    ):
+        new_bikes = resample_stations(
+            df, "bikes", freq, max_staleness, start=grid_start
+        )
+        if last is not None and max_staleness is None:
+            # Sans limite de report : repartir des dernières valeurs en cache
+            previous = cache.read_day(cache.days()[-1])[[last]]
+            seeded = pd.concat([previous, new_bikes], axis=1).ffill(axis=1)
+            new_bikes = seeded.drop(columns=[last])
+
+    if meta["bounds"] is None and new_bikes is not None:
+        meta["bounds"] = [float(b) for b in color_bounds(new_bikes)]
+    vmin, vmax = meta["bounds"] or (0.0, 1.0)
+
+    if new_bikes is not None:
+        days = new_bikes.columns.strftime("%Y-%m-%d")
+        cached_days = set(cache.days())
+        for day in sorted(set(days)):
+            chunk = new_bikes.loc[:, days == day]
+            features = []
+            if build_features is not None:
+                if day in cached_days:
+                    features = cache.read_features(day)
+                gj = build_features(chunk, metadata, vmin, vmax)
+                cache.write_features(day, features + gj["features"])
+            if day in cached_days:
+                chunk = pd.concat([cache.read_day(day), chunk], axis=1)
+            cache.write_day(day, chunk)
+
+    cache.save_meta(meta)
+    return cache.read_bikes(), metadata, (vmin, vmax)
+
+
+def cached_features(cache):
+    """Toutes les Features GeoJSON en cache, dans l'ordre des journées"""
+    features = []
+    for day in cache.days():
+        features += cache.read_features(day)
+    return features
@@ -0,0 +1,43 @@
+import matplotlib
+import matplotlib.colors as mcolors
+import numpy as np
+
+# Nombre d'entrées de la table (résolution native des colormaps matplotlib)
+LUT_SIZE = 256
+
+
+def build_color_lut(cmap_name="RdYlGn", n=LUT_SIZE):
+    """Table des couleurs hexadécimales précalculée pour une colormap"""
+    cmap = matplotlib.colormaps[cmap_name].resampled(n)
+    return np.array([mcolors.rgb2hex(rgb[:3]) for rgb in cmap(np.arange(n))])
+
+
+def color_indices(values, vmin, vmax, n=LUT_SIZE):
+    """Quantifie des valeurs sur les entrées de la table, comme le ferait
+    cmap(Normalize(vmin, vmax)(val)) avec des valeurs bornées à [vmin, vmax]"""
+    values = np.asarray(values, dtype="float64")
+    span = vmax - vmin
+    if span > 0:
+        x = (np.clip(values, vmin, vmax) - vmin) / span
+    else:
+        x = np.zeros_like(values)
+    return np.minimum((x * n).astype(int), n - 1)
+
+
+def colors_for(values, vmin, vmax, lut):
+    """Couleurs hexadécimales d'un tableau de valeurs"""
+    return lut[color_indices(values, vmin, vmax, len(lut))]
+
+
+def color_bounds(bikes):
+    """Bornes du gradient de couleurs"""
+    # Nouveau gradient : seuil vert atteint à un nombre de vélos plus bas
+    # (ex: 80e percentile)
+    values = bikes.to_numpy()
+    min_bikes = np.nanmin(values)
+    # On prend le 80e percentile comme seuil "vert"
+    green_threshold = np.nanquantile(values, 0.8)
+    # On fixe le max du gradient à ce seuil (ou à 10 si tu préfères)
+    vmax = max(green_threshold, 1)  # éviter vmax trop bas
+    vmin = min_bikes
+    return vmin, vmax
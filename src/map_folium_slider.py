@@ -1,128 +1,296 @@
 import os
+import time
+import argparse
+from functools import partial
+import numpy as np
 import pandas as pd
 import folium
-import ast
 from folium.plugins import TimestampedGeoJson
-from matplotlib import cm
-import matplotlib.colors as mcolors
+
+from compact_map import build_payload, save_compact_map
+from compact_history import CompactHistory
+from hex_grid import GRID_CELL_SIZE, add_grid_layer, build_grid_layer
+from history_loader import iter_source
+from history_store import STORE_DIR
+from map_cache import CACHE_DIR, MapCache, cached_features, update_cache
+from map_colors import build_color_lut, color_bounds, colors_for
+from metrics import METRICS, configure_metrics, incr, span
+from resampling import resample_stations
 
 # Chemin du fichier CSV
 data_file = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "stations_history.csv"
 )
 
-# Lecture des données
-df = pd.read_csv(data_file)
-df["snapshot_time"] = pd.to_datetime(df["snapshot_time"])
-
-
-def extract_lat_lon(pos_str):
-    try:
-        pos_dict = ast.literal_eval(pos_str)
-        return pos_dict.get("latitude", None), pos_dict.get("longitude", None)
-    except Exception:
-        return None, None
-
-
-def extract_bikes(main_stands_str):
-    try:
-        d = ast.literal_eval(main_stands_str)
-        return d.get("availabilities", {}).get("bikes", None)
-    except Exception:
-        return None
-
-
-df["latitude"], df["longitude"] = zip(*df["position"].map(extract_lat_lon))
-df["bikes"] = df["mainStands"].map(extract_bikes)
-df["latitude"] = pd.to_numeric(df["latitude"], errors="coerce")
-df["longitude"] = pd.to_numeric(df["longitude"], errors="coerce")
-
-# Générer la grille temporelle régulière (toutes les 15 minutes)
-min_time = df["snapshot_time"].min()
-max_time = df["snapshot_time"].max()
-all_times = pd.date_range(start=min_time, end=max_time, freq="15T")
-
-# Forward fill par station
-stations = df["number"].unique()
-filled_rows = []
-for station in stations:
-    station_df = df[df["number"] == station].set_index("snapshot_time").sort_index()
-    # Reindex sur la grille régulière
-    station_df = station_df.reindex(all_times, method="ffill")
-    # Remettre l'identifiant de la station (car perdu lors du reindex)
-    station_df["number"] = station
-    filled_rows.append(station_df)
-
-filled_df = (
-    pd.concat(filled_rows).reset_index().rename(columns={"index": "snapshot_time"})
+# Carte générée
+output_file = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "map_slider.html"
 )
 
-# Nouveau gradient : seuil vert atteint à un nombre de vélos plus bas (ex: 80e percentile)
-min_bikes = filled_df["bikes"].min()
-# On prend le 80e percentile comme seuil "vert"
-green_threshold = filled_df["bikes"].quantile(0.8)
-# On fixe le max du gradient à ce seuil (ou à 10 si tu préfères)
-vmax = max(green_threshold, 1)  # éviter vmax trop bas
-vmin = min_bikes
-
-
-def color_scale(val, vmin, vmax):
-    # Clamp la valeur pour éviter tout débordement
-    val = max(min(val, vmax), vmin)
-    norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
-    cmap = cm.get_cmap("RdYlGn")
-    rgb = cmap(norm(val))[:3]
-    return mcolors.rgb2hex(rgb)
-
-
-# Construction du GeoJSON temporel
-features = []
-for _, row in filled_df.iterrows():
-    if pd.isna(row["latitude"]) or pd.isna(row["longitude"]) or pd.isna(row["bikes"]):
-        continue
-    color = color_scale(row["bikes"], min_bikes, max_bikes)
-    feature = {
-        "type": "Feature",
-        "geometry": {
-            "type": "Point",
-            "coordinates": [row["longitude"], row["latitude"]],
-        },
-        "properties": {
-            "time": row["snapshot_time"].strftime("%Y-%m-%dT%H:%M:%S"),
-            "style": {
-                "color": color,
-                "fillColor": color,
-                "fillOpacity": 0.7,
-                "radius": 8,
+
+def load_history(
+    store_dir=STORE_DIR,
+    start=None,
+    end=None,
+    stations=None,
+    resolution="auto",
+    extra_columns=(),
+    contract=None,
+):
+    """Lecture des données : stockage en colonnes si disponible, sinon CSV.
+
+    Seules la période [start, end[ et les stations demandées sont chargées,
+    bloc par bloc, dans un historique compact (voir compact_history.py). Une
+    longue période est lue dans les agrégats du stockage (voir compaction.py).
+    Un stockage multi-contrats est lu contrat par contrat (`contract`).
+    """
+    source = store_dir if os.path.isdir(store_dir) else data_file
+    columns = ["number", "snapshot_time", "bikes", "name", "latitude", "longitude"]
+    columns += list(extra_columns)
+    return CompactHistory.from_chunks(
+        iter_source(source, start, end, stations, columns, resolution, contract)
+    )
+
+
+def iso_duration(freq):
+    """Durée ISO 8601 (ex. PT15M) correspondant à une fréquence pandas"""
+    seconds = int(pd.Timedelta(freq).total_seconds())
+    if seconds % 60:
+        return f"PT{seconds}S"
+    return f"PT{seconds // 60}M"
+
+
+def build_geojson(bikes, metadata, vmin, vmax, lut=None):
+    """Construction du GeoJSON temporel (une Feature par station et par pas).
+
+    Les couleurs sont lues dans une table précalculée et toutes les valeurs
+    sont préparées par colonnes avant l'assemblage des Features.
+    """
+    if lut is None:
+        lut = build_color_lut()
+
+    metadata = metadata.reindex(bikes.index)
+    located = (metadata["latitude"].notna() & metadata["longitude"].notna()).to_numpy()
+    values = bikes.to_numpy()[located]
+    metadata = metadata[located]
+
+    # Indices (station, pas) des valeurs connues, dans l'ordre des pas de temps
+    time_idx, station_idx = np.nonzero(~np.isnan(values.T))
+    counts = values[station_idx, time_idx].round().astype(int)
+
+    times = bikes.columns.strftime("%Y-%m-%dT%H:%M:%S").to_numpy()[time_idx]
+    colors = colors_for(counts, vmin, vmax, lut)
+    lons = metadata["longitude"].to_numpy()[station_idx]
+    lats = metadata["latitude"].to_numpy()[station_idx]
+    names = metadata["name"].fillna("").to_numpy()[station_idx]
+
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {
+                "time": time,
+                "style": {
+                    "color": color,
+                    "fillColor": color,
+                    "fillOpacity": 0.7,
+                    "radius": 8,
+                },
+                "icon": "circle",
+                "popup": f"{name}<br>Vélos dispo : {count}",
             },
-            "icon": "circle",
-            "popup": f"{row['name']}<br>Vélos dispo : {row['bikes']}",
-        },
+        }
+        for lon, lat, time, color, name, count in zip(
+            lons.tolist(),
+            lats.tolist(),
+            times,
+            colors,
+            names,
+            counts.tolist(),
+        )
+    ]
+
+    return {
+        "type": "FeatureCollection",
+        "features": features,
     }
-    features.append(feature)
-
-gj = {
-    "type": "FeatureCollection",
-    "features": features,
-}
-
-m = folium.Map(location=[43.6045, 1.4440], zoom_start=13)
-
-TimestampedGeoJson(
-    gj,
-    period="PT15M",
-    add_last_point=True,
-    auto_play=False,
-    loop=False,
-    max_speed=1,
-    loop_button=True,
-    date_options="YYYY-MM-DD HH:mm:ss",
-    time_slider_drag_update=True,
-    duration="PT15M",
-).add_to(m)
 
-output_file = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)), "map_slider.html"
-)
-m.save(output_file)
-print(f"Carte interactive générée : {output_file}")
+
+def add_geojson_layer(m, gj, freq):
+    """Ajoute le calque TimestampedGeoJson à la carte"""
+    TimestampedGeoJson(
+        gj,
+        period=iso_duration(freq),
+        add_last_point=True,
+        auto_play=False,
+        loop=False,
+        max_speed=1,
+        loop_button=True,
+        date_options="YYYY-MM-DD HH:mm:ss",
+        time_slider_drag_update=True,
+        duration=iso_duration(freq),
+    ).add_to(m)
+
+
+def main():
+    """Génère la carte interactive temporelle"""
+    parser = argparse.ArgumentParser(description="Carte temporelle des stations")
+    parser.add_argument("--freq", default="15min", help="pas de la grille temporelle")
+    parser.add_argument(
+        "--max-staleness",
+        default="1h",
+        help="âge maximal d'une valeur reportée sur la grille ('none' : illimité)",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["geojson", "compact", "grid"],
+        default="geojson",
+        help="compact : géométrie stockée une fois + tableaux de vélos par pas ; "
+        "grid : disponibilité agrégée par quartier (cellules)",
+    )
+    parser.add_argument(
+        "--cell-size",
+        type=float,
+        default=GRID_CELL_SIZE,
+        help="(grid) taille des cellules en mètres",
+    )
+    parser.add_argument(
+        "--grid-shape", choices=["hex", "square"], default="hex", help="(grid)"
+    )
+    parser.add_argument(
+        "--external-data",
+        action="store_true",
+        help="(compact) données dans un fichier JSON gzip à côté du HTML",
+    )
+    parser.add_argument(
+        "--no-gzip", action="store_true", help="(compact) fichier JSON non compressé"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="ne traite que les pas de temps postérieurs au cache",
+    )
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument(
+        "--vmin", type=float, default=None, help="borne basse fixe des couleurs"
+    )
+    parser.add_argument(
+        "--vmax", type=float, default=None, help="borne haute fixe des couleurs"
+    )
+    parser.add_argument("--start", default=None, help="début de la période chargée")
+    parser.add_argument("--end", default=None, help="fin (exclue) de la période")
+    parser.add_argument(
+        "--stations",
+        type=lambda s: [int(n) for n in s.split(",")],
+        default=None,
+        help="numéros de stations séparés par des virgules",
+    )
+    parser.add_argument(
+        "--resolution",
+        choices=["auto", "raw", "15min", "1h"],
+        default="auto",
+        help="relevés bruts ou agrégats du stockage (auto : selon la période)",
+    )
+    parser.add_argument(
+        "--contract",
+        default=os.getenv("JCDECAUX_CONTRACT"),
+        help="contrat lu dans un stockage multi-contrats",
+    )
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--output", default=output_file)
+    args = parser.parse_args()
+    if args.mode == "grid" and args.incremental:
+        parser.error("--mode grid ne fonctionne pas avec --incremental")
+    max_staleness = None if args.max_staleness.lower() == "none" else args.max_staleness
+    if (args.vmin is None) != (args.vmax is None):
+        parser.error("--vmin et --vmax se précisent ensemble")
+    pinned = None
+    if args.vmin is not None:
+        pinned = (args.vmin, args.vmax)
+
+    lut = build_color_lut()
+    configure_metrics()
+    build_start = time.perf_counter()
+
+    if args.incremental:
+        # Seuls les nouveaux pas de temps sont rééchantillonnés et convertis
+        cache = MapCache(args.cache_dir)
+        build_features = None
+        if args.mode == "geojson":
+            build_features = partial(build_geojson, lut=lut)
+
+        with span("update_cache"):
+            bikes, metadata, (vmin, vmax) = update_cache(
+                cache,
+                args.store,
+                args.freq,
+                max_staleness,
+                pinned,
+                build_features,
+                args.start,
+                args.end,
+                args.stations,
+                args.resolution,
+                args.contract,
+            )
+    else:
+        with span("load_history"):
+            history = load_history(
+                args.store,
+                args.start,
+                args.end,
+                args.stations,
+                args.resolution,
+                ["stands"] if args.mode == "grid" else (),
+                args.contract,
+            )
+        incr("rows_loaded", len(history.rows))
+
+        # Aligner toutes les stations sur la grille régulière (stations × temps)
+        with span("resample"):
+            df = history.to_frame(["number", "snapshot_time", "bikes"])
+            bikes = resample_stations(df, "bikes", args.freq, max_staleness)
+        metadata = history.stations[["name", "latitude", "longitude"]]
+        vmin, vmax = pinned or color_bounds(bikes)
+
+    m = folium.Map(location=[43.6045, 1.4440], zoom_start=13)
+
+    if args.mode == "grid":
+        # Places libres sur la même grille (stations × temps) que les vélos
+        with span("resample"):
+            df = history.to_frame(["number", "snapshot_time", "stands"])
+            grid = bikes.columns
+            stands = resample_stations(
+                df, "stands", args.freq, max_staleness, grid[0], grid[-1]
+            )
+        with span("features", mode=args.mode):
+            _, payload = build_grid_layer(
+                bikes, stands, metadata, args.cell_size, args.grid_shape
+            )
+            add_grid_layer(m, payload)
+        with span("save_html", mode=args.mode):
+            m.save(args.output)
+    elif args.mode == "compact":
+        with span("features", mode=args.mode):
+            payload = build_payload(bikes, metadata, vmin, vmax, lut.tolist())
+        with span("save_html", mode=args.mode):
+            save_compact_map(
+                m, payload, args.output, args.external_data, not args.no_gzip
+            )
+    else:
+        with span("features", mode=args.mode):
+            if args.incremental:
+                features = cached_features(cache)
+                gj = {"type": "FeatureCollection", "features": features}
+            else:
+                gj = build_geojson(bikes, metadata, vmin, vmax, lut)
+            add_geojson_layer(m, gj, args.freq)
+        with span("save_html", mode=args.mode):
+            m.save(args.output)
+    METRICS.observe("map_build", time.perf_counter() - build_start, mode=args.mode)
+    incr("html_bytes", os.path.getsize(args.output))
+    print(f"Carte interactive générée : {args.output}")
+
+
+if __name__ == "__main__":
+    main()
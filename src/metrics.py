@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Préfixe des métriques exportées
+PREFIX = "velo_"
+# Journal JSON (une ligne par étape) et fichier texte au format Prometheus,
+# activés par variables d'environnement ou par configure_metrics()
+LOG_ENV = "METRICS_LOG"
+PROM_ENV = "METRICS_FILE"
+# Description des métriques exportées (les autres portent leur nom)
+HELP = {
+    "stage_seconds": "Durée des étapes du pipeline (secondes)",
+    "stage_last_seconds": "Durée de la dernière exécution de l'étape (secondes)",
+    "stage_max_seconds": "Durée maximale de l'étape (secondes)",
+    "stage_errors_total": "Exécutions de l'étape terminées en erreur",
+    "peak_rss_bytes": "Pic de mémoire résidente du processus (octets)",
+}
+
+
+def peak_rss():
+    """Pic de mémoire résidente du processus (octets, None si indisponible)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kio sous Linux, octets sous macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _labels(labels):
+    """Clé hachable et triée des étiquettes d'une mesure"""
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Metrics:
+    """Registre des mesures d'un processus : durées des étapes, compteurs et
+    jauges, sous un verrou (collecteurs multi-threads).
+
+    Une mesure ne coûte que deux lectures d'horloge et une mise à jour de
+    dictionnaire ; le journal JSON n'est écrit que s'il est configuré et le
+    fichier Prometheus à la demande (export), ce qui permet de laisser
+    l'instrumentation active en production.
+    """
+
+    def __init__(self, log_file=None, prom_file=None):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.log_file = log_file
+        self.prom_file = prom_file
+        self._log = None
+
+    def configure(self, log_file=None, prom_file=None):
+        """Fichiers de sortie (par défaut : METRICS_LOG et METRICS_FILE)"""
+        with self.lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self.log_file = log_file or os.getenv(LOG_ENV)
+            self.prom_file = prom_file or os.getenv(PROM_ENV)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Mesure la durée d'une étape (bloc with), même en cas d'erreur"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, error, **labels)
+
+    def observe(self, stage, seconds, error=None, **labels):
+        """Enregistre la durée d'une étape"""
+        key = (stage, _labels(labels))
+        with self.lock:
+            stats = self.stages.get(key)
+            if stats is None:
+                stats = self.stages[key] = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "max": 0.0,
+                    "errors": 0,
+                }
+            stats["count"] += 1
+            stats["sum"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["last"] = seconds
+            stats["errors"] += error is not None
+        if self.log_file:
+            record = {"stage": stage, "seconds": round(seconds, 6)}
+            record.update(labels)
+            if error:
+                record["error"] = error
+            record["peak_rss_mb"] = round((peak_rss() or 0) / 1e6, 1)
+            self.log("span", record)
+
+    def incr(self, name, value=1, **labels):
+        """Ajoute `value` à un compteur (lignes, octets, erreurs, ...)"""
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Fixe la valeur d'une jauge (ex. horodatage du dernier snapshot)"""
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def log(self, event, record):
+        """Ajoute une ligne au journal JSON"""
+        line = {"time": datetime.now().isoformat(timespec="milliseconds")}
+        line["event"] = event
+        line.update(record)
+        text = json.dumps(line, default=str, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self._log is None:
+                self._log = open(self.log_file, "a", encoding="utf-8")
+            self._log.write(text)
+            self._log.flush()
+
+    def snapshot(self):
+        """Copie des mesures (étapes, compteurs, jauges)"""
+        with self.lock:
+            return (
+                {k: dict(v) for k, v in self.stages.items()},
+                dict(self.counters),
+                dict(self.gauges),
+            )
+
+    def to_prometheus(self):
+        """Mesures au format texte de Prometheus"""
+        stages, counters, gauges = self.snapshot()
+        gauges[("peak_rss_bytes", ())] = peak_rss()
+        families = {}
+
+        def add(name, kind, suffix, labels, value):
+            samples = families.setdefault(name, (kind, []))[1]
+            samples.append((suffix, labels, value))
+
+        for (stage, labels), stats in sorted(stages.items()):
+            labels = (("stage", stage),) + labels
+            add("stage_seconds", "summary", "_sum", labels, round(stats["sum"], 6))
+            add("stage_seconds", "summary", "_count", labels, stats["count"])
+            add("stage_last_seconds", "gauge", "", labels, round(stats["last"], 6))
+            add("stage_max_seconds", "gauge", "", labels, round(stats["max"], 6))
+            add("stage_errors_total", "counter", "", labels, stats["errors"])
+        for (name, labels), value in sorted(counters.items()):
+            add(f"{name}_total", "counter", "", labels, value)
+        for (name, labels), value in sorted(gauges.items()):
+            if value is not None:
+                add(name, "gauge", "", labels, value)
+
+        lines = []
+        for name, (kind, samples) in families.items():
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{PREFIX}{name}{suffix}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path=None):
+        """Écrit le fichier Prometheus (remplacé d'un coup, jamais lu à moitié)"""
+        path = path or self.prom_file
+        if not path:
+            return None
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+        return path
+
+
+# Registre du processus, partagé par tous les scripts
+METRICS = Metrics(os.getenv(LOG_ENV), os.getenv(PROM_ENV))
+span = METRICS.span
+incr = METRICS.incr
+set_gauge = METRICS.set_gauge
+export_metrics = METRICS.export
+
+
+def configure_metrics(log_file=None, prom_file=None):
+    """Active les sorties des mesures (par défaut : variables d'environnement
+    METRICS_LOG et METRICS_FILE) ; le fichier Prometheus est aussi écrit à la
+    fin du processus"""
+    METRICS.configure(log_file, prom_file)
+    atexit.unregister(METRICS.export)
+    if METRICS.prom_file:
+        atexit.register(METRICS.export)
@@ -0,0 +1,241 @@
+import os
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from collect_history import (
+    API_KEY,
+    API_URL,
+    ChangeTracker,
+    collect_snapshot,
+    create_session,
+    describe_error,
+    fetch_stations,
+    next_delay,
+)
+from anomaly_detector import AnomalyDetector, events_path
+from history_store import STORE_DIR
+from metrics import configure_metrics, export_metrics, incr
+from snapshot_log import SnapshotLog, log_dir
+from station_profiles import StationProfiles, profiles_path
+
+# Contrats à collecter (séparés par des virgules), par défaut le contrat unique
+CONTRACTS = os.getenv("JCDECAUX_CONTRACTS", os.getenv("JCDECAUX_CONTRACT") or "")
+CONTRACTS_URL = os.getenv(
+    "JCDECAUX_CONTRACTS_URL", "https://api.jcdecaux.com/vls/v3/contracts"
+)
+
+
+def list_contracts(session, contracts_url=CONTRACTS_URL, timeout=10):
+    """Liste tous les contrats JCDecaux disponibles"""
+    response = session.get(contracts_url, params={"apiKey": API_KEY}, timeout=timeout)
+    response.raise_for_status()
+    return [contract["name"] for contract in response.json()]
+
+
+class ContractPoller:
+    """État de collecte d'un contrat : session, suivi des changements, cadence,
+    détecteur d'anomalies, journal des snapshots et profils des stations
+    éventuels.
+
+    Un contrat n'est jamais interrogé deux fois en parallèle ; sa session HTTP
+    n'est donc utilisée que par un seul thread à la fois.
+    """
+
+    def __init__(
+        self,
+        contract,
+        interval=300,
+        jitter=15,
+        min_interval=60,
+        timeout=10,
+        backoff_max=3600,
+        detector=None,
+        log=None,
+        profiles=None,
+    ):
+        self.contract = contract
+        self.interval = interval
+        self.jitter = jitter
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.backoff_max = backoff_max
+        self.session = create_session()
+        self.tracker = ChangeTracker()
+        self.detector = detector
+        self.log = log
+        self.profiles = profiles
+        self.failures = 0
+        self.last_request = None
+        self.next_due = time.monotonic()
+
+    def ready_at(self):
+        """Instant de la prochaine requête autorisée (cadence et limite de débit)"""
+        if self.last_request is None:
+            return self.next_due
+        return max(self.next_due, self.last_request + self.min_interval)
+
+    def poll(self, store_dir=STORE_DIR, api_url=API_URL):
+        """Collecte et enregistre un snapshot du contrat (exécuté dans le pool)"""
+        self.last_request = time.monotonic()
+        result = {"contract": self.contract}
+        try:
+            total, written = collect_snapshot(
+                self.session,
+                store_dir,
+                self.tracker,
+                self.detector,
+                self.log,
+                self.profiles,
+                contract=self.contract,
+                api_url=api_url,
+                timeout=self.timeout,
+            )
+            self.failures = 0
+            result.update(stations=total, written=written)
+        except Exception as exc:
+            # Une erreur (réseau, réponse inattendue, écriture) ne concerne que
+            # ce contrat : consignée, puis nouvel essai après le backoff
+            self.failures += 1
+            self.tracker.reset()
+            incr("collect_failures", contract=self.contract)
+            result.update(error=describe_error(exc), failures=self.failures)
+
+        result["duration"] = time.monotonic() - self.last_request
+        result["snapshot_time"] = datetime.now().isoformat()
+        self.next_due = time.monotonic() + next_delay(
+            self.interval, self.jitter, self.failures, self.backoff_max
+        )
+        return result
+
+
+def collect_round(pollers, store_dir=STORE_DIR, api_url=API_URL, max_workers=8):
+    """Interroge une fois tous les contrats en parallèle ; renvoie les résultats"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(p.poll, store_dir, api_url) for p in pollers]
+        return [future.result() for future in futures]
+
+
+def fetch_all(contracts, api_url=API_URL, max_workers=8, timeout=10):
+    """Récupère l'état brut de plusieurs contrats en parallèle"""
+
+    def fetch(contract):
+        with create_session() as session:
+            return fetch_stations(session, contract, api_url, timeout)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(contracts, pool.map(fetch, contracts)))
+
+
+def run(pollers, store_dir=STORE_DIR, api_url=API_URL, max_workers=8, report=print):
+    """Boucle de collecte : chaque contrat suit sa propre cadence.
+
+    Les snapshots sont horodatés et écrits dès la réponse de leur contrat ; un
+    contrat lent n'occupe qu'un thread du pool et ne retarde pas les autres.
+    """
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            now = time.monotonic()
+            busy = set(in_flight.values())
+            for poller in pollers:
+                if poller not in busy and poller.ready_at() <= now:
+                    future = pool.submit(poller.poll, store_dir, api_url)
+                    in_flight[future] = poller
+
+            idle = [p.ready_at() for p in pollers if p not in in_flight.values()]
+            timeout = max(0.05, min(idle) - time.monotonic()) if idle else None
+            done, _ = wait(
+                list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                del in_flight[future]
+                report(_format_result(future.result()))
+            if done:
+                export_metrics()
+
+
+def _format_result(result):
+    """Ligne de journal pour le résultat d'une collecte"""
+    if "error" in result:
+        return (
+            f"❌ {result['contract']} : échec {result['failures']} ({result['error']})"
+        )
+    return (
+        f"✅ {result['contract']} : {result['written']}/{result['stations']} stations "
+        f"modifiées en {result['duration']:.2f}s"
+    )
+
+
+def main():
+    """Collecte concurrente de plusieurs contrats JCDecaux"""
+    parser = argparse.ArgumentParser(description="Collecte multi-contrats JCDecaux")
+    parser.add_argument(
+        "--contracts",
+        default=CONTRACTS,
+        help="contrats séparés par des virgules, ou 'all' pour tous",
+    )
+    parser.add_argument("--interval", type=float, default=300)
+    parser.add_argument("--jitter", type=float, default=15)
+    parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=60,
+        help="délai minimal entre deux requêtes d'un même contrat",
+    )
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--backoff-max", type=float, default=3600)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--contracts-url", default=CONTRACTS_URL)
+    parser.add_argument(
+        "--once", action="store_true", help="une seule collecte de chaque contrat"
+    )
+    parser.add_argument(
+        "--no-anomalies", action="store_true", help="sans détection des anomalies"
+    )
+    parser.add_argument(
+        "--no-log", action="store_true", help="sans journal des snapshots"
+    )
+    args = parser.parse_args()
+    configure_metrics()
+
+    if args.contracts == "all":
+        with create_session() as session:
+            contracts = list_contracts(session, args.contracts_url, args.timeout)
+    else:
+        contracts = [c.strip() for c in args.contracts.split(",") if c.strip()]
+    if not contracts:
+        parser.error("aucun contrat (JCDECAUX_CONTRACTS ou --contracts)")
+
+    pollers = [
+        ContractPoller(
+            contract,
+            args.interval,
+            args.jitter,
+            args.min_interval,
+            args.timeout,
+            args.backoff_max,
+            None if args.no_anomalies else AnomalyDetector(events_path(args.store)),
+            None if args.no_log else SnapshotLog(log_dir(args.store, contract)),
+            StationProfiles.load(profiles_path(args.store, contract)),
+        )
+        for contract in contracts
+    ]
+    print(f"🚲 Collecte de {len(pollers)} contrats ({args.workers} threads)")
+
+    if args.once:
+        for result in collect_round(pollers, args.store, args.api_url, args.workers):
+            print(_format_result(result))
+        return
+
+    try:
+        run(pollers, args.store, args.api_url, args.workers)
+    except KeyboardInterrupt:
+        print("\n👋 Arrêt de la collecte")
+
+
+if __name__ == "__main__":
+    main()
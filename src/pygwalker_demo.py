@@ -1,25 +1,55 @@
 import os
+import argparse
 from dotenv import load_dotenv
-import requests
 import pandas as pd
 import pygwalker as pyg
 
+from explore_data import MAX_ROWS, VIEWS, prepare
+from history_store import STORE_DIR, flatten_stations
+from multi_collector import CONTRACTS, fetch_all
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Charger les variables d'environnement
 load_dotenv()
-API_KEY = os.getenv("JCDECAUX_API_KEY")
-CONTRACT = os.getenv("JCDECAUX_CONTRACT")
-
-# Récupération des données des stations
-base_url = "https://api.jcdecaux.com/vls/v3/stations"
-params = f"?contract={CONTRACT}&apiKey={API_KEY}"
-url = base_url + params
-response = requests.get(url)
-stations = response.json()
-
-# Transformation en DataFrame
-stations_df = pd.DataFrame(stations)
+
+
+def live_stations():
+    """État courant des stations (un ou plusieurs contrats en parallèle),
+    colonnes imbriquées de l'API aplaties"""
+    contracts = [c.strip() for c in CONTRACTS.split(",") if c.strip()]
+    stations = fetch_all(contracts)
+    stations_df = pd.concat(
+        [pd.DataFrame(contract_stations) for contract_stations in stations.values()],
+        ignore_index=True,
+    )
+    stations_df["snapshot_time"] = pd.Timestamp.now()
+    return flatten_stations(stations_df).to_pandas()
+
+
+# Jupyter ajoute ses propres arguments : seuls les nôtres sont lus
+parser = argparse.ArgumentParser(description="Exploration PyGWalker")
+parser.add_argument("view", nargs="?", default="station_hour", choices=VIEWS + ["live"])
+parser.add_argument("--store", default=STORE_DIR, help="stockage ou CSV")
+parser.add_argument("--start", default=None)
+parser.add_argument("--end", default=None)
+parser.add_argument("--contract", default=os.getenv("JCDECAUX_CONTRACT"))
+parser.add_argument("--max-rows", type=int, default=MAX_ROWS)
+args, _ = parser.parse_known_args()
+
+# Vue agrégée et bornée de l'historique (en cache d'une session à l'autre),
+# ou état courant de l'API
+if args.view == "live":
+    stations_df = live_stations()
+else:
+    stations_df = prepare(
+        args.store,
+        args.view,
+        args.start,
+        args.end,
+        args.contract,
+        max_rows=args.max_rows,
+    )
 
 # Affichage interactif avec PyGWalker
 pyg.walk(stations_df, env="Jupyter")
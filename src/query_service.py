@@ -0,0 +1,402 @@
+import os
+import copy
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from asof_index import AsOfIndex
+from history_store import SNAPSHOTS_FILE, STORE_DIR, UNKNOWN, resolve_contract
+from metrics import METRICS, configure_metrics, export_metrics, span
+from snapshot_log import LogReader, log_dir
+from station_analyzer import COLUMNS, StationAnalyzer
+
+
+class TTLCache:
+    """Cache borné : les entrées expirent après `ttl` secondes et les moins
+    récemment utilisées sont évincées au-delà de `maxsize`"""
+
+    def __init__(self, maxsize=1024, ttl=5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Valeur en cache (None si absente ou expirée)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Ajoute une valeur, en évinçant la plus ancienne si le cache est plein"""
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def source_signature(source, contract=None):
+    """Empreinte peu coûteuse d'un historique, modifiée à chaque ajout.
+
+    Pour un stockage : dates de modification des dossiers de contrat et de
+    journée (un nouveau fichier modifie son dossier) et des journaux de
+    snapshots (du seul `contract` s'il est donné) ; pour un CSV : taille et
+    date du fichier.
+    """
+    if not os.path.isdir(source):
+        if not os.path.isfile(source):
+            return None
+        stat = os.stat(source)
+        return (stat.st_size, stat.st_mtime_ns)
+    contract_name = None if contract is None else f"contractName={contract}"
+    signature = []
+    for contract in sorted(os.scandir(source), key=lambda e: e.name):
+        if not contract.is_dir():
+            continue
+        if contract_name is not None and contract.name != contract_name:
+            continue
+        signature.append((contract.name, contract.stat().st_mtime_ns))
+        for entry in os.scandir(contract.path):
+            if entry.is_dir() or entry.name == SNAPSHOTS_FILE:
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(sorted(signature))
+
+
+class Dataset:
+    """Historique chargé une fois : analyseur (séries, récapitulatif) et index
+    « à l'instant T » (état courant et passé). Une source absente lève
+    FileNotFoundError (pas de données de démonstration)."""
+
+    def __init__(self, source, start=None, end=None, version=0, contract=None):
+        self.version = version
+        self.signature = source_signature(source, contract)
+        self.analyzer = StationAnalyzer(
+            source, start=start, end=end, contract=contract, demo_fallback=False
+        )
+        self._build_asof()
+
+    def _build_asof(self):
+        self.loaded_at = pd.Timestamp.now()
+        history = self.analyzer.stations_data
+        if history is None or history.empty:
+            frame = pd.DataFrame(
+                columns=["number", "snapshot_time", "bikes_available", "capacity"]
+            )
+        else:
+            frame = history.to_frame(
+                ["number", "snapshot_time", "bikes_available", "capacity"]
+            )
+        self.rows = len(frame)
+        self.asof = AsOfIndex(frame, columns=("bikes_available", "capacity"))
+        self.last_time = frame["snapshot_time"].max() if len(frame) else None
+
+    def extend(self, rows, times, signature):
+        """Jeu de données suivant, complété des lignes lues dans le journal
+        des snapshots (voir StationAnalyzer.extend) ; celui-ci reste inchangé
+        et continue d'être servi pendant la mise à jour"""
+        data = copy.copy(self)
+        data.version = self.version + 1
+        data.signature = signature
+        data.analyzer = self.analyzer.extend(rows, times)
+        data._build_asof()
+        return data
+
+
+class QueryService:
+    """Requêtes sur l'historique collecté, servies depuis la mémoire.
+
+    Le jeu de données est mis à jour en tâche de fond quand l'empreinte de la
+    source change (ajout du collecteur) : pour un stockage, seuls les
+    snapshots ajoutés au journal du contrat (voir snapshot_log.py) sont lus ;
+    sinon (CSV, période bornée, journal absent ou sans nouveau snapshot), le
+    jeu est rechargé en entier. Les requêtes continuent d'être servies par
+    l'ancien jeu pendant la mise à jour. Les réponses sont
+    gardées dans un cache TTL / LRU dont les clés incluent la version du jeu.
+    """
+
+    def __init__(
+        self,
+        source=STORE_DIR,
+        start=None,
+        end=None,
+        cache_size=1024,
+        cache_ttl=5.0,
+        reload_interval=5.0,
+        contract=None,
+    ):
+        self.source = source
+        self.start = start
+        self.end = end
+        if os.path.isdir(source):
+            contract = resolve_contract(source, contract)
+        self.contract = contract
+        self.reload_interval = reload_interval
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.data = Dataset(source, start, end, contract=contract)
+        self.reader = None
+        self._follow_log()
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def watch(self):
+        """Démarre la surveillance de la source (rechargement automatique)"""
+        if self._watcher is None and self.reload_interval:
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.reload_interval):
+            self.reload_if_changed()
+            export_metrics()
+
+    def _follow_log(self):
+        """Se place dans le journal des snapshots juste après le dernier
+        relevé chargé (stockage lu sans borne de fin seulement)"""
+        self.reader = None
+        if not os.path.isdir(self.source) or self.end is not None:
+            return
+        reader = LogReader(log_dir(self.source, self.contract or UNKNOWN))
+        if self.data.last_time is not None:
+            # Instants chargés arrondis à la seconde (historique compact)
+            reader.seek(pd.Timestamp(self.data.last_time) + pd.Timedelta(seconds=1))
+        self.reader = reader
+
+    def reload_if_changed(self):
+        """Met à jour le jeu de données si la source a changé ; renvoie True
+        si une mise à jour a eu lieu"""
+        signature = source_signature(self.source, self.contract)
+        if signature == self.data.signature:
+            return False
+        data = None
+        if self.reader is not None and self.data.last_time is not None:
+            table, times = self.reader.read_snapshots()
+            if times:
+                rows = pd.DataFrame(columns=COLUMNS)
+                if table is not None:
+                    columns = [c for c in COLUMNS if c in table.column_names]
+                    rows = table.select(columns).to_pandas()
+                with span("reload", mode="log"):
+                    data = self.data.extend(rows, times, signature)
+        if data is None:
+            with span("reload", mode="full"):
+                data = Dataset(
+                    self.source,
+                    self.start,
+                    self.end,
+                    self.data.version + 1,
+                    self.contract,
+                )
+            # Nouveau point de départ dans le journal
+            self.data = data
+            self._follow_log()
+        self.data = data
+        self.cache.clear()
+        self.reloads += 1
+        return True
+
+    def query(self, path, params):
+        """Réponse JSON (octets) d'une requête, depuis le cache si possible"""
+        data = self.data
+        if path.strip("/") == "health":
+            return json.dumps(self.health(data), default=str).encode("utf-8")
+        key = (data.version, path, tuple(sorted(params.items())))
+        body = self.cache.get(key)
+        if body is None:
+            result = self.dispatch(data, path, params)
+            body = json.dumps(result, default=str, ensure_ascii=False).encode("utf-8")
+            self.cache.put(key, body)
+        return body
+
+    def dispatch(self, data, path, params):
+        """Exécute une requête ; lève KeyError si la ressource n'existe pas"""
+        parts = [p for p in path.split("/") if p]
+        index = data.analyzer.index
+        if index is None:
+            raise KeyError("aucune donnée chargée")
+        if parts == ["stations"]:
+            return _records(data.analyzer.summary())
+        if parts == ["current"]:
+            return self.state(data, data.last_time, params.get("max_staleness"))
+        if parts == ["asof"]:
+            if "at" not in params:
+                raise ValueError("paramètre 'at' manquant")
+            return self.state(data, params["at"], params.get("max_staleness"))
+        if len(parts) >= 2 and parts[0] == "stations":
+            number = int(parts[1])
+            if number not in index:
+                raise KeyError(f"station {number} inconnue")
+            series = index.station_data(number)
+            if len(parts) == 3 and parts[2] == "stats":
+                return data.analyzer.station_stats(series, number)
+            if len(parts) == 2:
+                return _records(_between(series, params))
+        raise KeyError(path)
+
+    def state(self, data, at, max_staleness=None):
+        """État de toutes les stations à un instant"""
+        if at is None:
+            return []
+        state = data.asof.state_at(pd.Timestamp(at), max_staleness)
+        return _records(state.reset_index())
+
+    def health(self, data):
+        return {
+            "version": data.version,
+            "rows": data.rows,
+            "stations": len(data.asof),
+            "last_snapshot": data.last_time,
+            "loaded_at": data.loaded_at,
+            "reloads": self.reloads,
+            "cache": {
+                "size": len(self.cache),
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+            },
+        }
+
+
+def _between(series, params):
+    """Tranche [start, end[ d'une série temporelle"""
+    times = series["snapshot_time"]
+    keep = pd.Series(True, index=series.index)
+    if params.get("start"):
+        keep &= times >= pd.Timestamp(params["start"])
+    if params.get("end"):
+        keep &= times < pd.Timestamp(params["end"])
+    return series[keep]
+
+
+def _records(df):
+    """Lignes d'un DataFrame en dictionnaires sérialisables"""
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+class QueryServer(ThreadingHTTPServer):
+    """Serveur multi-threads : les tableaux de bord interrogent en parallèle"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_handler(service):
+    """Crée le gestionnaire HTTP des requêtes du service"""
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        # Connexions persistantes : en-têtes et corps partent sans attendre
+        # l'accusé de réception du client (algorithme de Nagle désactivé)
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if url.path == "/metrics":
+                body = METRICS.to_prometheus().encode("utf-8")
+                self.send_body(200, body, "text/plain; version=0.0.4")
+                return
+            # Une étiquette par type de requête (pas par station)
+            route = url.path.strip("/").split("/")[0] or "root"
+            try:
+                with span("query", route=route):
+                    body = service.query(url.path, params)
+                self.send_body(200, body)
+            except KeyError as exc:
+                self.send_json(404, {"error": f"introuvable : {exc.args[0]}"})
+            except ValueError as exc:
+                self.send_json(400, {"error": str(exc)})
+
+        def send_json(self, status, data):
+            self.send_body(status, json.dumps(data, ensure_ascii=False).encode())
+
+        def send_body(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+
+def start_query_server(service, host="127.0.0.1", port=0):
+    """Démarre le service en tâche de fond ; renvoie (serveur, url)"""
+    server = QueryServer((host, port), make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service.watch()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    """Service HTTP local de consultation de l'historique collecté"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("source", nargs="?", default=STORE_DIR, help="stockage ou CSV")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--start", default=None, help="début de la période chargée")
+    parser.add_argument(
+        "--contract",
+        default=os.getenv("JCDECAUX_CONTRACT"),
+        help="contrat lu dans un stockage multi-contrats",
+    )
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--cache-ttl", type=float, default=5.0, help="secondes")
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=5.0,
+        help="secondes entre deux vérifications de la source (0 : jamais)",
+    )
+    args = parser.parse_args()
+    if not os.path.exists(args.source):
+        parser.error(f"source introuvable : {args.source}")
+    configure_metrics()
+
+    service = QueryService(
+        args.source,
+        args.start,
+        cache_size=args.cache_size,
+        cache_ttl=args.cache_ttl,
+        reload_interval=args.reload_interval,
+        contract=args.contract,
+    )
+    server, url = start_query_server(service, args.host, args.port)
+    print(f"🌐 Service de requêtes : {url}/stations ({service.data.rows} relevés)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        service.stop()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
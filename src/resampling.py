@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+
+def time_grid(times, freq="15min", start=None, end=None):
+    """Grille temporelle régulière couvrant les instants observés"""
+    end = pd.Timestamp(end) if end is not None else times.max()
+    if start is None:
+        # Grille alignée sur la fréquence (ex. :00, :15, :30, :45)
+        start = times.min().ceil(freq)
+        if start > end:
+            start = times.min()
+    return pd.date_range(start=start, end=end, freq=freq, name="snapshot_time")
+
+
+def resample_stations(
+    df, value="bikes", freq="15min", max_staleness="1h", start=None, end=None
+):
+    """Aligne toutes les stations sur une grille régulière en une seule opération.
+
+    Chaque point de la grille reprend la dernière valeur connue de la station,
+    à condition qu'elle date de moins de `max_staleness` (None : sans limite).
+    Renvoie une matrice stations × temps (float32, NaN si inconnue ou périmée).
+
+    `df` contient des snapshots complets (voir history_loader) : avec les
+    seules lignes écrites par le collecteur, une station inchangée depuis plus
+    de `max_staleness` serait jugée périmée.
+    """
+    obs = df[["number", "snapshot_time", value]].dropna(subset=[value])
+    obs = obs.sort_values("snapshot_time", kind="stable")
+    grid = time_grid(obs["snapshot_time"], freq, start, end)
+    stations = pd.Index(sorted(obs["number"].unique()), name="number")
+
+    # Tous les couples (instant de grille, station), triés par instant
+    targets = pd.DataFrame(
+        {
+            "snapshot_time": grid.repeat(len(stations)),
+            "number": np.tile(stations.to_numpy(), len(grid)),
+        }
+    )
+    tolerance = pd.Timedelta(max_staleness) if max_staleness is not None else None
+    aligned = pd.merge_asof(
+        targets,
+        obs.astype({"number": targets["number"].dtype}),
+        on="snapshot_time",
+        by="number",
+        direction="backward",
+        tolerance=tolerance,
+    )
+
+    values = aligned[value].to_numpy(dtype="float32", na_value=np.nan)
+    matrix = values.reshape(len(grid), len(stations)).T
+    return pd.DataFrame(matrix, index=stations, columns=grid)
+
+
+def station_metadata(df, columns=("name", "latitude", "longitude")):
+    """Dernières métadonnées connues de chaque station (une ligne par station)"""
+    latest = df.sort_values("snapshot_time", kind="stable")
+    return latest.groupby("number")[list(columns)].last()
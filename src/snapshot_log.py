@@ -0,0 +1,333 @@
+import os
+import glob
+import time
+import argparse
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+
+from history_store import STORE_DIR, UNKNOWN, _contract_dir
+
+# Journal des snapshots au format Arrow, par contrat (ignoré par la lecture
+# Parquet grâce au préfixe "_") : contractName=<contrat>/_log/
+LOG_DIR = "_log"
+# Un segment est scellé au-delà de cette taille ou au changement de jour
+SEGMENT_BYTES = 64 * 2**20
+# Durée de conservation des segments (le stockage Parquet reste la référence)
+KEEP = "7D"
+# Segment en cours d'écriture, segment scellé et index (instant -> position)
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".arrows"
+INDEX_SUFFIX = ".idx"
+# Fin d'un flux Arrow IPC (écrite au scellement)
+END_OF_STREAM = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+def log_dir(store_dir=STORE_DIR, contract=UNKNOWN):
+    """Dossier du journal d'un contrat dans le stockage"""
+    return os.path.join(_contract_dir(store_dir, contract), LOG_DIR)
+
+
+def segments(directory):
+    """Noms des segments d'un journal, du plus ancien au plus récent"""
+    paths = glob.glob(os.path.join(directory, f"segment-*{INDEX_SUFFIX}"))
+    return sorted(os.path.basename(p)[: -len(INDEX_SUFFIX)] for p in paths)
+
+
+def _path(directory, name, suffix):
+    return os.path.join(directory, name + suffix)
+
+
+def _segment_file(directory, name):
+    """Fichier de données d'un segment (scellé ou en cours d'écriture)"""
+    sealed = _path(directory, name, SEALED_SUFFIX)
+    if os.path.exists(sealed):
+        return sealed
+    opened = _path(directory, name, OPEN_SUFFIX)
+    # Le segment a pu être scellé entre les deux tests
+    return opened if os.path.exists(opened) else sealed
+
+
+def read_index(directory, name, offset=0):
+    """Entrées de l'index d'un segment à partir de l'octet `offset` ; renvoie
+    (entrées, octet suivant).
+
+    Chaque entrée est (octet de la ligne, instant, position, longueur, lignes).
+    Une ligne incomplète (en cours d'écriture) est laissée pour plus tard.
+    """
+    with open(_path(directory, name, INDEX_SUFFIX), "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    entries = []
+    cursor = 0
+    while True:
+        end = data.find(b"\n", cursor)
+        if end < 0:
+            break
+        snapshot_time, position, length, rows = data[cursor:end].decode().split(",")
+        entries.append(
+            (offset + cursor, snapshot_time, int(position), int(length), int(rows))
+        )
+        cursor = end + 1
+    return entries, offset + cursor
+
+
+class SnapshotLog:
+    """Journal des snapshots, en ajout seul, découpé en segments Arrow.
+
+    Chaque snapshot est ajouté à la fin du segment courant (flux Arrow IPC),
+    puis sa position est ajoutée à l'index du segment : un lecteur ne lit que
+    les snapshots indexés, donc jamais un snapshot à moitié écrit. Un segment
+    plein (ou d'un jour précédent) est scellé : fin de flux écrite, puis
+    renommage atomique en `.arrows`, et les segments de plus de `keep` sont
+    supprimés. Un seul processus écrit dans un journal (un par contrat) ; les
+    lecteurs sont libres (voir LogReader).
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, keep=KEEP):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.keep = keep
+        self.name = None
+        self._sink = None
+        self._writer = None
+        self._schema = None
+        self._index = None
+        self._day = None
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _recover(self):
+        """Scelle les segments laissés ouverts par un arrêt brutal, tronqués
+        à leur dernier snapshot indexé"""
+        for name in segments(self.directory):
+            opened = _path(self.directory, name, OPEN_SUFFIX)
+            if not os.path.exists(opened):
+                continue
+            entries, end = read_index(self.directory, name)
+            os.truncate(_path(self.directory, name, INDEX_SUFFIX), end)
+            if not entries:
+                os.remove(opened)
+                os.remove(_path(self.directory, name, INDEX_SUFFIX))
+                continue
+            _, _, position, length, _ = entries[-1]
+            os.truncate(opened, position + length)
+            with open(opened, "ab") as f:
+                f.write(END_OF_STREAM)
+            os.replace(opened, _path(self.directory, name, SEALED_SUFFIX))
+
+    def _open(self, table, snapshot_time):
+        moment = pd.Timestamp(snapshot_time)
+        self.name = f"segment-{moment.strftime('%Y%m%dT%H%M%S%f')}"
+        self._day = moment.date()
+        self._sink = pa.OSFile(_path(self.directory, self.name, OPEN_SUFFIX), "wb")
+        self._schema = table.schema
+        self._writer = pa.ipc.new_stream(self._sink, table.schema)
+        self._index = open(
+            _path(self.directory, self.name, INDEX_SUFFIX), "a", encoding="utf-8"
+        )
+
+    def append(self, table, snapshot_time):
+        """Ajoute un snapshot (table Arrow, éventuellement vide) au journal"""
+        moment = pd.Timestamp(snapshot_time)
+        if self._sink is not None and (
+            self._sink.tell() >= self.segment_bytes
+            or moment.date() != self._day
+            or not table.schema.equals(self._schema)
+        ):
+            self.seal()
+        if self._sink is None:
+            self._open(table, moment)
+
+        position = self._sink.tell()
+        if table.num_rows:
+            self._writer.write_table(table)
+        length = self._sink.tell() - position
+        self._index.write(
+            f"{moment.isoformat()},{position},{length},{table.num_rows}\n"
+        )
+        self._index.flush()
+        return self.name, position
+
+    def seal(self):
+        """Scelle le segment courant (le suivant sera créé au prochain ajout)"""
+        if self._sink is None:
+            return
+        self._writer.close()
+        self._sink.close()
+        self._index.close()
+        os.replace(
+            _path(self.directory, self.name, OPEN_SUFFIX),
+            _path(self.directory, self.name, SEALED_SUFFIX),
+        )
+        self._sink = self._writer = self._index = None
+        if self.keep:
+            self.prune(self.keep)
+
+    close = seal
+
+    def prune(self, keep=KEEP, now=None):
+        """Supprime les segments scellés plus anciens que `keep` ; renvoie le
+        nombre de segments supprimés"""
+        limit = pd.Timestamp(now or datetime.now()) - pd.Timedelta(keep)
+        names = segments(self.directory)
+        removed = 0
+        # Un segment ne se termine qu'au début du suivant
+        for name, following in zip(names, names[1:]):
+            sealed = _path(self.directory, name, SEALED_SUFFIX)
+            if _segment_start(following) >= limit or not os.path.exists(sealed):
+                break
+            os.remove(_path(self.directory, name, INDEX_SUFFIX))
+            os.remove(sealed)
+            removed += 1
+        return removed
+
+
+def _segment_start(name):
+    return pd.Timestamp(datetime.strptime(name.split("-", 1)[1], "%Y%m%dT%H%M%S%f"))
+
+
+class LogReader:
+    """Lecture des snapshots ajoutés au journal depuis la dernière lecture.
+
+    La position (segment, octet de son index) peut être enregistrée dans
+    `position_file` pour reprendre là où un consommateur s'était arrêté. Les
+    lots sont lus directement dans les segments projetés en mémoire, sans
+    copie.
+    """
+
+    def __init__(self, directory, position_file=None):
+        self.directory = directory
+        self.position_file = position_file
+        self.position = None
+        if position_file and os.path.isfile(position_file):
+            with open(position_file, encoding="utf-8") as f:
+                name, offset = f.read().split(",")
+            self.position = (name, int(offset))
+
+    def save_position(self):
+        """Enregistre la position de lecture (remplacée d'un coup)"""
+        if not self.position_file or self.position is None:
+            return
+        tmp = f"{self.position_file}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(f"{self.position[0]},{self.position[1]}")
+        os.replace(tmp, self.position_file)
+
+    def seek(self, snapshot_time):
+        """Se place sur le premier snapshot postérieur ou égal à un instant"""
+        moment = pd.Timestamp(snapshot_time)
+        names = segments(self.directory)
+        # Dernier segment commençant avant l'instant
+        candidates = [n for n in names if _segment_start(n) <= moment] or names[:1]
+        self.position = None
+        first = names.index(candidates[-1]) if names else 0
+        for name in names[first:]:
+            entries, end = read_index(self.directory, name)
+            for line_offset, entry_time, _, _, _ in entries:
+                if pd.Timestamp(entry_time) >= moment:
+                    self.position = (name, line_offset)
+                    return self
+            self.position = (name, end)
+        return self
+
+    def read_new(self):
+        """Lignes des snapshots ajoutés depuis la position courante (table
+        Arrow) ; la position avance jusqu'au dernier snapshot lu"""
+        return self.read_snapshots()[0]
+
+    def read_snapshots(self):
+        """Comme read_new, mais renvoie (table ou None, instants des snapshots
+        lus) : un snapshot sans station modifiée n'a pas de ligne, mais il
+        compte pour reconstituer les snapshots complets"""
+        names = segments(self.directory)
+        times = []
+        if not names:
+            return None, times
+        if self.position is None:
+            name, offset = names[0], 0
+        elif self.position[0] in names:
+            name, offset = self.position
+        else:
+            # Segment supprimé (rétention) : reprise au plus ancien restant
+            later = [n for n in names if n > self.position[0]]
+            if not later:
+                return None, times
+            name, offset = later[0], 0
+
+        batches, schema = [], None
+        while True:
+            # Scellé avant la lecture de l'index : l'index est alors complet
+            sealed = os.path.exists(_path(self.directory, name, SEALED_SUFFIX))
+            entries, offset = read_index(self.directory, name, offset)
+            times.extend(pd.Timestamp(entry[1]) for entry in entries)
+            if any(entry[3] for entry in entries):
+                source = pa.memory_map(_segment_file(self.directory, name))
+                schema = pa.ipc.open_stream(source).schema
+                for _, _, position, length, _ in entries:
+                    if length:
+                        source.seek(position)
+                        batches.extend(
+                            _read_batches(source.read_buffer(length), schema)
+                        )
+            self.position = (name, offset)
+            following = names.index(name) + 1
+            if not sealed or following == len(names):
+                break
+            name, offset = names[following], 0
+        if not batches:
+            return None, times
+        return pa.Table.from_batches(batches), times
+
+    def follow(self, interval=5.0, stop=None, with_times=False):
+        """Générateur des nouveaux snapshots, vérifiés toutes les `interval`
+        secondes (jusqu'à ce que l'événement `stop` soit levé).
+
+        Avec with_times=True, produit (table ou None, instants des snapshots),
+        y compris pour des snapshots sans ligne modifiée.
+        """
+        while stop is None or not stop.is_set():
+            table, times = self.read_snapshots()
+            if table is not None or (with_times and times):
+                yield (table, times) if with_times else table
+                self.save_position()
+            elif stop is not None:
+                stop.wait(interval)
+            else:
+                time.sleep(interval)
+
+
+def _read_batches(buffer, schema):
+    """Lots Arrow contenus dans une tranche de segment"""
+    stream = pa.BufferReader(buffer)
+    while stream.tell() < buffer.size:
+        message = pa.ipc.read_message(stream)
+        # Le schéma n'est écrit qu'avec le premier lot du segment
+        if message.type == "record batch":
+            yield pa.ipc.read_record_batch(message, schema)
+
+
+def main():
+    """Suit le journal des snapshots d'un contrat"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--contract", default=os.getenv("JCDECAUX_CONTRACT", UNKNOWN))
+    parser.add_argument("--position-file", default=None, help="reprise de la lecture")
+    parser.add_argument("--since", default=None, help="premier instant lu")
+    parser.add_argument("--interval", type=float, default=5.0, help="secondes")
+    args = parser.parse_args()
+
+    reader = LogReader(log_dir(args.store, args.contract), args.position_file)
+    if args.since:
+        reader.seek(args.since)
+    try:
+        for table in reader.follow(args.interval):
+            times = table.column("snapshot_time").to_pandas()
+            print(f"{table.num_rows} lignes, jusqu'à {times.max()}")
+    except KeyboardInterrupt:
+        reader.save_position()
+
+
+if __name__ == "__main__":
+    main()
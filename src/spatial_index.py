@@ -0,0 +1,217 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from asof_index import AsOfIndex
+
+# Rayon terrestre moyen (m)
+EARTH_RADIUS = 6_371_000.0
+# Taille par défaut d'une cellule de la grille (m)
+CELL_SIZE = 250.0
+
+
+class SpatialIndex:
+    """Index spatial des stations par grille de hachage.
+
+    Les coordonnées sont projetées en mètres autour de la latitude moyenne
+    (projection équirectangulaire, précise à mieux de 0,1 % à l'échelle d'une
+    ville) puis rangées dans des cellules carrées de `cell_size` mètres. Une
+    requête n'examine que les cellules voisines du point, anneau par anneau.
+    """
+
+    def __init__(self, numbers, latitudes, longitudes, cell_size=CELL_SIZE):
+        lat = np.asarray(latitudes, dtype="float64")
+        lon = np.asarray(longitudes, dtype="float64")
+        located = ~(np.isnan(lat) | np.isnan(lon))
+        self.numbers = np.asarray(numbers)[located]
+        self.latitudes, self.longitudes = lat[located], lon[located]
+        self.cell_size = float(cell_size)
+        center = lat[located].mean() if located.any() else 0.0
+        self.cos_lat = math.cos(math.radians(center))
+        self.x, self.y = self.project(self.latitudes, self.longitudes)
+
+        # Cellule -> positions des stations qu'elle contient
+        cx, cy = self._cells(self.x, self.y)
+        self.cells = {}
+        for i, key in enumerate(zip(cx.tolist(), cy.tolist())):
+            self.cells.setdefault(key, []).append(i)
+        self.cells = {key: np.array(idx) for key, idx in self.cells.items()}
+        self.bounds = (
+            (cx.min(), cx.max(), cy.min(), cy.max()) if len(cx) else (0, 0, 0, 0)
+        )
+
+    @classmethod
+    def from_metadata(cls, metadata, cell_size=CELL_SIZE):
+        """Index construit depuis une table des stations indexée par numéro
+        (colonnes latitude, longitude)"""
+        return cls(
+            metadata.index.to_numpy(),
+            metadata["latitude"].to_numpy(),
+            metadata["longitude"].to_numpy(),
+            cell_size,
+        )
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def project(self, latitudes, longitudes):
+        """Coordonnées planes (m) de points géographiques"""
+        lat = np.radians(np.asarray(latitudes, dtype="float64"))
+        lon = np.radians(np.asarray(longitudes, dtype="float64"))
+        return EARTH_RADIUS * lon * self.cos_lat, EARTH_RADIUS * lat
+
+    def _cells(self, x, y):
+        return (
+            np.floor(x / self.cell_size).astype(np.int64),
+            np.floor(y / self.cell_size).astype(np.int64),
+        )
+
+    def _ring(self, cx, cy, r):
+        """Positions des stations des cellules à r cellules de (cx, cy)"""
+        if r == 0:
+            keys = [(cx, cy)]
+        else:
+            keys = [(cx + dx, cy - r) for dx in range(-r, r + 1)]
+            keys += [(cx + dx, cy + r) for dx in range(-r, r + 1)]
+            keys += [(cx - r, cy + dy) for dy in range(-r + 1, r)]
+            keys += [(cx + r, cy + dy) for dy in range(-r + 1, r)]
+        found = [self.cells[k] for k in keys if k in self.cells]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def _ring_range(self, cx, cy):
+        """Premier et dernier anneaux pouvant contenir des cellules occupées"""
+        x0, x1, y0, y1 = self.bounds
+        first = max(0, x0 - cx, cx - x1, y0 - cy, cy - y1)
+        last = max(abs(cx - x0), abs(cx - x1), abs(cy - y0), abs(cy - y1))
+        return int(first), int(last)
+
+    def _groups(self, latitudes, longitudes):
+        """Points des requêtes regroupés par cellule"""
+        x, y = self.project(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        cx, cy = self._cells(x, y)
+        keys = np.stack([cx, cy], axis=1)
+        cells, inverse = np.unique(keys, axis=0, return_inverse=True)
+        order = np.argsort(inverse.ravel(), kind="stable")
+        bounds = np.searchsorted(inverse.ravel()[order], np.arange(len(cells) + 1))
+        for g, (gx, gy) in enumerate(cells.tolist()):
+            yield gx, gy, order[bounds[g]:bounds[g + 1]], x, y
+
+    def _distances(self, points, candidates, x, y):
+        dx = x[points][:, None] - self.x[candidates][None, :]
+        dy = y[points][:, None] - self.y[candidates][None, :]
+        return np.hypot(dx, dy)
+
+    def nearest_batch(self, latitudes, longitudes, k=1, eligible=None):
+        """k stations les plus proches de chaque point.
+
+        `eligible` (booléens alignés sur `numbers`) restreint les stations
+        candidates. Renvoie (numéros, distances en m), deux tableaux points × k
+        complétés par -1 / inf s'il y a moins de k stations éligibles.
+        """
+        n = len(np.atleast_1d(latitudes))
+        numbers = np.full((n, k), -1, dtype=np.int64)
+        distances = np.full((n, k), np.inf)
+
+        for cx, cy, points, x, y in self._groups(latitudes, longitudes):
+            candidates = []
+            first_ring, last_ring = self._ring_range(cx, cy)
+            for r in range(first_ring, last_ring + 1):
+                ring = self._ring(cx, cy, r)
+                if eligible is not None:
+                    ring = ring[eligible[ring]]
+                candidates.append(ring)
+                found = np.concatenate(candidates)
+                if len(found) < k and r < last_ring:
+                    continue
+                dist = self._distances(points, found, x, y)
+                if r == last_ring:
+                    break
+                # Les anneaux 0..r couvrent tout le disque de rayon r × cellule
+                kth = np.partition(dist, k - 1, axis=1)[:, k - 1]
+                if np.all(kth <= r * self.cell_size):
+                    break
+            if not len(found):
+                continue
+            order = np.argsort(dist, axis=1, kind="stable")[:, :k]
+            m = order.shape[1]
+            numbers[points, :m] = self.numbers[found[order]]
+            distances[points, :m] = np.take_along_axis(dist, order, axis=1)
+        return numbers, distances
+
+    def nearest(self, latitude, longitude, k=1, eligible=None):
+        """k stations les plus proches d'un point (numéro, distance en m)"""
+        numbers, distances = self.nearest_batch([latitude], [longitude], k, eligible)
+        found = numbers[0] >= 0
+        return pd.DataFrame(
+            {"number": numbers[0][found], "distance": distances[0][found]}
+        )
+
+    def _within_cell(self, cx, cy, points, x, y, radius):
+        """(points, positions des stations, distances) à moins de `radius`"""
+        first_ring, last_ring = self._ring_range(cx, cy)
+        rings = min(int(math.ceil(radius / self.cell_size)), last_ring)
+        found = [self._ring(cx, cy, r) for r in range(first_ring, rings + 1)]
+        found = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+        dist = self._distances(points, found, x, y)
+        p, s = np.nonzero(dist <= radius)
+        return points[p], found[s], dist[p, s]
+
+    def within_batch(self, latitudes, longitudes, radius):
+        """Stations à moins de `radius` mètres de chaque point.
+
+        Renvoie une ligne par couple (point, station) : query (position du
+        point dans la requête), number, distance ; triée par point puis
+        distance.
+        """
+        parts = [
+            self._within_cell(cx, cy, points, x, y, radius)
+            for cx, cy, points, x, y in self._groups(latitudes, longitudes)
+        ]
+        query, found, dist = (
+            np.concatenate([part[i] for part in parts]) for i in range(3)
+        )
+        order = np.lexsort((dist, query))
+        return pd.DataFrame(
+            {
+                "query": query[order],
+                "number": self.numbers[found[order]],
+                "distance": dist[order],
+            }
+        )
+
+    def within(self, latitude, longitude, radius):
+        """Stations à moins de `radius` mètres d'un point, de la plus proche à
+        la plus lointaine"""
+        x, y = self.project([latitude], [longitude])
+        cx, cy = self._cells(x, y)
+        _, found, dist = self._within_cell(
+            int(cx[0]), int(cy[0]), np.zeros(1, dtype=np.int64), x, y, radius
+        )
+        order = np.argsort(dist, kind="stable")
+        return pd.DataFrame(
+            {"number": self.numbers[found[order]], "distance": dist[order]}
+        )
+
+    def eligible(self, state, column="bikes", minimum=1):
+        """Stations dont `column` vaut au moins `minimum` dans `state` (table
+        indexée par numéro, ex. l'état du réseau à un instant donné)"""
+        values = state[column].reindex(self.numbers)
+        return (values >= minimum).fillna(False).to_numpy(dtype=bool)
+
+    def nearest_available(
+        self, latitudes, longitudes, state, k=1, minimum=1, column="bikes"
+    ):
+        """k stations les plus proches ayant au moins `minimum` vélos (ou
+        places avec column="stands") dans l'état `state`"""
+        eligible = self.eligible(state, column, minimum)
+        return self.nearest_batch(latitudes, longitudes, k, eligible)
+
+
+def state_at(df, at, columns=("bikes", "stands")):
+    """Dernier état connu de chaque station à l'instant `at` (indexé par numéro).
+
+    Pour plusieurs instants sur le même historique, construire une seule fois
+    un AsOfIndex et appeler son state_at.
+    """
+    return AsOfIndex(df, columns).state_at(at)
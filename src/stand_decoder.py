@@ -0,0 +1,112 @@
+import pandas as pd
+
+# Champs de disponibilité présents dans totalStands / mainStands / overflowStands
+AVAILABILITY_FIELDS = [
+    "bikes",
+    "stands",
+    "mechanicalBikes",
+    "electricalBikes",
+    "electricalInternalBatteryBikes",
+    "electricalRemovableBatteryBikes",
+]
+STAND_FIELDS = AVAILABILITY_FIELDS + ["capacity"]
+POSITION_FIELDS = ["latitude", "longitude"]
+
+# Préfixe des colonnes décodées pour chaque colonne imbriquée
+STANDS_PREFIXES = {
+    "totalStands": "",
+    "mainStands": "main_",
+    "overflowStands": "overflow_",
+}
+
+
+def _field_pattern(field):
+    """Expression régulière extrayant la valeur numérique d'une clé"""
+    return rf"""["']{field}["']\s*:\s*(-?\d+(?:\.\d+)?)"""
+
+
+def _decode_dicts(values, fields):
+    """Décode des objets déjà sous forme de dictionnaires (réponse de l'API)"""
+
+    def lookup(d, field):
+        if not isinstance(d, dict):
+            return None
+        if field in d:
+            return d[field]
+        return (d.get("availabilities") or {}).get(field)
+
+    return pd.DataFrame(
+        {field: [lookup(d, field) for d in values] for field in fields}
+    )
+
+
+def _holds_dicts(series):
+    """Indique si la colonne contient des dictionnaires plutôt que des chaînes"""
+    first = series.first_valid_index()
+    return first is not None and isinstance(series[first], dict)
+
+
+def decode_column(series, fields):
+    """Décode une colonne imbriquée en colonnes numériques, en un seul passage.
+
+    Les chaînes sont dédupliquées avant le parsing : une station garde la même
+    position d'un snapshot à l'autre et les disponibilités se répètent souvent.
+    Les lignes mal formées donnent des valeurs manquantes.
+    """
+    if _holds_dicts(series):
+        result = _decode_dicts(series.tolist(), fields)
+        result.index = series.index
+        return result
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    strings = pd.Series(uniques, dtype=object).astype(str)
+    decoded = pd.DataFrame(
+        {
+            field: pd.to_numeric(
+                strings.str.extract(_field_pattern(field), expand=False),
+                errors="coerce",
+            )
+            for field in fields
+        },
+        index=strings.index,
+        dtype=float,
+    )
+
+    # Les lignes manquantes (code -1) pointent vers une ligne vide ajoutée en fin
+    decoded.loc[len(decoded)] = float("nan")
+    result = decoded.iloc[codes]
+    result.index = series.index
+    return result
+
+
+def decode_stands(series, prefix=""):
+    """Décode une colonne de type totalStands en colonnes entières typées"""
+    decoded = decode_column(series, STAND_FIELDS)
+    decoded = decoded.apply(pd.to_numeric, errors="coerce").round().astype("Int16")
+    return decoded.add_prefix(prefix)
+
+
+def decode_position(series):
+    """Décode la colonne position en latitude / longitude"""
+    decoded = decode_column(series, POSITION_FIELDS)
+    return decoded.apply(pd.to_numeric, errors="coerce").astype("float64")
+
+
+def decode_nested(df, stands_columns=("totalStands",), drop=True):
+    """Remplace les colonnes imbriquées par leurs champs à plat typés.
+
+    `position` devient latitude/longitude ; chaque colonne de `stands_columns`
+    devient bikes, stands, mechanicalBikes, electricalBikes, ... et capacity,
+    préfixés selon STANDS_PREFIXES.
+    """
+    parts = []
+    if "position" in df.columns:
+        parts.append(decode_position(df["position"]))
+    for col in stands_columns:
+        if col in df.columns:
+            parts.append(decode_stands(df[col], STANDS_PREFIXES.get(col, col + "_")))
+
+    if drop:
+        nested = ["position"] + list(STANDS_PREFIXES)
+        df = df.drop(columns=[c for c in nested if c in df.columns])
+    return pd.concat([df] + parts, axis=1)
@@ -1,129 +1,269 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import numpy as np
-from datetime import datetime, timedelta
-import ast
 import os
+import copy
+
+from compact_history import CompactHistory
+from history_loader import iter_source
+from history_store import reconstruct_snapshots
+from metrics import incr, span
+from stand_decoder import decode_nested
+from station_index import StationIndex
+from station_profiles import profile_stats, read_profiles
+from synthetic_history import generate_history
+
+# Colonnes utiles à l'analyse : les autres ne sont pas gardées en mémoire
+COLUMNS = ["number", "snapshot_time", "name", "address", "bikes", "capacity"]
+
+
+def draw_station_evolution(station_data, station_name):
+    """Dessine l'évolution du nombre de vélos et du remplissage d'une station"""
+    # Créer le graphique
+    fig = plt.figure(figsize=(12, 8))
+
+    # Graphique principal
+    plt.subplot(2, 1, 1)
+    plt.plot(
+        station_data["snapshot_time"],
+        station_data["bikes_available"],
+        marker="o",
+        linewidth=2,
+        markersize=6,
+        color="#2E86AB",
+    )
+    plt.fill_between(
+        station_data["snapshot_time"],
+        station_data["bikes_available"],
+        alpha=0.3,
+        color="#2E86AB",
+    )
+
+    # Ligne de capacité
+    capacity = station_data["capacity"].iloc[0]
+    plt.axhline(
+        y=capacity,
+        color="red",
+        linestyle="--",
+        alpha=0.7,
+        label=f"Capacité totale ({capacity} vélos)",
+    )
+
+    plt.title(
+        f"🚲 Évolution du nombre de vélos disponibles\n{station_name}",
+        fontsize=14,
+        fontweight="bold",
+        pad=20,
+    )
+    plt.ylabel("Nombre de vélos disponibles", fontsize=12)
+    plt.grid(True, alpha=0.3)
+    plt.legend()
+
+    # Formatage de l'axe des temps
+    plt.gcf().autofmt_xdate()
+
+    # Graphique de pourcentage de remplissage
+    plt.subplot(2, 1, 2)
+    fill_percentage = station_data["bikes_available"] / capacity * 100
+    plt.plot(
+        station_data["snapshot_time"],
+        fill_percentage,
+        marker="s",
+        linewidth=2,
+        markersize=6,
+        color="#A23B72",
+    )
+    plt.fill_between(
+        station_data["snapshot_time"], fill_percentage, alpha=0.3, color="#A23B72"
+    )
+
+    # Lignes de référence
+    plt.axhline(
+        y=80, color="red", linestyle="--", alpha=0.5, label="80% (Station pleine)"
+    )
+    plt.axhline(
+        y=20, color="orange", linestyle="--", alpha=0.5, label="20% (Station vide)"
+    )
+
+    plt.title(
+        "📊 Pourcentage de remplissage de la station",
+        fontsize=12,
+        fontweight="bold",
+    )
+    plt.ylabel("Pourcentage de remplissage (%)", fontsize=12)
+    plt.xlabel("Heure de la journée", fontsize=12)
+    plt.grid(True, alpha=0.3)
+    plt.legend()
+
+    # Formatage de l'axe des temps
+    plt.gcf().autofmt_xdate()
+
+    plt.tight_layout()
+    return fig
+
+
+def station_stats(station_data):
+    """Statistiques d'une station (moyenne, extrêmes, heures de pointe, ...)"""
+    bikes_data = station_data["bikes_available"]
+    capacity = station_data["capacity"].iloc[0]
+
+    # Heures de pointe
+    hours = station_data["snapshot_time"].dt.hour
+    return {
+        "mean": float(bikes_data.mean()),
+        "min": int(bikes_data.min()),
+        "max": int(bikes_data.max()),
+        "std": float(bikes_data.std()) if len(bikes_data) > 1 else 0.0,
+        "capacity": int(capacity),
+        "fill_rate": float(bikes_data.mean() / capacity * 100) if capacity else 0.0,
+        "peak_hour": int(hours.iloc[bikes_data.to_numpy().argmax()]),
+        "low_hour": int(hours.iloc[bikes_data.to_numpy().argmin()]),
+    }
 
 
 class StationAnalyzer:
-    def __init__(self, data_file="demo-source-data.csv"):
-        """Initialise l'analyseur de stations avec les données"""
+    def __init__(
+        self,
+        data_file="demo-source-data.csv",
+        start=None,
+        end=None,
+        stations=None,
+        resolution="auto",
+        contract=None,
+        demo_fallback=True,
+    ):
+        """Initialise l'analyseur de stations avec les données.
+
+        `start`, `end` et `stations` limitent la lecture à une période et à
+        quelques stations (seules ces lignes sont chargées). Sur une longue
+        période, un stockage est lu dans ses agrégats (resolution="auto", voir
+        history_loader.read_resolution) ; "raw" force les relevés bruts. Un
+        seul contrat est analysé : `contract`, ou le seul présent dans la
+        source (les numéros de stations sont propres à chaque contrat).
+        Avec demo_fallback=False, une source absente lève FileNotFoundError
+        au lieu de charger les données de démonstration.
+        """
         self.data_file = data_file
+        self.start = start
+        self.end = end
+        self.stations = stations
+        self.resolution = resolution
+        self.contract = contract
+        self.demo_fallback = demo_fallback
         self.stations_data = None
+        self.index = None
+        self.profiles = None
         self.load_data()
+        self.load_profiles()
 
     def load_data(self):
         """Charge et traite les données des stations"""
         try:
-            # Charger les données CSV
-            self.stations_data = pd.read_csv(self.data_file)
-
-            # Nettoyer et traiter les données
-            self.process_data()
+            # Charger le stockage en colonnes (dossier) ou le CSV historique,
+            # filtré à la lecture sur la période et les stations demandées, et
+            # compacter chaque bloc (types réduits, métadonnées par station)
+            chunks = iter_source(
+                self.data_file,
+                self.start,
+                self.end,
+                self.stations,
+                COLUMNS,
+                self.resolution,
+                self.contract,
+            )
+            with span("load_data"):
+                self.stations_data = CompactHistory.from_chunks(
+                    self.process_data(chunk) for chunk in chunks
+                )
 
         except FileNotFoundError:
+            if not self.demo_fallback:
+                raise
             print(f"Erreur: Le fichier {self.data_file} n'a pas été trouvé.")
             print("Utilisation de données de démonstration...")
             self.create_demo_data()
 
-    def process_data(self):
-        """Traite les données pour extraire les informations utiles"""
-        if self.stations_data is None:
+        self.build_index()
+
+    def extend(self, rows, times=None):
+        """Analyseur complété de relevés postérieurs à l'historique chargé
+        (nouvel objet : celui-ci reste utilisable pendant la mise à jour).
+
+        `rows` sont les lignes du journal des snapshots (stations modifiées
+        seulement) : elles sont reconstituées en snapshots complets aux
+        instants `times` à partir du dernier snapshot chargé. Seules les
+        nouvelles lignes sont lues et compactées ; l'index est reconstruit en
+        mémoire.
+        """
+        rows = self.process_data(rows.reindex(columns=COLUMNS))
+        history = self.stations_data
+        if history is None or history.empty:
+            history = CompactHistory.from_chunks([])
+        elif times is not None and len(times):
+            last = history.rows["snapshot_time"] == history.rows["snapshot_time"].max()
+            state = CompactHistory(
+                history.rows[last], history.stations, history.base
+            ).to_frame(list(rows.columns))
+            known = pd.concat([state, rows], ignore_index=True)
+            rows = reconstruct_snapshots(known, times)
+            rows = rows[rows["snapshot_time"] > state["snapshot_time"].max()]
+
+        analyzer = copy.copy(self)
+        analyzer.stations_data = history.append(rows)
+        analyzer.build_index()
+        analyzer.load_profiles()
+        return analyzer
+
+    def load_profiles(self):
+        """Charge les profils tenus à jour par le collecteur (stockage lu en
+        entier seulement : ils portent sur tout l'historique)"""
+        filtered = any(v is not None for v in (self.start, self.end, self.stations))
+        if os.path.isdir(self.data_file) and not filtered:
+            self.profiles = read_profiles(self.data_file, self.contract)
+
+    def summary(self):
+        """Récapitulatif par station : profils précalculés si disponibles,
+        sinon récapitulatif de l'index"""
+        if self.profiles is not None:
+            return self.profiles
+        return self.index.summary
+
+    def build_index(self):
+        """Construit l'index par station (historiques triés + récapitulatif)"""
+        if self.stations_data is None or self.stations_data.empty:
+            self.index = None
             return
-
-        # Extraire le nombre de vélos depuis la colonne totalStands
-        def extract_bikes(row):
-            try:
-                if pd.notna(row["totalStands"]):
-                    data = ast.literal_eval(row["totalStands"])
-                    return data["availabilities"]["bikes"]
-                return 0
-            except (ValueError, SyntaxError, KeyError):
-                return 0
-
-        def extract_capacity(row):
-            try:
-                if pd.notna(row["totalStands"]):
-                    data = ast.literal_eval(row["totalStands"])
-                    return data["capacity"]
-                return 0
-            except (ValueError, SyntaxError, KeyError):
-                return 0
-
-        # Ajouter les colonnes calculées
-        self.stations_data["bikes_available"] = self.stations_data.apply(
-            extract_bikes, axis=1
-        )
-        self.stations_data["capacity"] = self.stations_data.apply(
-            extract_capacity, axis=1
+        self.index = StationIndex(
+            self.stations_data.rows,
+            metadata=self.stations_data.stations,
+            time_base=self.stations_data.base,
         )
 
-        # Convertir snapshot_time en datetime
-        self.stations_data["snapshot_time"] = pd.to_datetime(
-            self.stations_data["snapshot_time"]
-        )
+    def process_data(self, data):
+        """Traite un bloc de données pour extraire les informations utiles"""
+        with span("process_data"):
+            # Décoder en un seul passage les colonnes imbriquées du CSV brut
+            # (le stockage en colonnes fournit directement les champs à plat)
+            if "totalStands" in data.columns:
+                data = decode_nested(data)
 
-    def create_demo_data(self):
-        """Crée des données de démonstration avec évolution temporelle"""
-        # Stations de base
-        base_stations = [
-            {
-                "number": 385,
-                "name": "00385 - VITARELLES - FRONDE",
-                "address": "21, chemin de la Fronde",
-            },
-            {
-                "number": 195,
-                "name": "00195 - RIEUX - CHANT DU MERLE",
-                "address": "FACE 15 RUE PIERRE LAROUSSE",
-            },
-            {"number": 29, "name": "00029 - VALADE", "address": "31 RUE VALADE"},
-            {
-                "number": 400,
-                "name": "00400 - SAINT-MARTIN-DU-TOUCH GARE",
-                "address": "4, rue Marie Louise Dissard",
-            },
-            {
-                "number": 156,
-                "name": "00156 - EMPALOT - MÉTRO",
-                "address": "38 AV JEAN MOULIN",
-            },
-        ]
-
-        # Générer des données temporelles (24 heures avec des mesures toutes les heures)
-        start_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        time_points = [start_time + timedelta(hours=i) for i in range(24)]
-
-        # Créer des données pour chaque station
-        demo_data = []
-        for station in base_stations:
-            # Générer un pattern réaliste pour chaque station
-            base_bikes = np.random.randint(5, 15)
-            capacity = base_bikes + np.random.randint(5, 10)
-
-            for i, time_point in enumerate(time_points):
-                # Pattern quotidien: plus de vélos le matin et le soir
-                hour = time_point.hour
-                if 7 <= hour <= 9:  # Heures de pointe matin
-                    bikes = max(0, min(capacity, base_bikes + np.random.randint(-2, 8)))
-                elif 17 <= hour <= 19:  # Heures de pointe soir
-                    bikes = max(0, min(capacity, base_bikes + np.random.randint(-2, 8)))
-                else:  # Heures creuses
-                    bikes = max(0, min(capacity, base_bikes + np.random.randint(-5, 5)))
-
-                demo_data.append(
-                    {
-                        "number": station["number"],
-                        "name": station["name"],
-                        "address": station["address"],
-                        "bikes_available": bikes,
-                        "capacity": capacity,
-                        "snapshot_time": time_point,
-                    }
-                )
+            data = data.rename(columns={"bikes": "bikes_available"})
+            for col in ["bikes_available", "capacity"]:
+                data[col] = data[col].fillna(0)
 
-        self.stations_data = pd.DataFrame(demo_data)
+            # Convertir snapshot_time en datetime
+            data["snapshot_time"] = pd.to_datetime(data["snapshot_time"])
+        incr("rows_processed", len(data))
+        return data
+
+    def create_demo_data(self, stations=5, snapshots=24):
+        """Crée des données de démonstration avec évolution temporelle"""
+        # Historique synthétique : une mesure par heure sur la journée, avec
+        # les heures de pointe du matin et du soir
+        start_time = pd.Timestamp.now().normalize()
+        demo_data = generate_history(
+            stations, snapshots, freq="1h", start=start_time, nested=False
+        )
+        self.stations_data = CompactHistory.from_frame(self.process_data(demo_data))
 
     def display_stations(self):
         """Affiche la liste des stations disponibles"""
@@ -135,13 +275,8 @@ class StationAnalyzer:
             print("Aucune donnée de station disponible.")
             return
 
-        # Grouper par station pour afficher les informations uniques
-        unique_stations = (
-            self.stations_data.groupby(["number", "name", "address"])
-            .agg({"bikes_available": "mean", "capacity": "first"})
-            .round(1)
-            .reset_index()
-        )
+        # Récapitulatif par station précalculé (profils ou index)
+        unique_stations = self.summary().round({"bikes_available": 1})
 
         print(f"\n📊 {len(unique_stations)} stations disponibles:\n")
 
@@ -153,7 +288,8 @@ class StationAnalyzer:
             capacity = station["capacity"]
 
             # Calculer le pourcentage de remplissage
-            fill_percentage = (avg_bikes / capacity * 100) if capacity > 0 else 0
+            known = pd.notna(capacity) and capacity > 0
+            fill_percentage = (avg_bikes / capacity * 100) if known else 0
 
             # Indicateur visuel de disponibilité
             if fill_percentage > 70:
@@ -176,10 +312,8 @@ class StationAnalyzer:
             print("Aucune donnée disponible pour la sélection.")
             return None
 
-        # Obtenir la liste des stations uniques
-        unique_stations = (
-            self.stations_data.groupby(["number", "name"]).first().reset_index()
-        )
+        # Liste des stations uniques (récapitulatif précalculé)
+        unique_stations = self.summary()
 
         print("\n🎯 SÉLECTION D'UNE STATION")
         print("-" * 40)
@@ -215,133 +349,45 @@ class StationAnalyzer:
         station_number = station["number"]
         station_name = station["name"]
 
-        # Filtrer les données pour cette station
-        station_data = self.stations_data[
-            self.stations_data["number"] == station_number
-        ].copy()
+        # Historique de la station, déjà trié par temps dans l'index
+        station_data = self.index.station_data(station_number)
 
         if station_data.empty:
             print(f"❌ Aucune donnée trouvée pour la station {station_number}")
             return
 
-        # Trier par temps
-        station_data = station_data.sort_values("snapshot_time")
-
-        # Créer le graphique
-        plt.figure(figsize=(12, 8))
-
-        # Graphique principal
-        plt.subplot(2, 1, 1)
-        plt.plot(
-            station_data["snapshot_time"],
-            station_data["bikes_available"],
-            marker="o",
-            linewidth=2,
-            markersize=6,
-            color="#2E86AB",
-        )
-        plt.fill_between(
-            station_data["snapshot_time"],
-            station_data["bikes_available"],
-            alpha=0.3,
-            color="#2E86AB",
-        )
-
-        # Ligne de capacité
-        capacity = station_data["capacity"].iloc[0]
-        plt.axhline(
-            y=capacity,
-            color="red",
-            linestyle="--",
-            alpha=0.7,
-            label=f"Capacité totale ({capacity} vélos)",
-        )
-
-        plt.title(
-            f"🚲 Évolution du nombre de vélos disponibles\n{station_name}",
-            fontsize=14,
-            fontweight="bold",
-            pad=20,
-        )
-        plt.ylabel("Nombre de vélos disponibles", fontsize=12)
-        plt.grid(True, alpha=0.3)
-        plt.legend()
-
-        # Formatage de l'axe des temps
-        plt.gcf().autofmt_xdate()
-
-        # Graphique de pourcentage de remplissage
-        plt.subplot(2, 1, 2)
-        fill_percentage = station_data["bikes_available"] / capacity * 100
-        plt.plot(
-            station_data["snapshot_time"],
-            fill_percentage,
-            marker="s",
-            linewidth=2,
-            markersize=6,
-            color="#A23B72",
-        )
-        plt.fill_between(
-            station_data["snapshot_time"], fill_percentage, alpha=0.3, color="#A23B72"
-        )
-
-        # Lignes de référence
-        plt.axhline(
-            y=80, color="red", linestyle="--", alpha=0.5, label="80% (Station pleine)"
-        )
-        plt.axhline(
-            y=20, color="orange", linestyle="--", alpha=0.5, label="20% (Station vide)"
-        )
-
-        plt.title(
-            "📊 Pourcentage de remplissage de la station",
-            fontsize=12,
-            fontweight="bold",
-        )
-        plt.ylabel("Pourcentage de remplissage (%)", fontsize=12)
-        plt.xlabel("Heure de la journée", fontsize=12)
-        plt.grid(True, alpha=0.3)
-        plt.legend()
-
-        # Formatage de l'axe des temps
-        plt.gcf().autofmt_xdate()
-
-        plt.tight_layout()
+        draw_station_evolution(station_data, station_name)
         plt.show()
 
         # Afficher des statistiques
-        self.display_station_stats(station_data, station_name)
-
-    def display_station_stats(self, station_data, station_name):
+        self.display_station_stats(station_data, station_name, station_number)
+
+    def station_stats(self, station_data, number=None):
+        """Statistiques d'une station : lues dans les profils du contrat
+        analysé si possible, sinon calculées sur son historique"""
+        if self.profiles is not None and number is not None:
+            rows = self.profiles[self.profiles["number"] == number]
+            if len(rows):
+                return profile_stats(rows.iloc[0])
+        return station_stats(station_data)
+
+    def display_station_stats(self, station_data, station_name, number=None):
         """Affiche les statistiques de la station"""
         print(f"\n📈 STATISTIQUES - {station_name}")
         print("-" * 50)
 
-        bikes_data = station_data["bikes_available"]
-        capacity = station_data["capacity"].iloc[0]
-
-        print(f"🚲 Nombre moyen de vélos: {bikes_data.mean():.1f}")
-        print(f"📊 Nombre minimum: {bikes_data.min()}")
-        print(f"📈 Nombre maximum: {bikes_data.max()}")
-        print(f"📏 Écart-type: {bikes_data.std():.1f}")
-        print(f"🏗️  Capacité totale: {capacity}")
-        print(
-            f"💯 Taux de remplissage moyen: {(bikes_data.mean() / capacity * 100):.1f}%"
-        )
-
-        # Heures de pointe
-        station_data_with_hour = station_data.copy()
-        station_data_with_hour["hour"] = station_data_with_hour["snapshot_time"].dt.hour
-
-        peak_hour = station_data_with_hour.loc[
-            station_data_with_hour["bikes_available"].idxmax(), "hour"
-        ]
-        low_hour = station_data_with_hour.loc[
-            station_data_with_hour["bikes_available"].idxmin(), "hour"
-        ]
-
-        print(f"⏰ Heure de pointe (plus de vélos): {peak_hour:02d}h")
-        print(f"🌙 Heure creuse (moins de vélos): {low_hour:02d}h")
+        stats = self.station_stats(station_data, number)
+        print(f"🚲 Nombre moyen de vélos: {stats['mean']:.1f}")
+        print(f"📊 Nombre minimum: {stats['min']}")
+        print(f"📈 Nombre maximum: {stats['max']}")
+        print(f"📏 Écart-type: {stats['std']:.1f}")
+        print(f"🏗️  Capacité totale: {stats['capacity']}")
+        print(f"💯 Taux de remplissage moyen: {stats['fill_rate']:.1f}%")
+        print(f"⏰ Heure de pointe (plus de vélos): {stats['peak_hour']:02d}h")
+        print(f"🌙 Heure creuse (moins de vélos): {stats['low_hour']:02d}h")
+        if "empty_share" in stats:
+            print(f"🔴 Temps passé vide: {stats['empty_share']:.1f}%")
+            print(f"🔵 Temps passé pleine: {stats['full_share']:.1f}%")
 
     def run(self):
         """Lance l'application interactive"""
@@ -371,14 +417,17 @@ class StationAnalyzer:
 
 def main():
     """Fonction principale"""
-    # Essayer d'abord avec stations_history.csv, sinon utiliser demo-source-data.csv
-    data_file = "stations_history.csv"
+    # Essayer d'abord le stockage stations_history/, puis stations_history.csv,
+    # sinon utiliser demo-source-data.csv
+    data_file = "stations_history"
+    if not os.path.isdir(data_file):
+        data_file = "stations_history.csv"
     if not os.path.exists(data_file):
         data_file = "demo-source-data.csv"
         print("⚠️  Utilisation des données de démonstration")
         print("(stations_history.csv non trouvé)")
 
-    analyzer = StationAnalyzer(data_file)
+    analyzer = StationAnalyzer(data_file, contract=os.getenv("JCDECAUX_CONTRACT"))
     analyzer.run()
 
 
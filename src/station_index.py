@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+
+class StationIndex:
+    """Index par station construit une seule fois au chargement.
+
+    Les lignes sont triées par (station, temps) : l'historique d'une station est
+    une tranche contiguë des tableaux, retrouvée en O(1) par son numéro.
+
+    Avec un historique compact (voir compact_history.py), `time_base` est
+    l'instant de référence des décalages en secondes de snapshot_time et
+    `metadata` la table des stations (nom, adresse) indexée par numéro.
+    """
+
+    def __init__(
+        self,
+        stations_data,
+        value_columns=("bikes_available", "capacity"),
+        metadata=None,
+        time_base=None,
+    ):
+        data = stations_data.sort_values(["number", "snapshot_time"], kind="stable")
+        numbers = data["number"].to_numpy()
+        self.numbers, starts = np.unique(numbers, return_index=True)
+        self.offsets = np.append(starts, len(numbers))
+        self.positions = {int(n): i for i, n in enumerate(self.numbers)}
+
+        self.time_base = time_base
+        self.times = data["snapshot_time"].to_numpy()
+        self.values = {c: data[c].to_numpy() for c in value_columns if c in data}
+        if metadata is not None:
+            # Table des stations : une valeur par station, alignée sur l'index
+            metadata = metadata.reindex(self.numbers)
+            self.metadata = {
+                c: metadata[c].to_numpy()
+                for c in ("name", "address")
+                if c in metadata.columns
+            }
+        else:
+            # Dernières valeurs connues (nom, adresse) de chaque station
+            last = self.offsets[1:] - 1
+            self.metadata = {
+                c: data[c].to_numpy()[last] for c in ("name", "address") if c in data
+            }
+        self.summary = self._build_summary()
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __contains__(self, number):
+        return int(number) in self.positions
+
+    def bounds(self, number):
+        """Début et fin de la tranche d'une station dans les tableaux"""
+        i = self.positions[int(number)]
+        return self.offsets[i], self.offsets[i + 1]
+
+    def station_data(self, number):
+        """Historique trié par temps d'une station (vide si inconnue)"""
+        if number not in self:
+            return pd.DataFrame(columns=["snapshot_time", *self.values])
+        start, end = self.bounds(number)
+        times = self.times[start:end]
+        if self.time_base is not None:
+            times = self.time_base + pd.to_timedelta(times, unit="s")
+        data = {"snapshot_time": times}
+        data.update({c: v[start:end] for c, v in self.values.items()})
+        return pd.DataFrame(data)
+
+    def _build_summary(self):
+        """Table récapitulative : une ligne par station"""
+        starts, ends = self.offsets[:-1], self.offsets[1:]
+        summary = pd.DataFrame({"number": self.numbers, "count": ends - starts})
+        for col, values in self.metadata.items():
+            summary[col] = values
+        if "bikes_available" in self.values and len(starts):
+            bikes = self.values["bikes_available"].astype("float64")
+            summary["bikes_available"] = np.add.reduceat(bikes, starts) / (
+                ends - starts
+            )
+        if "capacity" in self.values:
+            summary["capacity"] = self.values["capacity"][starts]
+        return summary
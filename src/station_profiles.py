@@ -0,0 +1,329 @@
+import os
+import glob
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from history_store import (
+    STORE_DIR,
+    UNKNOWN,
+    _contract_dir,
+    read_history,
+    read_snapshots,
+    reconstruct_snapshots,
+    resolve_contract,
+    store_contracts,
+)
+
+# Profils par station, à côté du journal des snapshots de chaque contrat
+PROFILES_FILE = "_profiles.npz"
+# Heures de la semaine (lundi 0h = 0)
+WEEK_HOURS = 7 * 24
+# Tableaux tenus par station, avec leur valeur initiale
+STATE = {
+    "count": 0.0,
+    "total": 0.0,
+    "squares": 0.0,
+    "minimum": np.inf,
+    "maximum": -np.inf,
+    "fill_total": 0.0,
+    "fill_count": 0.0,
+    "observed_seconds": 0.0,
+    "empty_seconds": 0.0,
+    "full_seconds": 0.0,
+    "last_bikes": np.nan,
+    "last_capacity": np.nan,
+}
+
+
+def profiles_path(store_dir=STORE_DIR, contract=UNKNOWN):
+    """Fichier des profils d'un contrat dans le stockage, dans le dossier de
+    sa partition (voir contract_partition) à côté du journal des snapshots"""
+    return os.path.join(_contract_dir(store_dir, contract), PROFILES_FILE)
+
+
+def week_hours(times):
+    """Heure de la semaine de chaque instant"""
+    times = pd.DatetimeIndex(times)
+    return (times.dayofweek * 24 + times.hour).to_numpy()
+
+
+class StationProfiles:
+    """Agrégats par station tenus à jour snapshot par snapshot.
+
+    Moments des vélos disponibles (nombre, somme, carrés, extrêmes), vélos
+    moyens par heure de la semaine, durées passées vide et pleine et dernières
+    valeurs vues : chaque snapshot complet ne coûte qu'une mise à jour de
+    quelques cases par station, et les statistiques d'une station ou le
+    récapitulatif du réseau se lisent sans parcourir l'historique.
+
+    Avec `path`, les profils sont enregistrés après chaque mise à jour.
+    """
+
+    def __init__(self, path=None, max_gap="1h"):
+        self.path = path
+        self.max_gap = pd.Timedelta(max_gap).total_seconds()
+
+        # État par station, aligné sur `numbers` (trié)
+        self.numbers = np.empty(0, dtype=np.int64)
+        for name in STATE:
+            setattr(self, name, np.empty(0))
+        self.hour_total = np.zeros((0, WEEK_HOURS))
+        self.hour_count = np.zeros((0, WEEK_HOURS))
+        self.last_time = np.empty(0, dtype="datetime64[s]")
+        self.names = np.empty(0, dtype=object)
+        self.addresses = np.empty(0, dtype=object)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __contains__(self, number):
+        row = np.searchsorted(self.numbers, number)
+        return row < len(self.numbers) and self.numbers[row] == number
+
+    def _positions(self, numbers):
+        """Lignes des stations dans les profils (les nouvelles y sont ajoutées)"""
+        new = np.setdiff1d(numbers, self.numbers)
+        if len(new):
+            merged = np.union1d(self.numbers, new)
+            old = np.searchsorted(merged, self.numbers)
+            n = len(merged)
+            grown = {name: np.full(n, value) for name, value in STATE.items()}
+            grown["hour_total"] = np.zeros((n, WEEK_HOURS))
+            grown["hour_count"] = np.zeros((n, WEEK_HOURS))
+            grown["last_time"] = np.full(n, np.datetime64("NaT"), "datetime64[s]")
+            grown["names"] = np.full(n, "", dtype=object)
+            grown["addresses"] = np.full(n, "", dtype=object)
+            for name, array in grown.items():
+                array[old] = getattr(self, name)
+                setattr(self, name, array)
+            self.numbers = merged
+        return np.searchsorted(self.numbers, numbers)
+
+    def update(self, df):
+        """Ajoute des snapshots complets (un seul ou un historique reconstitué,
+        voir reconstruct_snapshots) aux profils"""
+        df = df.dropna(subset=["bikes"])
+        if not len(df):
+            return self
+        times = pd.to_datetime(df["snapshot_time"]).to_numpy().astype("datetime64[s]")
+        order = np.lexsort((times, df["number"].to_numpy()))
+        times = times[order]
+        rows = self._positions(df["number"].to_numpy(dtype=np.int64)[order])
+        bikes = df["bikes"].to_numpy(dtype="float64")[order]
+        capacity = pd.to_numeric(df["capacity"], errors="coerce").to_numpy(
+            dtype="float64"
+        )[order]
+
+        # Moments et extrêmes
+        np.add.at(self.count, rows, 1.0)
+        np.add.at(self.total, rows, bikes)
+        np.add.at(self.squares, rows, bikes * bikes)
+        np.minimum.at(self.minimum, rows, bikes)
+        np.maximum.at(self.maximum, rows, bikes)
+        known = capacity > 0
+        np.add.at(self.fill_total, rows[known], bikes[known] / capacity[known])
+        np.add.at(self.fill_count, rows[known], 1.0)
+
+        # Vélos par heure de la semaine
+        cells = rows * WEEK_HOURS + week_hours(times)
+        np.add.at(self.hour_total.ravel(), cells, bikes)
+        np.add.at(self.hour_count.ravel(), cells, 1.0)
+
+        # Durées : l'intervalle depuis le relevé précédent (y compris le
+        # dernier relevé vu avant ce lot) est attribué à l'état de ce relevé
+        first = np.r_[True, rows[1:] != rows[:-1]]
+        previous_time = np.r_[times[:1], times[:-1]]
+        previous_bikes = np.r_[bikes[:1], bikes[:-1]]
+        previous_capacity = np.r_[capacity[:1], capacity[:-1]]
+        previous_time[first] = self.last_time[rows[first]]
+        previous_bikes[first] = self.last_bikes[rows[first]]
+        previous_capacity[first] = self.last_capacity[rows[first]]
+        gap = (times - previous_time) / np.timedelta64(1, "s")
+        counted = (gap > 0) & (gap <= self.max_gap)
+        gap = np.where(counted, gap, 0.0)
+        np.add.at(self.observed_seconds, rows, gap)
+        np.add.at(self.empty_seconds, rows, np.where(previous_bikes <= 0, gap, 0.0))
+        full = (previous_capacity > 0) & (previous_bikes >= previous_capacity)
+        np.add.at(self.full_seconds, rows, np.where(full, gap, 0.0))
+
+        # Dernières valeurs vues
+        last = np.r_[rows[1:] != rows[:-1], True]
+        self.last_time[rows[last]] = times[last]
+        self.last_bikes[rows[last]] = bikes[last]
+        self.last_capacity[rows[last]] = capacity[last]
+        for name, column in (("names", "name"), ("addresses", "address")):
+            if column in df.columns:
+                values = df[column].to_numpy(dtype=object)[order][last]
+                getattr(self, name)[rows[last]] = np.where(
+                    pd.isna(values), "", values
+                ).astype(str)
+
+        if self.path:
+            self.save(self.path)
+        return self
+
+    def _hour_means(self, rows):
+        """Vélos moyens par heure de la journée (toutes semaines confondues)"""
+        by_day = (self.hour_total[rows], self.hour_count[rows])
+        total, count = (a.reshape(len(rows), 7, 24).sum(axis=1) for a in by_day)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / count
+
+    def summary(self):
+        """Récapitulatif du réseau : une ligne par station"""
+        return self._table(np.arange(len(self)))
+
+    def _table(self, rows):
+        """Statistiques de stations (lignes des profils)"""
+        count = self.count[rows]
+        mean = self.total[rows] / np.maximum(count, 1)
+        variance = (self.squares[rows] - count * mean * mean) / np.maximum(
+            count - 1, 1
+        )
+        observed = np.maximum(self.observed_seconds[rows], 1)
+        hours = self._hour_means(rows)
+        # Heures jamais observées : ni pointe ni creux
+        peak = np.nanargmax(np.where(np.isnan(hours), -np.inf, hours), axis=1)
+        low = np.nanargmin(np.where(np.isnan(hours), np.inf, hours), axis=1)
+        return pd.DataFrame(
+            {
+                "number": self.numbers[rows],
+                "name": self.names[rows].astype(str),
+                "address": self.addresses[rows].astype(str),
+                "count": count.astype(np.int64),
+                "bikes_available": mean,
+                "std": np.sqrt(np.maximum(variance, 0.0)),
+                "min": self.minimum[rows],
+                "max": self.maximum[rows],
+                "capacity": pd.array(self.last_capacity[rows], dtype="Int64"),
+                "fill_rate": self.fill_total[rows]
+                / np.maximum(self.fill_count[rows], 1)
+                * 100,
+                "empty_share": self.empty_seconds[rows] / observed * 100,
+                "full_share": self.full_seconds[rows] / observed * 100,
+                "peak_hour": peak,
+                "low_hour": low,
+                "last_time": self.last_time[rows],
+                "last_bikes": self.last_bikes[rows],
+            }
+        )
+
+    def stats(self, number):
+        """Statistiques d'une station, aux clés de station_stats"""
+        if number not in self:
+            raise KeyError(number)
+        return profile_stats(
+            self._table([np.searchsorted(self.numbers, number)]).iloc[0]
+        )
+
+    def hourly_profile(self, number):
+        """Vélos moyens par heure de la semaine d'une station (7 × 24)"""
+        if number not in self:
+            raise KeyError(number)
+        row = np.searchsorted(self.numbers, number)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self.hour_total[row] / self.hour_count[row]
+        return pd.DataFrame(
+            means.reshape(7, 24),
+            index=pd.Index(range(7), name="dayofweek"),
+            columns=pd.Index(range(24), name="hour"),
+        )
+
+    def save(self, path=None):
+        """Enregistre les profils (fichier remplacé d'un coup)"""
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        state = {k: v for k, v in self.__dict__.items() if k != "path"}
+        state["names"] = state["names"].astype(str)
+        state["addresses"] = state["addresses"].astype(str)
+        np.savez(tmp, **state)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path, keep_path=True):
+        """Recharge des profils enregistrés (vides si le fichier n'existe pas)"""
+        profiles = cls(path if keep_path else None)
+        if not os.path.isfile(path):
+            return profiles
+        with np.load(path) as data:
+            for name in data.files:
+                value = data[name]
+                setattr(profiles, name, value.item() if value.ndim == 0 else value)
+        profiles.names = profiles.names.astype(object)
+        profiles.addresses = profiles.addresses.astype(object)
+        return profiles
+
+
+def profile_stats(row):
+    """Statistiques d'une station (ligne du récapitulatif), aux clés de
+    station_stats"""
+    stats = {"mean": float(row["bikes_available"])}
+    for key in ("std", "fill_rate", "empty_share", "full_share"):
+        stats[key] = float(row[key])
+    for key in ("min", "max", "capacity", "peak_hour", "low_hour"):
+        stats[key] = int(row[key]) if pd.notna(row[key]) else 0
+    return stats
+
+
+def read_profiles(store_dir=STORE_DIR, contract=None):
+    """Récapitulatif des profils d'un contrat du stockage (voir
+    resolve_contract).
+
+    None s'il n'y a pas de profils, ou s'ils sont en retard sur le journal des
+    snapshots (collecte faite sans les tenir à jour) : mieux vaut alors
+    recalculer le récapitulatif sur l'historique.
+    """
+    contract = resolve_contract(store_dir, contract)
+    path = profiles_path(store_dir, contract or UNKNOWN)
+    if not os.path.isfile(path):
+        return None
+    profiles = StationProfiles.load(path, keep_path=False)
+    if not len(profiles):
+        return None
+    journal = read_snapshots(store_dir, contract or UNKNOWN)
+    if len(journal) and profiles.last_time.max() < journal.max().floor("s"):
+        return None
+    return profiles.summary().assign(contractName=contract)
+
+
+def rebuild(store_dir=STORE_DIR, contract=UNKNOWN):
+    """Recalcule les profils d'un contrat depuis l'historique, journée par
+    journée (snapshots complets reconstitués)"""
+    profiles = StationProfiles()
+    days = sorted(glob.glob(os.path.join(_contract_dir(store_dir, contract), "date=*")))
+    journal = read_snapshots(store_dir, contract)
+    for day_dir in days:
+        start = pd.Timestamp(os.path.basename(day_dir).split("=", 1)[1])
+        end = start + pd.Timedelta("1D")
+        df = read_history(store_dir, contract=contract, start=start, end=end)
+        if df.empty:
+            continue
+        times = journal[(journal >= start) & (journal < end)]
+        profiles.update(reconstruct_snapshots(df, times if len(times) else None))
+    profiles.save(profiles_path(store_dir, contract))
+    return profiles
+
+
+def main():
+    """Recalcule les profils des stations depuis l'historique (collecteur arrêté :
+    il tient ensuite les profils à jour à chaque snapshot)"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--contract", default=None, help="tous par défaut")
+    args = parser.parse_args()
+
+    if args.contract:
+        contracts = [resolve_contract(args.store, args.contract)]
+    else:
+        contracts = store_contracts(args.store)
+    for contract in contracts:
+        profiles = rebuild(args.store, contract)
+        print(f"{contract} : {len(profiles)} stations")
+
+
+if __name__ == "__main__":
+    main()
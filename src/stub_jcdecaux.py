@@ -0,0 +1,191 @@
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Centre approximatif de Toulouse
+CENTER = (43.6045, 1.4440)
+
+
+class StubNetwork:
+    """Réseau de stations simulé, dont une partie évolue à chaque requête"""
+
+    def __init__(
+        self, contract="toulouse", stations=400, change_rate=0.1, seed=0, latency=0.0
+    ):
+        self.contract = contract
+        self.change_rate = change_rate
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stations = []
+        for number in range(1, stations + 1):
+            capacity = self.rng.randint(10, 30)
+            self.stations.append(
+                {
+                    "number": number,
+                    "name": f"{number:05d} - STATION {number}",
+                    "address": f"{number} RUE DE TEST",
+                    "latitude": CENTER[0] + self.rng.uniform(-0.05, 0.05),
+                    "longitude": CENTER[1] + self.rng.uniform(-0.07, 0.07),
+                    "capacity": capacity,
+                    "mechanical": self.rng.randint(0, capacity // 2),
+                    "electrical": self.rng.randint(0, capacity // 2),
+                    "lastUpdate": _utc_now(),
+                }
+            )
+
+    def step(self):
+        """Fait évoluer une fraction des stations (vélos pris ou rendus)"""
+        for station in self.stations:
+            if self.rng.random() >= self.change_rate:
+                continue
+            kind = self.rng.choice(["mechanical", "electrical"])
+            bikes = station["mechanical"] + station["electrical"]
+            delta = self.rng.choice([-1, 1])
+            if delta < 0 and station[kind] == 0:
+                continue
+            if delta > 0 and bikes >= station["capacity"]:
+                continue
+            station[kind] += delta
+            station["lastUpdate"] = _utc_now()
+
+    def payload(self):
+        """État courant au format de l'API JCDecaux v3"""
+        with self.lock:
+            self.step()
+            return [_station_json(self.contract, s) for s in self.stations]
+
+
+def _utc_now():
+    """Horodatage UTC au format de l'API"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _station_json(contract, station):
+    """Représentation API d'une station simulée"""
+    bikes = station["mechanical"] + station["electrical"]
+    stands = {
+        "availabilities": {
+            "bikes": bikes,
+            "stands": station["capacity"] - bikes,
+            "mechanicalBikes": station["mechanical"],
+            "electricalBikes": station["electrical"],
+            "electricalInternalBatteryBikes": station["electrical"],
+            "electricalRemovableBatteryBikes": 0,
+        },
+        "capacity": station["capacity"],
+    }
+    return {
+        "number": station["number"],
+        "contractName": contract,
+        "name": station["name"],
+        "address": station["address"],
+        "position": {
+            "latitude": round(station["latitude"], 6),
+            "longitude": round(station["longitude"], 6),
+        },
+        "banking": False,
+        "bonus": False,
+        "status": "OPEN",
+        "lastUpdate": station["lastUpdate"],
+        "connected": True,
+        "overflow": False,
+        "shape": None,
+        "totalStands": stands,
+        "mainStands": stands,
+        "overflowStands": None,
+    }
+
+
+class StubServer(ThreadingHTTPServer):
+    """Serveur multi-threads acceptant de nombreuses connexions simultanées"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_handler(networks, fail_rate=0.0):
+    """Crée le gestionnaire HTTP servant les réseaux simulés"""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path.endswith("/contracts"):
+                self.send_json([{"name": name} for name in networks])
+                return
+
+            contract = parse_qs(url.query).get("contract", [""])[0].lower()
+            if not url.path.endswith("/stations") or contract not in networks:
+                self.send_error(404, "Unknown contract")
+                return
+            if random.random() < fail_rate:
+                self.send_error(503, "Service Unavailable")
+                return
+
+            network = networks[contract]
+            time.sleep(network.latency)
+            self.send_json(network.payload())
+
+        def send_json(self, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def start_stub_server(
+    port=0, contracts=("toulouse",), fail_rate=0.0, latencies=None, **network_kw
+):
+    """Démarre le serveur simulé en tâche de fond ; renvoie (serveur, url).
+
+    `latencies` associe à chaque contrat un temps de réponse en secondes.
+    """
+    latencies = latencies or {}
+    networks = {
+        c.lower(): StubNetwork(c.lower(), latency=latencies.get(c, 0.0), **network_kw)
+        for c in contracts
+    }
+    server = StubServer(("127.0.0.1", port), make_handler(networks, fail_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/vls/v3/stations"
+    return server, url
+
+
+def main():
+    """Lance un serveur JCDecaux simulé pour tester la collecte en local"""
+    parser = argparse.ArgumentParser(description="Serveur JCDecaux simulé")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--contract", action="append", default=None)
+    parser.add_argument("--stations", type=int, default=400)
+    parser.add_argument("--change-rate", type=float, default=0.1)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, url = start_stub_server(
+        args.port,
+        args.contract or ["toulouse"],
+        args.fail_rate,
+        stations=args.stations,
+        change_rate=args.change_rate,
+    )
+    print(f"🧪 Serveur simulé : {url}?contract=toulouse")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
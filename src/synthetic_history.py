@@ -0,0 +1,197 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from history_store import to_schema, write_table
+from stub_jcdecaux import CENTER
+
+# Colonnes du CSV historique, dans l'ordre de collect_history.py
+CSV_COLUMNS = [
+    "number",
+    "contractName",
+    "name",
+    "address",
+    "position",
+    "banking",
+    "bonus",
+    "status",
+    "lastUpdate",
+    "connected",
+    "overflow",
+    "shape",
+    "totalStands",
+    "mainStands",
+    "overflowStands",
+    "snapshot_time",
+]
+
+# Profils de station : se vide le matin (résidentiel), se remplit le matin
+# (bureaux) ou reste stable (mixte)
+RESIDENTIAL, BUSINESS, MIXED = 1, -1, 0
+
+
+def _peak(hours, center, width):
+    """Pic gaussien de fréquentation centré sur une heure"""
+    return np.exp(-(((hours - center) / width) ** 2))
+
+
+def _stands_strings(bikes, mechanical, electrical, capacity):
+    """Colonne totalStands au format du CSV, une chaîne par combinaison unique"""
+    # Combinaison codée en un seul entier (valeurs < 1024)
+    keys = ((bikes * 1024 + mechanical) * 1024 + electrical) * 1024 + capacity
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    b, m = uniques // 1024**3, uniques // 1024**2 % 1024
+    e, c = uniques // 1024 % 1024, uniques % 1024
+    strings = np.array(
+        [
+            "{'availabilities': {"
+            f"'bikes': {b}, 'stands': {c - b}, 'mechanicalBikes': {m}, "
+            f"'electricalBikes': {e}, 'electricalInternalBatteryBikes': {e}, "
+            "'electricalRemovableBatteryBikes': 0}, "
+            f"'capacity': {c}}}"
+            for b, m, e, c in zip(b.tolist(), m.tolist(), e.tolist(), c.tolist())
+        ],
+        dtype=object,
+    )
+    return strings[inverse]
+
+
+def generate_history(
+    stations=400,
+    snapshots=288,
+    freq="5min",
+    start="2025-06-02",
+    seed=0,
+    contract="toulouse",
+    nested=True,
+):
+    """Historique synthétique réaliste de `stations` × `snapshots` lignes.
+
+    Chaque station a un profil (résidentiel, bureaux ou mixte) qui se vide ou
+    se remplit aux heures de pointe (8h, 18h), atténué le week-end, plus un
+    bruit aléatoire. Avec nested=True, les colonnes ont le format du CSV
+    (position, totalStands, mainStands sous forme de dictionnaires) ; sinon
+    elles sont déjà à plat (latitude, bikes, capacity, ...).
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start=start, periods=snapshots, freq=freq)
+    numbers = np.arange(1, stations + 1)
+
+    # Caractéristiques fixes des stations
+    capacity = rng.integers(10, 41, stations)
+    profile = rng.choice([RESIDENTIAL, BUSINESS, MIXED], stations, p=[0.45, 0.35, 0.2])
+    base_fill = rng.uniform(0.3, 0.7, stations)
+    amplitude = rng.uniform(0.2, 0.45, stations)
+    electric_share = rng.uniform(0.2, 0.6, stations)
+    latitude = CENTER[0] + rng.uniform(-0.05, 0.05, stations)
+    longitude = CENTER[1] + rng.uniform(-0.07, 0.07, stations)
+
+    # Taux de remplissage (temps × stations)
+    hours = (times.hour + times.minute / 60).to_numpy()[:, None]
+    weekday = np.where(times.dayofweek < 5, 1.0, 0.3)[:, None]
+    commute = _peak(hours, 18, 2) - _peak(hours, 8, 1.5)
+    fill = base_fill + profile * amplitude * weekday * commute
+    fill += rng.normal(0, 0.05, (snapshots, stations))
+    bikes = np.rint(np.clip(fill, 0, 1) * capacity).astype(np.int64)
+    electrical = rng.binomial(bikes, electric_share)
+    mechanical = bikes - electrical
+
+    # Une ligne par (instant, station), instant par instant comme la collecte
+    rows = snapshots * stations
+    snapshot_time = np.repeat(times.to_numpy(), stations)
+    age = rng.integers(0, int(pd.Timedelta(freq).total_seconds()) + 1, rows)
+    last_update = snapshot_time - age.astype("timedelta64[s]")
+    status = np.where(rng.random(rows) < 0.001, "CLOSED", "OPEN")
+
+    df = pd.DataFrame(
+        {
+            "number": np.tile(numbers, snapshots),
+            "contractName": contract,
+            "name": np.tile([f"{n:05d} - STATION {n}" for n in numbers], snapshots),
+            "address": np.tile([f"{n} RUE DE TEST" for n in numbers], snapshots),
+            "banking": False,
+            "bonus": False,
+            "status": status,
+            "lastUpdate": np.datetime_as_string(last_update, unit="s"),
+            "connected": True,
+            "overflow": False,
+        }
+    )
+    df["lastUpdate"] = df["lastUpdate"] + "Z"
+
+    bikes, mechanical, electrical = (a.ravel() for a in (bikes, mechanical, electrical))
+    capacity_rows = np.tile(capacity, snapshots)
+    if nested:
+        positions = np.array(
+            [
+                f"{{'latitude': {lat:.6f}, 'longitude': {lon:.6f}}}"
+                for lat, lon in zip(latitude, longitude)
+            ],
+            dtype=object,
+        )
+        stands = _stands_strings(bikes, mechanical, electrical, capacity_rows)
+        df["position"] = np.tile(positions, snapshots)
+        df["shape"] = None
+        df["totalStands"] = stands
+        df["mainStands"] = stands
+        df["overflowStands"] = None
+        df["snapshot_time"] = snapshot_time
+        return df[CSV_COLUMNS]
+
+    df["latitude"] = np.tile(latitude.round(6), snapshots)
+    df["longitude"] = np.tile(longitude.round(6), snapshots)
+    df["bikes"] = bikes
+    df["stands"] = capacity_rows - bikes
+    df["mechanicalBikes"] = mechanical
+    df["electricalBikes"] = electrical
+    df["capacity"] = capacity_rows
+    df["snapshot_time"] = snapshot_time
+    return df
+
+
+def write_store(df, store_dir):
+    """Écrit un historique à plat (nested=False) dans le stockage en colonnes.
+
+    Le nom des fichiers reprend la période générée : des périodes successives
+    s'ajoutent au stockage, la même période réécrite remplace ses fichiers.
+    """
+    times = pd.to_datetime(df["snapshot_time"])
+    span = f"{times.min():%Y%m%dT%H%M%S}-{times.max():%Y%m%dT%H%M%S}"
+    write_table(to_schema(df), store_dir, part_name=f"synthetic-{span}")
+    return store_dir
+
+
+def main():
+    """Génère un historique synthétique (CSV ou stockage en colonnes)"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--stations", type=int, default=400)
+    parser.add_argument("--snapshots", type=int, default=288)
+    parser.add_argument("--freq", default="5min")
+    parser.add_argument("--start", default="2025-06-02")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--contract", default="toulouse")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--csv", help="fichier CSV au format de l'historique")
+    target.add_argument("--store", help="dossier du stockage en colonnes")
+    args = parser.parse_args()
+
+    df = generate_history(
+        args.stations,
+        args.snapshots,
+        args.freq,
+        args.start,
+        args.seed,
+        args.contract,
+        nested=args.csv is not None,
+    )
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+        print(f"{len(df)} lignes écrites dans {args.csv}")
+    else:
+        write_store(df, args.store)
+        print(f"{len(df)} lignes écrites dans {args.store}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les modules sont des scripts à plat dans src/, qui s'importent entre eux
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
@@ -0,0 +1,77 @@
+import os
+import glob
+
+import pytest
+
+import collect_history
+from collect_history import (
+    ChangeTracker,
+    collect_snapshot,
+    create_session,
+    run_daemon,
+)
+from history_store import read_snapshots
+from snapshot_log import SnapshotLog, log_dir
+from station_profiles import StationProfiles, profiles_path
+from stub_jcdecaux import start_stub_server
+
+ROUNDS = 3
+
+
+class StopDaemon(Exception):
+    """Interrompt le démon après quelques collectes"""
+
+
+@pytest.fixture
+def stub():
+    server, url = start_stub_server(port=0, stations=20)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def assert_single_contract_dir(store):
+    """Journal, profils, journal des snapshots et données d'un contrat sont
+    rangés ensemble dans un seul dossier, au nom normalisé"""
+    assert sorted(glob.glob(os.path.join(store, "contractName=*"))) == [
+        os.path.join(store, "contractName=toulouse")
+    ]
+    contract_dir = os.path.join(store, "contractName=toulouse")
+    assert os.path.isfile(os.path.join(contract_dir, "_snapshots.csv"))
+    assert os.path.isfile(os.path.join(contract_dir, "_profiles.npz"))
+    assert os.path.isdir(os.path.join(contract_dir, "_log"))
+    assert glob.glob(os.path.join(contract_dir, "date=*", "*.parquet"))
+    assert len(read_snapshots(store, "Toulouse")) == ROUNDS
+
+
+def test_collect_snapshot_rounds(stub, tmp_path):
+    store = str(tmp_path / "store")
+    fetch_kwargs = {"api_url": stub, "contract": "Toulouse"}
+    tracker = ChangeTracker()
+    log = SnapshotLog(log_dir(store, "Toulouse"))
+    profiles = StationProfiles.load(profiles_path(store, "Toulouse"))
+    session = create_session()
+    for _ in range(ROUNDS):
+        total, _ = collect_snapshot(
+            session, store, tracker, log=log, profiles=profiles, **fetch_kwargs
+        )
+        assert total == 20
+    assert_single_contract_dir(store)
+
+
+def test_run_daemon_rounds(stub, tmp_path, monkeypatch):
+    store = str(tmp_path / "store")
+    rounds = []
+
+    def next_delay(*args):
+        rounds.append(args)
+        if len(rounds) == ROUNDS:
+            raise StopDaemon
+        return 0
+
+    monkeypatch.setattr(collect_history, "next_delay", next_delay)
+    with pytest.raises(StopDaemon):
+        run_daemon(
+            interval=0, jitter=0, store_dir=store, api_url=stub, contract="Toulouse"
+        )
+    assert_single_contract_dir(store)